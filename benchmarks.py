@@ -0,0 +1,452 @@
+"""
+performance benchmarks for mltoolkit hot paths. run with `python benchmarks.py [group ...]`; record a baseline with
+`--save baseline.json` and check for regressions against it with `--compare baseline.json`
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# modules that must never be pulled in by `import mltoolkit` or by defining and parsing configs
+HEAVY_MODULES = ['torch', 'wandb']
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import mltoolkit
+elapsed = time.perf_counter() - start
+mltoolkit.parse_args(mltoolkit.GeneralArguments, print_args=False)
+print(json.dumps({'seconds': elapsed, 'modules': [m for m in %r if m in sys.modules]}))
+"""
+
+
+def bench_import(repeats=5):
+    """
+    measures cold `import mltoolkit` time in fresh interpreters and fails if importing mltoolkit or parsing
+    arguments pulls in heavy dependencies
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get('PYTHONPATH')])))
+    timings = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT % (HEAVY_MODULES,)], env=env, cwd=here,
+                             check=True, capture_output=True, text=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        assert not result['modules'], f'mltoolkit imported heavy modules: {result["modules"]}'
+        timings.append(result['seconds'])
+    return {'import_mltoolkit': min(timings)}
+
+
+def _timeit(fn, *args, repeats=3):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def synthetic_flat_config(num_keys, depth=3, width=10):
+    """
+    dotted-key config with `num_keys` leaves spread over `depth` levels of `width` groups each
+    """
+    config = {}
+    for i in range(num_keys):
+        parts, rest = [], i
+        for level in range(depth - 1):
+            parts.append(f'g{level}_{rest % width}')
+            rest //= width
+        parts.append(f'k{i}')
+        config['.'.join(parts)] = i
+    return config
+
+
+def synthetic_argclass(depth=3, width=4, leaves=10, name='Config'):
+    """
+    argclass tree `depth` levels deep where every level has `width` nested argclasses and `leaves` plain fields
+    """
+    from mltoolkit.argparser import argclass
+    annotations, namespace = {}, {}
+    for i in range(leaves):
+        annotations[f'f{i}'] = [int, float, str][i % 3]
+        namespace[f'f{i}'] = [i, i * 0.5, f'value{i}'][i % 3]
+    if depth > 1:
+        for i in range(width):
+            annotations[f'sub{i}'] = synthetic_argclass(depth - 1, width, leaves, name=f'{name}_{i}')
+    namespace['__annotations__'] = annotations
+    namespace['__module__'] = __name__
+    # registered on the module so that instances can be pickled
+    cls = globals()[name] = argclass(type(name, (), namespace))
+    return cls
+
+
+def _changed(value):
+    return value + 1 if type(value) is int else value * 3 if type(value) is float else value + 'x'
+
+
+def synthetic_config(arg_class):
+    """
+    nested config for `arg_class` with every leaf changed from its default
+    """
+    from mltoolkit.argparser import asdict, flatten_args, unflatten_args
+    return unflatten_args({k: _changed(v) for k, v in flatten_args(asdict(arg_class())).items()})
+
+
+def write_yaml_config(arg_class, path):
+    """
+    writes `synthetic_config(arg_class)` to the yaml file `path`
+    """
+    import yaml
+    with open(path, 'w') as f:
+        yaml.safe_dump(synthetic_config(arg_class), f, sort_keys=False)
+    return path
+
+
+def _timeit_each(fn, inputs):
+    # best time of `fn` over fresh inputs, for functions that modify their argument
+    best = float('inf')
+    for value in inputs:
+        start = time.perf_counter()
+        fn(value)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_flatten(sizes=(10_000, 100_000, 1_000_000), repeats=3):
+    """
+    measures `flatten_args` / `unflatten_args` and their in-place variants on synthetic dotted configs
+    """
+    from mltoolkit.argparser import _flatten_args, _unflatten_args, flatten_args, unflatten_args
+    results = {}
+    for size in sizes:
+        flat = synthetic_flat_config(size)
+        nested = unflatten_args(flat)
+        assert flatten_args(nested).keys() == flat.keys()
+        results[f'unflatten_args[{size}]'] = _timeit(unflatten_args, flat, repeats=repeats)
+        results[f'flatten_args[{size}]'] = _timeit(flatten_args, nested, repeats=repeats)
+        results[f'_unflatten_args[{size}]'] = _timeit_each(_unflatten_args, [dict(flat) for _ in range(repeats)])
+        results[f'_flatten_args[{size}]'] = _timeit_each(_flatten_args,
+                                                         [unflatten_args(flat) for _ in range(repeats)])
+    return results
+
+
+def bench_asdict(depth=5, width=4, leaves=10):
+    """
+    compares `asdict` and the streaming serializers against `dataclasses.asdict` on a deeply nested config
+    """
+    import dataclasses
+    import io
+    from mltoolkit.argparser import asdict
+    from mltoolkit.serialization import dump_json, dump_yaml
+    config = synthetic_argclass(depth, width, leaves)()
+    return {
+        'dataclasses.asdict': _timeit(dataclasses.asdict, config),
+        'asdict': _timeit(asdict, config),
+        'json.dump(dataclasses.asdict)': _timeit(lambda: json.dump(dataclasses.asdict(config), io.StringIO())),
+        'dump_json': _timeit(dump_json, config, io.StringIO()),
+        'dump_yaml': _timeit(dump_yaml, config, io.StringIO()),
+    }
+
+
+def bench_parse_args(depth=3, width=10, leaves=50):
+    """
+    compares the schema driven command line fast path against full argparse setup + parsing on a config with
+    depth=3, width=10, leaves=50 -> 5550 fields
+    """
+    from mltoolkit.argparser import NestedArgumentParser
+    from mltoolkit.schema import compile_schema
+    arg_class = synthetic_argclass(depth, width, leaves)
+    num_fields = len(compile_schema(arg_class).fields)
+    args = ['--sub0.f0', '3', '--sub1.sub2.f1=0.5', '--f2', 'name']
+
+    def fast_path():
+        NestedArgumentParser(arg_class).parse_args(args)
+
+    def argparse_path():
+        NestedArgumentParser(arg_class).parse_known_args(args)
+
+    return {
+        f'parse_args[fast, {num_fields} fields]': _timeit(fast_path),
+        f'parse_args[argparse, {num_fields} fields]': _timeit(argparse_path),
+    }
+
+
+def bench_parse_config(depth=3, width=10, leaves=50):
+    """
+    measures the top-level `parse_args` on a yaml config setting every field of the `bench_parse_args` config, with
+    the parsed config cache cold (first parse of a file in a process) and warm
+    """
+    import tempfile
+    from mltoolkit import config
+    from mltoolkit.argparser import parse_args
+    arg_class = synthetic_argclass(depth, width, leaves)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_yaml_config(arg_class, os.path.join(tmp, 'config.yaml'))
+        args = ['--config', path, '--sub0.f0', '3']
+        expected = arg_class(**synthetic_config(arg_class))
+        assert parse_args(arg_class, print_args=False, args=args).sub0.f1 == expected.sub0.f1
+
+        def cold():
+            config._PARSED_CONFIGS.clear()
+            config._RESOLVED_CONFIGS.clear()
+            parse_args(arg_class, print_args=False, args=args)
+
+        return {
+            f'parse_args[yaml cold, {os.path.getsize(path) // 1024} KiB]': _timeit(cold),
+            'parse_args[yaml warm]': _timeit(lambda: parse_args(arg_class, print_args=False, args=args)),
+        }
+
+
+def bench_argclass(depth=3, width=10, leaves=50):
+    """
+    measures `NestedArgumentParser` construction with the compiled schema cold and memoized, and instantiating the
+    `bench_parse_args` config from nested dictionaries
+    """
+    from mltoolkit import schema
+    from mltoolkit.argparser import NestedArgumentParser
+    arg_class = synthetic_argclass(depth, width, leaves)
+    nested = synthetic_config(arg_class)
+
+    def cold():
+        schema._SCHEMAS.clear()
+        NestedArgumentParser(arg_class)
+
+    return {
+        'NestedArgumentParser[cold schema]': _timeit(cold),
+        'NestedArgumentParser': _timeit(NestedArgumentParser, arg_class),
+        'instantiate': _timeit(lambda: arg_class(**nested)),
+        'instantiate[defaults]': _timeit(arg_class),
+    }
+
+
+def bench_validate(num_variants=100_000):
+    """
+    measures coercion of flattened sweep variants of the test config, reported per variant
+    """
+    from mltoolkit.validation import compile_validator
+    from mltoolkit.arguments import GeneralArguments
+    validator = compile_validator(GeneralArguments)
+    variants = [{'seed': str(i), 'workers': i % 8 + 1, 'no_gpu': 'false'} for i in range(num_variants)]
+
+    def validate_all():
+        for variant in variants:
+            validator.validate(variant)
+
+    return {'validate[per variant]': _timeit(validate_all) / num_variants}
+
+
+def _binary_bench_config(depth=3, width=4, leaves=10):
+    # every leaf is changed from its default
+    arg_class = synthetic_argclass(depth, width, leaves, name='BinaryConfig')
+    return arg_class, arg_class(**synthetic_config(arg_class))
+
+
+def bench_binary(repeats=1000):
+    """
+    compares `dumps` / `loads` against pickle and json on a config of 210 non-default fields, reported per call
+    """
+    import pickle
+    from mltoolkit.argparser import asdict
+    from mltoolkit.serialization import dumps, loads
+    arg_class, config = _binary_bench_config()
+    binary, pickled, encoded = dumps(config), pickle.dumps(config), json.dumps(asdict(config))
+    assert loads(binary, arg_class) == config
+
+    def per_call(fn, *args):
+        return _timeit(lambda: [fn(*args) for _ in range(repeats)]) / repeats
+
+    return {
+        'dumps': per_call(dumps, config),
+        'loads': per_call(loads, binary, arg_class),
+        'pickle.dumps': per_call(pickle.dumps, config),
+        'pickle.loads': per_call(pickle.loads, pickled),
+        'json.dumps(asdict)': per_call(lambda: json.dumps(asdict(config))),
+        'arg_class(**json.loads)': per_call(lambda: arg_class(**json.loads(encoded))),
+    }
+
+
+def binary_sizes():
+    """
+    encoded size in bytes of the `bench_binary` config
+    """
+    import pickle
+    from mltoolkit.argparser import asdict
+    from mltoolkit.serialization import dumps
+    _, config = _binary_bench_config()
+    return {
+        'dumps': len(dumps(config)),
+        'pickle.dumps': len(pickle.dumps(config)),
+        'json.dumps(asdict)': len(json.dumps(asdict(config))),
+    }
+
+
+CONV_ARCHITECTURE = [
+    {'Conv2d': {'args': [3, 32, 3], 'padding': 1}}, {'BatchNorm2d': {'args': [32]}}, {'ReLU': None},
+    {'Conv2d': {'args': [32, 32, 3], 'padding': 1}}, {'BatchNorm2d': {'args': [32]}}, {'ReLU': None},
+    {'Conv2d': {'args': [32, 32, 1]}}, {'BatchNorm2d': {'args': [32]}}, {'ReLU': None},
+    {'Flatten': None}, {'Linear': {'args': [32 * 32 * 32, 128]}}, {'BatchNorm1d': {'args': [128]}}, {'ReLU': None},
+    {'Dropout': {'p': 0.1}}, {'Linear': {'args': [128, 10]}},
+]
+
+
+def bench_fusion(batch_size=32, repeats=50):
+    """
+    cpu inference latency of a conv -> batch norm -> relu network with and without `fuse_network`
+    """
+    import torch
+    from mltoolkit.network_builder import build_network
+    from mltoolkit.network_fusion import check_fusion, fuse_network
+    network = build_network(CONV_ARCHITECTURE)
+    with torch.no_grad():
+        # non-trivial running statistics
+        network(torch.randn(64, 3, 32, 32))
+    fused = fuse_network(network)
+    x = torch.randn(batch_size, 3, 32, 32)
+    check_fusion(network, fused, x)
+
+    # interleaved so that both networks see the same machine load, median per call
+    timings = {'forward': [], 'forward[fuse]': []}
+    with torch.no_grad():
+        for _ in range(repeats):
+            for name, module in (('forward', network), ('forward[fuse]', fused)):
+                start = time.perf_counter()
+                module(x)
+                timings[name].append(time.perf_counter() - start)
+    return {name: statistics.median(times) for name, times in timings.items()}
+
+
+def bench_build_network(repeats=5):
+    """
+    measures `build_network` construction (layer instantiation and weight initialization) of the `bench_fusion`
+    network and a deep MLP, on the cpu and on the meta device
+    """
+    import torch
+    from mltoolkit.network_builder import build_network
+    mlp = [block for _ in range(32) for block in ({'Linear': {'args': [512, 512]}}, {'ReLU': None})]
+    torch.manual_seed(0)
+    return {
+        'build_network[conv]': _timeit(build_network, CONV_ARCHITECTURE, repeats=repeats),
+        'build_network[conv, meta]': _timeit(lambda: build_network(CONV_ARCHITECTURE, device='meta'),
+                                             repeats=repeats),
+        'build_network[mlp 32x512]': _timeit(build_network, mlp, repeats=repeats),
+        'build_network[mlp 32x512, meta]': _timeit(lambda: build_network(mlp, device='meta'), repeats=repeats),
+    }
+
+
+# group name -> benchmark(options) returning {name: seconds}; results are keyed `group/name`
+BENCHMARKS = {
+    'import': lambda options: bench_import(),
+    'flatten': lambda options: bench_flatten(),
+    'asdict': lambda options: bench_asdict(),
+    'parse_args': lambda options: bench_parse_args(options.depth, options.width, options.leaves),
+    'parse_config': lambda options: bench_parse_config(options.depth, options.width, options.leaves),
+    'argclass': lambda options: bench_argclass(options.depth, options.width, options.leaves),
+    'validate': lambda options: bench_validate(),
+    'binary': lambda options: bench_binary(),
+    'build_network': lambda options: bench_build_network(),
+    'fusion': lambda options: bench_fusion(),
+}
+
+# group name -> function returning {name: bytes}
+SIZES = {
+    'binary_size': binary_sizes,
+}
+
+
+def run(groups, options):
+    """
+    runs the benchmark `groups`
+    :return: {'seconds': {group/name: seconds}, 'bytes': {group/name: size}}
+    """
+    results = {'seconds': {}, 'bytes': {}}
+    for group in groups:
+        if group in BENCHMARKS:
+            timings = BENCHMARKS[group](options)
+            results['seconds'].update((f'{group}/{name}', seconds) for name, seconds in timings.items())
+        else:
+            results['bytes'].update((f'{group}/{name}', size) for name, size in SIZES[group]().items())
+    return results
+
+
+def _format_seconds(seconds):
+    if seconds >= 1e-3:
+        return f'{seconds * 1e3:10.3f} ms'
+    return f'{seconds * 1e6:10.3f} us'
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    compares `results` against `baseline` (both as returned by `run`)
+    @param tolerance: relative slowdown (or size increase) that counts as a regression
+    :return: names of the regressed benchmarks
+    """
+    regressions = []
+    for unit, values in results.items():
+        base_values = baseline.get(unit, {})
+        for name, value in values.items():
+            base = base_values.get(name)
+            if base is None:
+                print(f'{name:<50} {"new":>12}')
+                continue
+            ratio = value / base if base else float('inf') if value else 1.
+            regressed = ratio > 1 + tolerance
+            if regressed:
+                regressions.append(name)
+            current = _format_seconds(value) if unit == 'seconds' else f'{value:10d} B '
+            print(f'{name:<50} {current}  x{ratio:5.2f}{"  REGRESSION" if regressed else ""}')
+    return regressions
+
+
+def main(argv=None):
+    import argparse
+    import platform
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('groups', nargs='*', metavar='group',
+                        help=f'benchmark groups to run (default: all): {", ".join([*BENCHMARKS, *SIZES])}')
+    parser.add_argument('--save', metavar='FILE', help='write the results to a json baseline file')
+    parser.add_argument('--compare', metavar='FILE', help='compare against a json baseline; exits with status 1 '
+                                                          'if any benchmark regressed')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative slowdown that counts as a regression in --compare mode')
+    parser.add_argument('--depth', type=int, default=3, help='depth of the synthetic argclass tree')
+    parser.add_argument('--width', type=int, default=10, help='nested argclasses per level')
+    parser.add_argument('--leaves', type=int, default=50, help='plain fields per level')
+    options = parser.parse_args(argv)
+    unknown = [group for group in options.groups if group not in BENCHMARKS and group not in SIZES]
+    if unknown:
+        parser.error(f'unknown benchmark groups: {", ".join(unknown)}')
+
+    # measure the in-process paths, not persistent caches left behind by other runs
+    for env in ('MLTOOLKIT_CONFIG_CACHE', 'MLTOOLKIT_SCHEMA_CACHE', 'MLTOOLKIT_NETWORK_CACHE'):
+        os.environ.pop(env, None)
+
+    results = run(options.groups or [*BENCHMARKS, *SIZES], options)
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], tolerance=options.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regression(s) against {options.compare}: {", ".join(regressions)}')
+    else:
+        regressions = []
+        for name, seconds in results['seconds'].items():
+            print(f'{name:<50} {_format_seconds(seconds)}')
+        for name, size in results['bytes'].items():
+            print(f'{name:<50} {size:10d} B')
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'fixture': {'depth': options.depth, 'width': options.width, 'leaves': options.leaves},
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'results': results,
+            }, f, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
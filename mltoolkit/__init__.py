@@ -1,3 +1,36 @@
+import importlib
+
 from mltoolkit.argparser import parse_args, parse_config, argclass, asdict
 from mltoolkit.arguments import GeneralArguments, WandBArguments, DataUseArguments
-from mltoolkit.util import init_wandb, download_dataset, log_dataset_reference
+from mltoolkit.config import compose_config
+from mltoolkit.serialization import dump_json, dump_yaml, dumps, fingerprint, loads
+from mltoolkit.sweep import sweep
+
+# public names whose modules pull in heavy dependencies (wandb, torch, multiprocessing). these are only imported on first access
+# so that `import mltoolkit` stays cheap for launchers, sweep workers and `--help`
+_LAZY_ATTRS = {
+    'init_wandb': 'mltoolkit.util',
+    'download_dataset': 'mltoolkit.util',
+    'log_dataset_reference': 'mltoolkit.util',
+    'fix_seeds': 'mltoolkit.util',
+    'build_network': 'mltoolkit.network_builder',
+    'Builder': 'mltoolkit.network_builder',
+    'launch': 'mltoolkit.launcher',
+}
+
+__all__ = ['parse_args', 'parse_config', 'compose_config', 'argclass', 'asdict',
+           'GeneralArguments', 'WandBArguments', 'DataUseArguments', 'sweep', 'dump_json', 'dump_yaml', 'fingerprint',
+           'dumps', 'loads',
+           *_LAZY_ATTRS]
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        value = getattr(importlib.import_module(_LAZY_ATTRS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
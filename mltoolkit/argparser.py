@@ -5,19 +5,21 @@ import dataclasses
 import functools
 import json
 import os
+import re
 import sys
-import typing
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser, ArgumentTypeError
 from copy import copy
 import dataclasses
-from enum import Enum
-from inspect import isclass
 from pathlib import Path
-from typing import Any, Dict, NewType, Optional, Tuple, Union, get_type_hints
+from typing import Any, NewType, Tuple
 
-import yaml
 from rich.pretty import pprint
 
+from mltoolkit.config import compose_config, flatten_args, parse_config, unflatten_args
+from mltoolkit.distributed import process_info, share_result
+from mltoolkit.schema import FieldSpec, compile_schema
+from mltoolkit.validation import compile_validator
+
 DataClass = NewType("DataClass", Any)
 DataClassType = NewType("DataClassType", Any)
 
@@ -26,37 +28,28 @@ def _is_argclass(obj):
     return hasattr(obj, '_ARGCLASS')
 
 
+def _is_argclass_instance(obj):
+    return hasattr(obj, '_ARGCLASS') and not isinstance(obj, type)
+
+
 def _flatten_args(json):
+    """
+    in-place variant of `flatten_args`
+    """
     if type(json) == dict:
-        for k, v in list(json.items()):
-            if type(v) == dict:
-                _flatten_args(v)
-                json.pop(k)
-                for k2, v2 in v.items():
-                    json[k + "." + k2] = v2
+        flat = flatten_args(json)
+        json.clear()
+        json.update(flat)
 
 
 def _unflatten_args(json):
+    """
+    in-place variant of `unflatten_args`
+    """
     if type(json) == dict:
-        for k in sorted(json.keys(), reverse=True):
-            if "." in k:
-                key_parts = k.split(".")
-                json1 = json
-                for i in range(0, len(key_parts) - 1):
-                    k1 = key_parts[i]
-                    if k1 in json1:
-                        json1 = json1[k1]
-                        if type(json1) != dict:
-                            conflicting_key = ".".join(key_parts[0:i + 1])
-                            raise Exception('Key "{}" conflicts with key "{}"'.format(
-                                k, conflicting_key))
-                    else:
-                        json2 = dict()
-                        json1[k1] = json2
-                        json1 = json2
-                if type(json1) == dict:
-                    v = json.pop(k)
-                    json1[key_parts[-1]] = v
+        nested = unflatten_args(json)
+        json.clear()
+        json.update(nested)
 
 
 # From https://stackoverflow.com/questions/15008758/parsing-boolean-values-with-argparse
@@ -73,69 +66,360 @@ def _string_to_bool(v):
         )
 
 
+_FIELD_NAMES = {}
+
+
+def _field_names(cls):
+    """
+    names of all dataclass fields of `cls`, including the ones inherited from base classes
+    """
+    names = _FIELD_NAMES.get(cls)
+    if names is None:
+        names = _FIELD_NAMES[cls] = tuple(f.name for f in dataclasses.fields(cls))
+    return names
+
+
 def asdict(c):
-    if not _is_argclass(c):
+    """
+    converts an argclass into nested dictionaries. unlike `dataclasses.asdict` values are not copied: only
+    argclasses, and lists / dicts holding argclasses, are converted, every other value is shared with `c`
+    """
+    if not _is_argclass_instance(c):
         return c
-    d = {}
-    for name, field_type in c.__annotations__.items():
-        val = getattr(c, name, None)
-        # special cases for when field is argclass, list, dict, val
-        if _is_argclass(field_type):
-            d[name] = asdict(val)
-        elif type(val) is list:
-            d[name] = [asdict(item) for item in val]
-        elif type(val) is dict:
-            d[name] = {k: asdict(v) for k, v in val.items()}
-        else:
-            d[name] = val
-    return d
+    root = {}
+    stack = [(c, root)]
+    while stack:
+        obj, d = stack.pop()
+        for name in _field_names(type(obj)):
+            val = getattr(obj, name, None)
+            # special cases for when field is argclass, list, dict, val
+            if _is_argclass_instance(val):
+                d[name] = {}
+                stack.append((val, d[name]))
+            elif type(val) is list and any(_is_argclass_instance(item) for item in val):
+                d[name] = list(val)
+                for i, item in enumerate(val):
+                    if _is_argclass_instance(item):
+                        d[name][i] = {}
+                        stack.append((item, d[name][i]))
+            elif type(val) is dict and any(_is_argclass_instance(item) for item in val.values()):
+                d[name] = dict(val)
+                for k, item in val.items():
+                    if _is_argclass_instance(item):
+                        d[name][k] = {}
+                        stack.append((item, d[name][k]))
+            else:
+                d[name] = val
+    return root
+
+
+def _nested_decoder(field_type):
+    """
+    returns how values of `field_type` are decoded into argclasses ('argclass', 'dict' or 'list') and the argclass
+    to decode into, or None if the field holds no nested argclasses
+    """
+    if _is_argclass(field_type):
+        return 'argclass', field_type
+    origin = getattr(field_type, '__origin__', None)
+    field_args = getattr(field_type, '__args__', None) or ()
+    if origin is dict and len(field_args) == 2 and _is_argclass(field_args[1]):
+        return 'dict', field_args[1]
+    if origin is list and len(field_args) == 1 and _is_argclass(field_args[0]):
+        return 'list', field_args[0]
+    return None
+
+
+# condition and decoded value of every kind of nested argclass field
+_DECODE_TEMPLATES = {
+    'argclass': ("type(self.{name}) is dict", "{cls}(**self.{name})"),
+    'dict': ("self.{name} is not None", "{{k: {cls}(**v) if type(v) is dict else v for k, v in self.{name}.items()}}"),
+    'list': ("self.{name} is not None", "[{cls}(**v) if type(v) is dict else v for v in self.{name}]"),
+}
+
+
+def _create_post_init(cls, original_post_init, frozen=False):
+    """
+    generates a `__post_init__` for `cls` that decodes dictionaries only for the fields holding nested argclasses,
+    so that instantiation cost doesn't depend on the number of plain fields. returns None if there is nothing to decode
+    """
+    lines = []
+    namespace = {'_setattr': object.__setattr__}
+    for name, field_type in cls.__annotations__.items():
+        decoder = _nested_decoder(field_type)
+        if decoder is None:
+            continue
+        kind, field_argclass = decoder
+        namespace[f'_cls_{name}'] = field_argclass
+        condition, value = _DECODE_TEMPLATES[kind]
+        value = value.format(name=name, cls=f'_cls_{name}')
+        # frozen dataclasses can only be initialized through object.__setattr__
+        assignment = f"_setattr(self, '{name}', {value})" if frozen else f"self.{name} = {value}"
+        lines.append(f"    if {condition.format(name=name)}:\n        {assignment}\n")
+
+    if not lines:
+        return None
+    if original_post_init is not None and callable(original_post_init):
+        namespace['_original_post_init'] = original_post_init
+        lines.append("    _original_post_init(self)\n")
+
+    source = "def __post_init__(self):\n" + "".join(lines)
+    exec(source, namespace)
+    post_init = namespace['__post_init__']
+    post_init.__qualname__ = f'{cls.__qualname__}.__post_init__'
+    if '_original_post_init' in namespace:
+        post_init.__wrapped__ = original_post_init
+    return post_init
+
+
+_HASH_FIELD_NAMES = {}
+
+# attribute caching the structural hash of frozen argclasses
+_HASH_ATTR = '_argclass_hash'
+
+
+def _hashable(value):
+    if type(value) is list or type(value) is tuple:
+        return tuple(_hashable(item) for item in value)
+    if type(value) is dict:
+        return frozenset((k, _hashable(v)) for k, v in value.items())
+    if type(value) is set:
+        return frozenset(value)
+    return value
+
+
+def _argclass_hash(self):
+    """
+    structural hash of a frozen argclass over its public fields, computed once per instance
+    """
+    try:
+        return getattr(self, _HASH_ATTR)
+    except AttributeError:
+        pass
+    cls = type(self)
+    names = _HASH_FIELD_NAMES.get(cls)
+    if names is None:
+        names = _HASH_FIELD_NAMES[cls] = tuple(f.name for f in dataclasses.fields(cls)
+                                               if f.compare and not f.name.startswith('_'))
+    value = hash((cls.__qualname__, tuple(_hashable(getattr(self, name)) for name in names)))
+    object.__setattr__(self, _HASH_ATTR, value)
+    return value
+
+
+def _argclass_getstate(self):
+    # the cached hash is left out on purpose: string hashes differ between processes
+    return [getattr(self, name) for name in _field_names(type(self))]
+
+
+def _argclass_setstate(self, state):
+    for name, value in zip(_field_names(type(self)), state):
+        object.__setattr__(self, name, value)
+
+
+def _rebind_class_cell(value, old_cls, new_cls):
+    """
+    points the `__class__` closure cell of a method (used by zero-argument `super()`) at `new_cls`, like
+    `dataclasses` does for `slots=True`
+    """
+    if isinstance(value, (classmethod, staticmethod)):
+        value = value.__func__
+    if isinstance(value, property):
+        for accessor in (value.fget, value.fset, value.fdel):
+            _rebind_class_cell(accessor, old_cls, new_cls)
+        return
+    while value is not None:
+        code = getattr(value, '__code__', None)
+        if code is not None and '__class__' in code.co_freevars:
+            cell = value.__closure__[code.co_freevars.index('__class__')]
+            if cell.cell_contents is old_cls:
+                cell.cell_contents = new_cls
+        # generated `__post_init__`s wrap the one defined on the class
+        value = getattr(value, '__wrapped__', None)
+
+
+def _add_slots(cls, extra_slots=()):
+    """
+    re-creates dataclass `cls` with `__slots__` for its fields, so instances carry no `__dict__`
+    """
+    cls_dict = dict(cls.__dict__)
+    inherited_slots = set()
+    for base in cls.__mro__[1:-1]:
+        base_slots = base.__dict__.get('__slots__', ())
+        inherited_slots.update([base_slots] if isinstance(base_slots, str) else base_slots)
+    field_names = tuple(f.name for f in dataclasses.fields(cls))
+    cls_dict['__slots__'] = tuple(name for name in (*field_names, *extra_slots) if name not in inherited_slots)
+    for name in field_names:
+        # remove default values, which would conflict with the slot descriptors
+        cls_dict.pop(name, None)
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+    new_cls = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    new_cls.__qualname__ = cls.__qualname__
+    for value in cls_dict.values():
+        _rebind_class_cell(value, cls, new_cls)
+    return new_cls
+
+
+def _check_frozen(cls):
+    """
+    frozen argclasses are hashed by value with a cached hash, so all of their fields must be immutable as well
+    """
+    for base in cls.__mro__[1:]:
+        params = base.__dict__.get('__dataclass_params__')
+        if params is not None and not params.frozen:
+            raise TypeError(f'frozen argclass {cls.__qualname__} can\'t inherit from non-frozen {base.__qualname__}; '
+                            f'declare {base.__qualname__} with @argclass(frozen=True) or drop frozen=True')
+    for name, field_type in cls.__dict__.get('__annotations__', {}).items():
+        decoder = _nested_decoder(field_type)
+        if decoder is None:
+            continue
+        params = getattr(decoder[1], '__dataclass_params__', None)
+        if params is not None and not params.frozen:
+            raise TypeError(f'frozen argclass {cls.__qualname__} can\'t hold non-frozen argclass '
+                            f'{decoder[1].__qualname__} in field "{name}"; declare {decoder[1].__qualname__} with '
+                            f'@argclass(frozen=True)')
 
 
 def argclass(*args, **kwargs):
     """
-    wrapper to create arg class
+    wrapper to create arg class. keyword arguments are passed on to `dataclasses.dataclass`, in addition
+    `slots=True` stores fields in `__slots__` instead of a per-instance `__dict__` (on every python version) and
+    `frozen=True` makes instances immutable and hashable with a cached structural hash
     """
+    slots = kwargs.pop('slots', False)
+    frozen = kwargs.get('frozen', False)
 
     def decorator(cls):
+        if frozen:
+            _check_frozen(cls)
         if not hasattr(cls, '_ARGCLASS'):
             cls._ARGCLASS = True
         # update argument annotations if there are any
         for name, field_type in cls.__annotations__.items():
             if _is_argclass(field_type) and getattr(cls, name, None) is None:
-                setattr(cls, name, field_type())
-
-        # decode dictionaries into argument classes through post init
-        original_post_init = getattr(cls, '__post_init__', None)
-
-        def __post_init__(self):
-            for name, field_type in cls.__annotations__.items():
-                field_value = getattr(self, name, None)
-                if _is_argclass(field_type) and type(field_value) is dict:
-                    setattr(self, name, field_type(**field_value))
-                # handle cases where field type is a dict
-                if type(field_type) == typing._GenericAlias and field_type._name == 'Dict' and _is_argclass(
-                        field_type.__args__[1]):
-                    field_argclass = field_type.__args__[1]
-                    for key, value in field_value.items():
-                        field_value[key] = field_argclass(**value)
-                elif type(field_type) == typing._GenericAlias and field_type._name == 'List' and _is_argclass(
-                        field_type.__args__[0]):
-                    field_argclass = field_type.__args__[0]
-                    if field_value is not None:
-                        for i in range(len(field_value)):
-                            field_value[i] = field_argclass(**field_value[i])
-
-            if original_post_init is not None and callable(original_post_init):
-                original_post_init(self)
-
-        cls.__post_init__ = __post_init__
+                setattr(cls, name, dataclasses.field(default_factory=field_type))
+
+        # decode dictionaries into argument classes through a post init generated for this class
+        post_init = _create_post_init(cls, getattr(cls, '__post_init__', None), frozen=frozen)
+        if post_init is not None:
+            cls.__post_init__ = post_init
 
         cls = dataclasses.dataclass(cls, **kwargs)
+        if frozen:
+            cls.__hash__ = _argclass_hash
+            cls.__getstate__ = _argclass_getstate
+            cls.__setstate__ = _argclass_setstate
+        if slots:
+            cls = _add_slots(cls, extra_slots=(_HASH_ATTR,) if frozen else ())
         return cls
 
     return decorator(args[0]) if args else decorator
 
 
+def _field_arguments(spec: FieldSpec):
+    """
+    argparse flags and kwargs for a schema field: `--path`, plus `--parent.no_name` for booleans defaulting to True
+    """
+    field_name = f"--{spec.path}"
+    # field.metadata is not used at all by Data Classes,
+    # it is provided as a third-party extension mechanism.
+    kwargs = spec.metadata.copy()
+
+    # A variable to store kwargs for a boolean field, if needed
+    # so that we can init a `no_*` complement argument (see below)
+    bool_kwargs = {}
+    if spec.kind == 'enum':
+        kwargs["choices"] = [x.value for x in spec.type]
+        kwargs["type"] = type(kwargs["choices"][0])
+        if spec.default is not dataclasses.MISSING:
+            kwargs["default"] = spec.default
+        else:
+            kwargs["required"] = True
+    elif spec.kind == 'bool':
+        # Copy the currect kwargs to use to instantiate a `no_*` complement argument below.
+        # We do not initialize it here because the `no_*` alternative must be instantiated after the real argument
+        bool_kwargs = copy(kwargs)
+
+        # Hack because type=bool in argparse does not behave as we want.
+        kwargs["type"] = _string_to_bool
+        if spec.type is bool or (spec.default is not None and spec.default is not dataclasses.MISSING):
+            # Default value is False if we have no default when of type bool.
+            default = False if spec.default is dataclasses.MISSING else spec.default
+            # This is the value that will get picked if we don't include --field_name in any way
+            kwargs["default"] = default
+            # This tells argparse we accept 0 or 1 value after --field_name
+            kwargs["nargs"] = "?"
+            # This is the value that will get picked if we do --field_name (without value)
+            kwargs["const"] = True
+    elif spec.kind == 'list':
+        kwargs["type"] = spec.type.__args__[0]
+        kwargs["nargs"] = "+"
+        if spec.default_factory is not dataclasses.MISSING:
+            kwargs["default_factory"] = spec.default_factory
+        elif spec.default is dataclasses.MISSING:
+            kwargs["required"] = True
+    else:
+        kwargs["type"] = spec.type
+        if spec.required:
+            kwargs["required"] = True
+        elif spec.default_factory is not dataclasses.MISSING:
+            kwargs["default_factory"] = spec.default_factory
+        else:
+            kwargs["default"] = spec.default
+
+    arguments = [(field_name, kwargs)]
+
+    # Add a complement `no_*` argument for a boolean field AFTER the initial field has already been added.
+    # Order is important for arguments with the same destination!
+    # We use a copy of earlier kwargs because the original kwargs have changed a lot before reaching down
+    # here and we do not need those changes/additional keys.
+    if spec.default is True and spec.kind == 'bool':
+        parent = spec.path[:-len(spec.name)]
+        bool_kwargs["default"] = False
+        arguments.append((f"--{parent}no_{spec.name}", dict(bool_kwargs, action="store_false", dest=spec.path)))
+    return arguments
+
+
+_ARGUMENT_TABLES = {}
+_FLAG_TABLES = {}
+
+
+def _argument_table(schema):
+    """
+    (flag, argument group, argparse kwargs) of every field of `schema`, memoized per class. fields with a
+    `default_factory` keep the factory under the `default_factory` key, so every parse gets a fresh default
+    """
+    table = _ARGUMENT_TABLES.get(schema.dataclass_type)
+    if table is None:
+        table = _ARGUMENT_TABLES[schema.dataclass_type] = [
+            (flag, spec.group, kwargs) for spec in schema.fields.values() for flag, kwargs in _field_arguments(spec)]
+    return table
+
+
+# same as argparse: tokens like `-1` or `-.5` are values, not flags
+_NEGATIVE_NUMBER = re.compile(r'^-\d+$|^-\d*\.\d+$')
+
+
+def _is_flag(token):
+    return token.startswith('-') and token != '-' and not _NEGATIVE_NUMBER.match(token)
+
+
+class _UseArgparse(Exception):
+    """
+    raised by the fast command line path for input that has to go through argparse
+    """
+
+
+def _convert_argument(kwargs, value):
+    convert = kwargs.get('type')
+    try:
+        value = convert(value) if convert is not None else value
+    except (TypeError, ValueError, ArgumentTypeError):
+        raise _UseArgparse()
+    if 'choices' in kwargs and value not in kwargs['choices']:
+        raise _UseArgparse()
+    return value
+
+
 # Modified from HfArgumentParser
 class NestedArgumentParser(ArgumentParser):
     """
@@ -160,150 +444,163 @@ class NestedArgumentParser(ArgumentParser):
             kwargs["formatter_class"] = ArgumentDefaultsHelpFormatter
         super().__init__(**kwargs)
         self.dataclass_type = dataclass_type
+        self.schema = compile_schema(dataclass_type)
         self.required_args = required_args
         if self.required_args is None:
             self.required_args = []
 
+        self._config_flags = ()
         if not hasattr(dataclass_type, 'config'):
+            self._config_flags = ("-c", "--config")
             self.add_argument(
                 "-c", "--config", dest="config", action="store", help="config file", required=False
             )
+        # actions of the parser itself (help, config and the dataclass fields); anything beyond these was added by
+        # the caller
+        self._num_own_actions = len(self._actions)
+        self._dataclass_arguments_added = False
 
-        self._add_dataclass_arguments(self.dataclass_type)
-
-    def _parse_dataclass_field(self, parser: ArgumentParser, field: dataclasses.Field, parent=None):
-        # fold parent name into field for nested arguments
-        if parent is None:
-            parent = ''
-        else:
-            parent = f'{parent}.'
-
-        # ignore arguments with _ in beginning
-        if field.name.startswith('_'):
+    def _add_dataclass_arguments(self):
+        """
+        adds an argparse action for every field. deferred until argparse is actually needed (`--help`, errors or
+        arguments the fast path doesn't understand)
+        """
+        if self._dataclass_arguments_added:
             return
-        field_name = f"--{parent}{field.name}"
-        kwargs = field.metadata.copy()
-        # field.metadata is not used at all by Data Classes,
-        # it is provided as a third-party extension mechanism.
-        if isinstance(field.type, str):
-            raise RuntimeError(
-                "Unresolved type detected, which should have been done with the help of "
-                "`typing.get_type_hints` method by default"
-            )
-
-        origin_type = getattr(field.type, "__origin__", field.type)
-        if origin_type is Union:
-            if str not in field.type.__args__ and (
-                    len(field.type.__args__) != 2 or type(None) not in field.type.__args__
-            ):
-                raise ValueError(
-                    "Only `Union[X, NoneType]` (i.e., `Optional[X]`) is allowed for `Union` because"
-                    " the argument parser only supports one type per argument."
-                    f" Problem encountered in field '{field.name}'."
-                )
-            if type(None) not in field.type.__args__:
-                # filter `str` in Union
-                field.type = field.type.__args__[0] if field.type.__args__[1] == str else field.type.__args__[1]
-                origin_type = getattr(field.type, "__origin__", field.type)
-            elif bool not in field.type.__args__:
-                # filter `NoneType` in Union (except for `Union[bool, NoneType]`)
-                field.type = (
-                    field.type.__args__[0] if isinstance(None, field.type.__args__[1]) else field.type.__args__[1]
-                )
-                origin_type = getattr(field.type, "__origin__", field.type)
-
-        # A variable to store kwargs for a boolean field, if needed
-        # so that we can init a `no_*` complement argument (see below)
-        bool_kwargs = {}
-        if isinstance(field.type, type) and issubclass(field.type, Enum):
-            kwargs["choices"] = [x.value for x in field.type]
-            kwargs["type"] = type(kwargs["choices"][0])
-            if field.default is not dataclasses.MISSING:
-                kwargs["default"] = field.default
+        self._dataclass_arguments_added = True
+        num_actions = len(self._actions)
+        groups = {}
+        for flag, group, kwargs in _argument_table(self.schema):
+            if group is None:
+                parser = self
             else:
-                kwargs["required"] = True
-        elif dataclasses.is_dataclass(field.type):
-            self._add_dataclass_arguments(field.type, parent=f'{parent}{field.name}')
-            return
-        elif field.type is bool or field.type == Optional[bool]:
-            # Copy the currect kwargs to use to instantiate a `no_*` complement argument below.
-            # We do not initialize it here because the `no_*` alternative must be instantiated after the real argument
-            bool_kwargs = copy(kwargs)
-
-            # Hack because type=bool in argparse does not behave as we want.
-            kwargs["type"] = _string_to_bool
-            if field.type is bool or (field.default is not None and field.default is not dataclasses.MISSING):
-                # Default value is False if we have no default when of type bool.
-                default = False if field.default is dataclasses.MISSING else field.default
-                # This is the value that will get picked if we don't include --field_name in any way
-                kwargs["default"] = default
-                # This tells argparse we accept 0 or 1 value after --field_name
-                kwargs["nargs"] = "?"
-                # This is the value that will get picked if we do --field_name (without value)
-                kwargs["const"] = True
-        elif isclass(origin_type) and issubclass(origin_type, list):
-            kwargs["type"] = field.type.__args__[0]
-            kwargs["nargs"] = "+"
-            if field.default_factory is not dataclasses.MISSING:
-                kwargs["default"] = field.default_factory()
-            elif field.default is dataclasses.MISSING:
-                kwargs["required"] = True
-        else:
-            kwargs["type"] = field.type
-            if field.default is not dataclasses.MISSING:
-                kwargs["default"] = field.default
-            elif field.default_factory is not dataclasses.MISSING:
-                kwargs["default"] = field.default_factory()
+                if group not in groups:
+                    groups[group] = self.add_argument_group(group)
+                parser = groups[group]
+            kwargs = dict(kwargs)
+            if 'default_factory' in kwargs:
+                kwargs['default'] = kwargs.pop('default_factory')()
+            if flag in self.required_args:
+                kwargs['required'] = True
+            parser.add_argument(flag, **kwargs)
+        self._num_own_actions += len(self._actions) - num_actions
+
+    def parse_known_args(self, args=None, namespace=None):
+        self._add_dataclass_arguments()
+        return super().parse_known_args(args=args, namespace=namespace)
+
+    def format_usage(self):
+        self._add_dataclass_arguments()
+        return super().format_usage()
+
+    def format_help(self):
+        self._add_dataclass_arguments()
+        return super().format_help()
+
+    def _flag_table(self):
+        """
+        command line flag -> (destination, argparse kwargs) of every flag the fast path understands, memoized per class
+        """
+        flags = _FLAG_TABLES.get(self.dataclass_type)
+        if flags is None:
+            flags = _FLAG_TABLES[self.dataclass_type] = {flag: ('config', {}) for flag in self._config_flags}
+            for flag, _, kwargs in _argument_table(self.schema):
+                flags[flag] = (kwargs.get('dest', flag[2:]), kwargs)
+        return flags
+
+    def _fast_parse(self, args):
+        """
+        parses `--a.b.c value`, `--a.b.c=value` and `--no_x` overrides straight from the compiled schema without
+        building any argparse actions. raises `_UseArgparse` for anything it can't handle exactly like argparse
+        (help, unknown or abbreviated flags, invalid values, missing required arguments)
+        :return: (namespace dict, list of entered destinations, unrecognized arguments)
+        """
+        flags = self._flag_table()
+        values = {}
+        entered = []
+        remaining = []
+        i = 0
+        while i < len(args):
+            token = args[i]
+            i += 1
+            if token == '--':
+                raise _UseArgparse()
+            if not _is_flag(token):
+                remaining.append(token)
+                continue
+            flag, has_value, value = token.partition('=')
+            if flag not in flags:
+                raise _UseArgparse()
+            dest, kwargs = flags[flag]
+            nargs = kwargs.get('nargs')
+            if kwargs.get('action') == 'store_false':
+                if has_value:
+                    raise _UseArgparse()
+                values[dest] = False
+            elif nargs == '+':
+                items = [value] if has_value else []
+                while not has_value and i < len(args) and not _is_flag(args[i]):
+                    items.append(args[i])
+                    i += 1
+                if not items:
+                    raise _UseArgparse()
+                values[dest] = [_convert_argument(kwargs, item) for item in items]
+            elif has_value or (i < len(args) and not _is_flag(args[i])):
+                if not has_value:
+                    value = args[i]
+                    i += 1
+                values[dest] = _convert_argument(kwargs, value)
+            elif nargs == '?':
+                values[dest] = kwargs['const']
             else:
-                kwargs["required"] = True
-
-        if field_name in self.required_args:
-            kwargs['required'] = True
-        parser.add_argument(field_name, **kwargs)
-
-        # Add a complement `no_*` argument for a boolean field AFTER the initial field has already been added.
-        # Order is important for arguments with the same destination!
-        # We use a copy of earlier kwargs because the original kwargs have changed a lot before reaching down
-        # here and we do not need those changes/additional keys.
-        if field.default is True and (field.type is bool or field.type == Optional[bool]):
-            bool_kwargs["default"] = False
-            parser.add_argument(f"--{parent}no_{field.name}", action="store_false", dest=f"{parent}{field.name}",
-                                **bool_kwargs)
-
-    def _add_dataclass_arguments(self, dtype: DataClassType, parent=None):
-        if hasattr(dtype, "_argument_group_name"):
-            parser = self.add_argument_group(dtype._argument_group_name)
-        else:
-            parser = self
-
-        try:
-            type_hints: Dict[str, type] = get_type_hints(dtype)
-        except NameError:
-            raise RuntimeError(
-                f"Type resolution failed for f{dtype}. Try declaring the class in global scope or "
-                "removing line of `from __future__ import annotations` which opts in Postponed "
-                "Evaluation of Annotations (PEP 563)"
-            )
+                raise _UseArgparse()
+            entered.append(dest)
 
-        for field in dataclasses.fields(dtype):
-            if not field.init:
+        # fill in defaults in flag order; the first flag of a destination holds its default, like in argparse
+        namespace = {}
+        for flag, (dest, kwargs) in flags.items():
+            if dest in namespace:
+                continue
+            if dest in values:
+                namespace[dest] = values[dest]
+                continue
+            if kwargs.get('required') or flag in self.required_args:
+                raise _UseArgparse()
+            if 'default_factory' in kwargs:
+                namespace[dest] = kwargs['default_factory']()
                 continue
-            field.type = type_hints[field.name]
-            self._parse_dataclass_field(parser, field, parent=parent)
+            default = kwargs.get('default')
+            if isinstance(default, str) and 'type' in kwargs:
+                default = _convert_argument(kwargs, default)
+            namespace[dest] = default
+        return namespace, entered, remaining
+
+    def _entered_args(self, args):
+        flags = self._flag_table()
+        entered = []
+        for arg in args:
+            flag = arg.split('=')[0]
+            if flag in flags:
+                entered.append(flags[flag][0])
+        return entered
 
     def parse_args(self, args=None, return_entered_args=False) -> DataClass:
-        namespace, remaining_args = self.parse_known_args(args=args)
+        args = sys.argv[1:] if args is None else list(args)
+        try:
+            if len(self._actions) != self._num_own_actions:
+                # arguments added by the caller are only known to argparse
+                raise _UseArgparse()
+            inputs, entered_args, remaining_args = self._fast_parse(args)
+        except _UseArgparse:
+            namespace, remaining_args = self.parse_known_args(args=args)
+            inputs = vars(namespace)
+            entered_args = self._entered_args(args)
 
         if len(remaining_args) > 0:
             pprint("Didn't recognize the following arguments:")
             pprint(remaining_args)
             # exit(1)
-        default_args = dataclasses.asdict(self.dataclass_type())
-        _flatten_args(default_args)
-        inputs = {k: v for k, v in vars(namespace).items()}
-        entered_args = [arg.replace('--', '').split('=')[0] for arg in sys.argv]
-        entered_args = [arg for arg in entered_args if arg in default_args.keys() or arg == 'config']
-        _unflatten_args(inputs)
+        inputs = unflatten_args(inputs)
 
         if return_entered_args:
             return inputs, entered_args
@@ -316,42 +613,33 @@ class NestedArgumentParser(ArgumentParser):
         dataclass types.
         """
         data = json.loads(Path(json_file).read_text())
-        keys = {f.name for f in dataclasses.fields(self.dataclass_type) if f.init}
-        inputs = {k: v for k, v in data.items() if k in keys}
-        _unflatten_args(inputs)
-        obj = self.dataclass_type(**inputs)
-        return obj
+        return self.parse_dict(data)
 
     def parse_dict(self, args: dict) -> Tuple[DataClass, ...]:
         """
         Alternative helper method that does not use `argparse` at all, instead uses a dict and populating the dataclass
         types.
         """
-        keys = {f.name for f in dataclasses.fields(self.dataclass_type) if f.init}
-        inputs = {k: v for k, v in args.items() if k in keys}
-        _unflatten_args(inputs)
-        obj = self.dataclass_type(**inputs)
+        keys = set(self.schema.init_names)
+        inputs = flatten_args({k: v for k, v in args.items() if k in keys})
+        inputs = compile_validator(self.dataclass_type).validate(inputs)
+        obj = self.dataclass_type(**unflatten_args(inputs))
         return obj
 
 
-def parse_config(config_file):
-    assert os.path.exists(config_file), f'could not find config file: {config_file}'
+def _print_args(args):
+    pprint("=" * 20 + " Training Arguments " + "=" * 20)
+    pprint(asdict(args))
 
-    if '.yaml' in config_file:
-        with open(config_file) as f:
-            arg_dict = (yaml.safe_load(f))
-    elif '.json' in config_file:
-        with open(config_file) as f:
-            arg_dict = json.load(f)
-    else:
-        assert False, f'{config_file} file type is not supported yet!'
-    return arg_dict
 
-
-def parse_args(arg_class, required_args=None, print_args=True, resolve_config=True):
+def parse_args(arg_class, required_args=None, print_args=True, resolve_config=True, args=None, distributed=False):
     """
     behavior as follows: first reads config file arguments. then overrides any arguments with
      provided command line arguments
+    @param args: command line arguments to parse, defaults to `sys.argv[1:]`
+    @param distributed: under multi-process launches (torchrun, slurm, mpi) only one process per host parses the
+                        arguments (or global rank 0 when torch.distributed is initialized) and shares them with the
+                        others, see `mltoolkit.distributed.share_result`. only rank 0 prints them
     @param print_args: print parsed arguments into
     @param required_args: list of arguments that must be passed; assertion error if not passed
     @param arg_class: @argclass wrapped class to populate
@@ -368,9 +656,17 @@ def parse_args(arg_class, required_args=None, print_args=True, resolve_config=Tr
             config = os.path.join(config, script)
         return config
 
+    if distributed and process_info().world_size > 1:
+        key = f'parse_args:{arg_class.__module__}.{arg_class.__qualname__}:{args!r}:{required_args!r}'
+        args = share_result(functools.partial(parse_args, arg_class, required_args=required_args, print_args=False,
+                                              resolve_config=resolve_config, args=args), key=key)
+        if print_args and process_info().is_main:
+            _print_args(args)
+        return args
+
     parser = NestedArgumentParser(arg_class, required_args=required_args)
-    cli_arg_dict, entered_args = parser.parse_args(return_entered_args=True)
-    _flatten_args(cli_arg_dict)
+    cli_arg_dict, entered_args = parser.parse_args(args=args, return_entered_args=True)
+    cli_arg_dict = flatten_args(cli_arg_dict)
     cli_arg_dict = {arg: cli_arg_dict[arg] for arg in entered_args}
 
     # check if config file is provided
@@ -379,20 +675,20 @@ def parse_args(arg_class, required_args=None, print_args=True, resolve_config=Tr
     if 'config' in cli_arg_dict.keys() and cli_arg_dict['config'] and resolve_config:
         cli_arg_dict['config'] = resolve_config_file(cli_arg_dict['config'])
         config_file = cli_arg_dict['config']
-        arg_dict = parse_config(config_file)
+        arg_dict = compose_config(config_file, flat=True)
 
         if not hasattr(arg_class, 'config'):
             del cli_arg_dict['config']
 
     # override config file args with command line args
-    _flatten_args(arg_dict)
     arg_dict.update(cli_arg_dict)
 
-    _unflatten_args(arg_dict)
+    # coerce config file values (e.g. `lr: 5e-4`, which yaml loads as a string) and report every invalid one at once
+    arg_dict = compile_validator(arg_class).validate(arg_dict)
+    arg_dict = unflatten_args(arg_dict)
     # parse into dataclass representation
     args = arg_class(**arg_dict)
 
     if ('no_print_args' in arg_dict and arg_dict['no_print_args']) or print_args:
-        pprint("=" * 20 + " Training Arguments " + "=" * 20)
-        pprint(dataclasses.asdict(args))
+        _print_args(args)
     return args
@@ -1,9 +1,53 @@
+import functools
 import os
 from dataclasses import field
-from typing import Optional, Any, Sequence
+from typing import Optional, Any, Sequence, List
 
 from mltoolkit.argparser import argclass
 
+# overrides device detection for every process it is set in, e.g. MLTOOLKIT_DEVICE=cpu
+DEVICE_ENV = 'MLTOOLKIT_DEVICE'
+
+
+def _import_torch():
+    try:
+        import torch
+    except ModuleNotFoundError:
+        raise ModuleNotFoundError('torch needs to be installed for device checking')
+    return torch
+
+
+@functools.lru_cache(maxsize=None)
+def available_devices() -> List[str]:
+    """
+    devices usable by this process in order of preference, e.g. ['cuda:0', 'cuda:1', 'cpu']. probed once per process
+    """
+    torch = _import_torch()
+    devices = []
+    if torch.cuda.is_available():
+        devices.extend(f'cuda:{i}' for i in range(torch.cuda.device_count()))
+    if 'mps' in dir(torch.backends) and torch.backends.mps.is_available():
+        devices.append('mps')
+    devices.append('cpu')
+    return devices
+
+
+@functools.lru_cache(maxsize=None)
+def detect_device(no_gpu=False) -> str:
+    """
+    best device available to this process, checked in order ['cuda', 'mps', 'cpu'] and memoized. $MLTOOLKIT_DEVICE
+    takes precedence over detection
+    @param no_gpu: only consider the cpu
+    """
+    if os.environ.get(DEVICE_ENV):
+        return os.environ[DEVICE_ENV]
+    if no_gpu:
+        return 'cpu'
+    devices = available_devices()
+    if devices[0].startswith('cuda'):
+        return 'cuda'
+    return devices[0]
+
 
 @argclass
 class GeneralArguments:
@@ -15,22 +59,23 @@ class GeneralArguments:
     config: Optional[str] = field(default=None, metadata={'help': 'load arguments from config file/folder'})
 
     def __post_init__(self):
-        # check for devices in order ['cuda', 'mps', 'cpu']
-        try:
-            import torch
-        except:
-            raise ModuleNotFoundError('torch needs to be installed for device checking')
-        if torch.cuda.is_available() and not self.no_gpu:
-            self._device = 'cuda'
-        elif 'mps' in dir(torch.backends) and torch.backends.mps.is_available() and not self.no_gpu:
-            self._device = 'mps'
-        else:
-            self._device = 'cpu'
+        # device detection is deferred to the first `device` access. kept so subclasses can call super().__post_init__()
+        pass
 
     @property
     def device(self):
+        """
+        explicitly set device, otherwise the best device available to this process. torch is only imported on first
+        access
+        """
+        if self._device is None:
+            return detect_device(no_gpu=self.no_gpu)
         return self._device
 
+    @device.setter
+    def device(self, device):
+        self._device = device
+
 
 @argclass
 class WandBArguments:
@@ -0,0 +1,301 @@
+"""
+Content-addressed local cache of downloaded wandb artifacts. Entries are keyed by the artifact path and the digest of
+the artifact's contents, so every process on a host downloads a version once and later runs link the cached files
+into their own directories. Downloads of the same entry are serialized with file locks, and the least recently used
+entries are evicted when the cache grows past its size bound.
+
+cache layout:
+    objects/<key>/       artifact contents (read-only)
+    objects/<key>.json   entry metadata; its mtime is the last use of the entry
+    refs/<hash>.json     last digest an artifact path resolved to, used in offline mode
+    locks/<key>.lock     held exclusively while downloading or evicting an entry, shared while linking it or while a
+                         process uses the entry in place
+"""
+import contextlib
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+import stat
+from typing import Callable, List, Optional
+
+LINK_MODES = ('hardlink', 'symlink', 'copy')
+
+_SIZE_SUFFIXES = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+
+
+def parse_size(size) -> Optional[int]:
+    """
+    bytes of a size given as a number or a string like '500M' or '20G'
+    """
+    if size is None or size == '':
+        return None
+    if isinstance(size, str):
+        size = size.strip().upper()
+        if size.endswith('B'):
+            size = size[:-1]
+        if size and size[-1] in _SIZE_SUFFIXES:
+            return int(float(size[:-1]) * _SIZE_SUFFIXES[size[-1]])
+    return int(float(size))
+
+
+def _hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+def entry_key(artifact_path, digest) -> str:
+    return _hash(f'{artifact_path}@{digest}')
+
+
+@contextlib.contextmanager
+def _locked(path, shared=False, blocking=True):
+    """
+    holds an flock on `path` for the duration of the block, yields whether it was acquired
+    """
+    import fcntl
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(fd, flags if blocking else flags | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)
+
+
+# lock path -> descriptor holding a shared lock on it, for entries this process uses in place
+_PINS = {}
+
+
+def _pin(lock_path, meta_path) -> bool:
+    """
+    holds a shared lock on the entry until `_unpin` or the end of the process, so it can't be evicted
+    :return: False if the entry was evicted before it could be pinned
+    """
+    import fcntl
+    if lock_path in _PINS:
+        return True
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    if not os.path.exists(meta_path):
+        os.close(fd)
+        return False
+    _PINS[lock_path] = fd
+    return True
+
+
+def _unpin(lock_path):
+    fd = _PINS.pop(lock_path, None)
+    if fd is not None:
+        os.close(fd)
+
+
+def _tree_size(path):
+    return sum(os.path.getsize(os.path.join(dirpath, name))
+               for dirpath, _, filenames in os.walk(path) for name in filenames)
+
+
+def _make_read_only(path):
+    # hardlinked files share their inode with the cache, so runs must not be able to modify them in place
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            file = os.path.join(dirpath, name)
+            os.chmod(file, os.stat(file).st_mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def link_tree(source, target, mode='hardlink'):
+    """
+    mirrors the files of `source` into `target`. hardlinks fall back to symlinks across file systems
+    @param mode: 'hardlink', 'symlink' or 'copy'. hardlinked and copied files stay valid after the cache entry is
+                 evicted, symlinks don't
+    """
+    assert mode in LINK_MODES, f'unknown link mode {mode}, expected one of {LINK_MODES}'
+    for dirpath, _, filenames in os.walk(source):
+        directory = os.path.join(target, os.path.relpath(dirpath, source))
+        os.makedirs(directory, exist_ok=True)
+        for name in filenames:
+            src, dst = os.path.join(dirpath, name), os.path.join(directory, name)
+            if os.path.lexists(dst):
+                os.remove(dst)
+            if mode == 'hardlink':
+                try:
+                    os.link(src, dst)
+                    continue
+                except OSError:
+                    mode = 'symlink'
+            if mode == 'symlink':
+                os.symlink(os.path.abspath(src), dst)
+            else:
+                shutil.copy2(src, dst)
+    return target
+
+
+@dataclasses.dataclass
+class CacheEntry:
+    key: str
+    artifact_path: str
+    digest: str
+    # bytes of the artifact contents
+    size: int
+    last_used: float
+    path: str
+
+
+class ArtifactCache:
+    """
+    content-addressed store of artifact downloads under `root`, bounded to `max_size` bytes
+    """
+
+    def __init__(self, root, max_size=None):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.max_size = parse_size(max_size)
+        for directory in ('objects', 'refs', 'locks'):
+            os.makedirs(os.path.join(self.root, directory), exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, 'objects', key)
+
+    def _meta_path(self, key):
+        return os.path.join(self.root, 'objects', f'{key}.json')
+
+    def _lock_path(self, key):
+        return os.path.join(self.root, 'locks', f'{key}.lock')
+
+    def _ref_path(self, artifact_path):
+        return os.path.join(self.root, 'refs', f'{_hash(artifact_path)}.json')
+
+    def _write_json(self, path, value):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+    def _touch(self, key):
+        try:
+            os.utime(self._meta_path(key))
+        except FileNotFoundError:
+            pass
+
+    def resolve(self, artifact_path) -> Optional[str]:
+        """
+        digest `artifact_path` resolved to when it was last fetched, None if it was never fetched
+        """
+        try:
+            with open(self._ref_path(artifact_path)) as f:
+                return json.load(f)['digest']
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+    def lookup(self, artifact_path, digest=None) -> Optional[str]:
+        """
+        directory of the cached contents of `artifact_path` at `digest` (by default the digest it last resolved to),
+        None if they aren't cached. the entry is pinned: it isn't evicted until `unpin` or the end of this process
+        """
+        digest = digest if digest is not None else self.resolve(artifact_path)
+        if digest is None:
+            return None
+        key = entry_key(artifact_path, digest)
+        if not os.path.exists(self._meta_path(key)) or not _pin(self._lock_path(key), self._meta_path(key)):
+            return None
+        self._touch(key)
+        return self._path(key)
+
+    def fetch(self, artifact_path, digest, download: Callable[[str], object]) -> str:
+        """
+        directory of the cached contents of `artifact_path` at `digest`, calling `download(directory)` to fill it
+        on a miss. concurrent fetches of the same entry download once; the others wait for it. the entry is pinned
+        like in `lookup`
+        """
+        key = entry_key(artifact_path, digest)
+        path = self._path(key)
+        # an entry pinned by this process can't be evicted, and locking it exclusively would wait on our own pin
+        while not _pin(self._lock_path(key), self._meta_path(key)):
+            self._download(key, artifact_path, digest, download)
+        self._write_json(self._ref_path(artifact_path), {'digest': digest})
+        self._touch(key)
+        self.evict(keep=(key,))
+        return path
+
+    def _download(self, key, artifact_path, digest, download):
+        path = self._path(key)
+        with _locked(self._lock_path(key)):
+            if not os.path.exists(self._meta_path(key)):
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                shutil.rmtree(path, ignore_errors=True)
+                os.makedirs(tmp_path)
+                try:
+                    download(tmp_path)
+                    _make_read_only(tmp_path)
+                    os.replace(tmp_path, path)
+                finally:
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                # the metadata marks the entry complete
+                self._write_json(self._meta_path(key), {'artifact_path': artifact_path, 'digest': digest,
+                                                        'size': _tree_size(path)})
+
+    def unpin(self, path):
+        """
+        allows the entry directory `path` returned by `lookup` or `fetch` to be evicted again
+        """
+        _unpin(self._lock_path(os.path.basename(path)))
+
+    def link(self, path, target, mode='hardlink') -> str:
+        """
+        links the cache entry directory `path` into `target` (e.g. a run directory), see `link_tree`. the entry
+        can't be evicted while it is being linked
+        """
+        with _locked(self._lock_path(os.path.basename(path)), shared=True):
+            assert os.path.isdir(path), f'cache entry {path} was evicted'
+            return link_tree(path, target, mode=mode)
+
+    def entries(self) -> List[CacheEntry]:
+        entries = []
+        objects = os.path.join(self.root, 'objects')
+        for name in os.listdir(objects):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            try:
+                with open(os.path.join(objects, name)) as f:
+                    meta = json.load(f)
+                last_used = os.stat(os.path.join(objects, name)).st_mtime
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            entries.append(CacheEntry(key=key, artifact_path=meta['artifact_path'], digest=meta['digest'],
+                                      size=meta['size'], last_used=last_used, path=self._path(key)))
+        return entries
+
+    def size(self) -> int:
+        return sum(entry.size for entry in self.entries())
+
+    def evict(self, max_size=None, keep=()) -> List[CacheEntry]:
+        """
+        removes least recently used entries until the cache fits `max_size` (defaults to the cache's bound).
+        entries in `keep` and entries that are being downloaded, linked or are pinned by a process are skipped
+        :return: evicted entries
+        """
+        max_size = parse_size(max_size) if max_size is not None else self.max_size
+        if max_size is None:
+            return []
+        evicted = []
+        with _locked(os.path.join(self.root, 'locks', 'evict.lock')):
+            entries = sorted(self.entries(), key=lambda entry: entry.last_used)
+            total = sum(entry.size for entry in entries)
+            for entry in entries:
+                if total <= max_size:
+                    break
+                if entry.key in keep:
+                    continue
+                with _locked(self._lock_path(entry.key), blocking=False) as acquired:
+                    if not acquired:
+                        continue
+                    os.remove(self._meta_path(entry.key))
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                total -= entry.size
+                evicted.append(entry)
+        return evicted
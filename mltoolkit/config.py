@@ -0,0 +1,255 @@
+"""
+Config file loading. Files are parsed with the fastest available loader for their extension and parsed results are
+cached in-process and (optionally) on disk, keyed by path, modification time and content hash. Configs can be composed
+on top of base configs, which are resolved through a memoized include graph.
+"""
+import hashlib
+import json
+import os
+import pickle
+from typing import Any, Callable, Dict
+
+import yaml
+
+# directory used to persist parsed configs across processes; disabled when unset
+CONFIG_CACHE_ENV = 'MLTOOLKIT_CONFIG_CACHE'
+
+# libyaml bindings are an order of magnitude faster than the pure python loader
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def _load_yaml(data: bytes):
+    return yaml.load(data, Loader=_YamlLoader)
+
+
+def _load_json(data: bytes):
+    return json.loads(data)
+
+
+def _load_toml(data: bytes):
+    try:
+        import tomllib
+    except ModuleNotFoundError:
+        try:
+            import tomli as tomllib
+        except ModuleNotFoundError:
+            raise ModuleNotFoundError('tomli needs to be installed to read .toml configs on python < 3.11')
+    return tomllib.loads(data.decode())
+
+
+CONFIG_LOADERS: Dict[str, Callable[[bytes], Any]] = {
+    '.yaml': _load_yaml,
+    '.yml': _load_yaml,
+    '.json': _load_json,
+    '.toml': _load_toml,
+}
+
+# absolute path -> (mtime_ns, size, content hash, pickled config)
+_PARSED_CONFIGS = {}
+
+
+_MISSING = object()
+
+
+def _key_conflict(key, conflicting_key):
+    return Exception('Key "{}" conflicts with key "{}"'.format(key, conflicting_key))
+
+
+def _flatten_into(flat, prefix, args):
+    for k, v in args.items():
+        if type(v) == dict:
+            _flatten_into(flat, f'{prefix}{k}.', v)
+        else:
+            flat[prefix + k] = v
+
+
+def flatten_args(args):
+    """
+    flattens nested dictionaries into a new dictionary of dotted keys, e.g. {'a': {'b': 1}} -> {'a.b': 1}.
+    keys keep their insertion order and the input is not modified
+    """
+    flat = {}
+    _flatten_into(flat, '', args)
+    return flat
+
+
+def unflatten_args(args):
+    """
+    expands dotted keys into a new nested dictionary in a single pass, e.g. {'a.b': 1} -> {'a': {'b': 1}}.
+    dictionary values are merged with dotted keys sharing their prefix and later keys override earlier ones.
+    the input is not modified; nested dictionaries are only copied when keys have to be merged into them
+    """
+    result = {}
+    # ids of the nested dictionaries created here (trie nodes), which may be written to
+    owned = {id(result)}
+
+    def child_node(node, key_parts, i, key):
+        child = node.get(key_parts[i], _MISSING)
+        if child is _MISSING:
+            child = node[key_parts[i]] = {}
+            owned.add(id(child))
+        elif id(child) not in owned:
+            if type(child) != dict:
+                raise _key_conflict(key, '.'.join(key_parts[:i + 1]))
+            child = node[key_parts[i]] = dict(child)
+            owned.add(id(child))
+        return child
+
+    def assign(node, name, value, key, path):
+        existing = node.get(name, _MISSING)
+        if existing is _MISSING or id(existing) not in owned:
+            node[name] = value
+        elif type(value) != dict:
+            raise _key_conflict(key, f'{path}.{next(iter(existing))}' if existing else path)
+        else:
+            for k, v in value.items():
+                assign(existing, k, v, key, f'{path}.{k}')
+
+    # dotted prefix -> trie node, so keys sharing a parent don't walk the path from the root again
+    prefixes = {}
+    for key, value in args.items():
+        if '.' not in key:
+            assign(result, key, value, key, key)
+            continue
+        prefix, _, name = key.rpartition('.')
+        node = prefixes.get(prefix)
+        if node is None:
+            key_parts = key.split('.')
+            node = result
+            for i in range(len(key_parts) - 1):
+                node = child_node(node, key_parts, i, key)
+            prefixes[prefix] = node
+        assign(node, name, value, key, key)
+    return result
+
+
+def _config_loader(config_file):
+    ext = os.path.splitext(config_file)[1].lower()
+    loader = CONFIG_LOADERS.get(ext)
+    assert loader is not None, f'{config_file} file type is not supported yet!'
+    return loader
+
+
+def _cache_path(cache_dir, path):
+    return os.path.join(cache_dir, hashlib.sha256(path.encode()).hexdigest() + '.config')
+
+
+def _read_cache_entry(cache_path):
+    try:
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        return None
+
+
+def _write_cache_entry(cache_path, entry):
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def parse_config(config_file, cache_dir=None):
+    """
+    reads a yaml/json/toml config file into a dictionary
+    @param config_file: path to config file; the format is picked by extension
+    @param cache_dir: directory to cache parsed configs in, defaults to $MLTOOLKIT_CONFIG_CACHE
+    :return: parsed config; a fresh object on every call, so it can be modified freely
+    """
+    assert os.path.exists(config_file), f'could not find config file: {config_file}'
+    loader = _config_loader(config_file)
+    path = os.path.abspath(config_file)
+    stat = os.stat(path)
+
+    # unchanged files are served without reading them again
+    entry = _PARSED_CONFIGS.get(path)
+    cache_dir = cache_dir or os.environ.get(CONFIG_CACHE_ENV)
+    cache_path = _cache_path(cache_dir, path) if cache_dir else None
+    if entry is None and cache_path is not None:
+        entry = _read_cache_entry(cache_path)
+    if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+        _PARSED_CONFIGS[path] = entry
+        return pickle.loads(entry[3])
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    content_hash = hashlib.sha256(data).hexdigest()
+    if entry is not None and entry[2] == content_hash:
+        # touched but unchanged file
+        blob = entry[3]
+    else:
+        blob = pickle.dumps(loader(data), protocol=pickle.HIGHEST_PROTOCOL)
+    entry = (stat.st_mtime_ns, stat.st_size, content_hash, blob)
+    _PARSED_CONFIGS[path] = entry
+    if cache_path is not None:
+        _write_cache_entry(cache_path, entry)
+    return pickle.loads(blob)
+
+
+# key listing the config files a config is composed on top of
+BASE_KEY = '_base_'
+
+# absolute path -> (((dependency path, mtime_ns, size), ...), pickled flattened config)
+_RESOLVED_CONFIGS = {}
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def _resolve_flat(path, stack, cache_dir):
+    """
+    returns the flattened config at `path` merged on top of its bases, together with the signatures of every file
+    it was built from. each file is resolved once and reused by all configs that include it
+    """
+    if path in stack:
+        cycle = ' -> '.join(stack[stack.index(path):] + [path])
+        raise ValueError(f'config include cycle detected: {cycle}')
+
+    resolved = _RESOLVED_CONFIGS.get(path)
+    if resolved is not None and all(_file_signature(dep[0]) == dep for dep in resolved[0]):
+        return resolved
+
+    stack.append(path)
+    config = parse_config(path, cache_dir=cache_dir) or {}
+    bases = config.pop(BASE_KEY, None) or []
+    if isinstance(bases, str):
+        bases = [bases]
+
+    flat = {}
+    dependencies = {}
+    for base in bases:
+        base_path = os.path.abspath(os.path.join(os.path.dirname(path), os.path.expanduser(base)))
+        assert os.path.exists(base_path), f'could not find base config {base} of {path}'
+        base_dependencies, base_blob = _resolve_flat(base_path, stack, cache_dir)
+        dependencies.update((dep[0], dep) for dep in base_dependencies)
+        flat.update(pickle.loads(base_blob))
+    flat.update(flatten_args(config))
+    stack.pop()
+
+    dependencies[path] = _file_signature(path)
+    resolved = (tuple(dependencies.values()), pickle.dumps(flat, protocol=pickle.HIGHEST_PROTOCOL))
+    _RESOLVED_CONFIGS[path] = resolved
+    return resolved
+
+
+def compose_config(config_file, cache_dir=None, flat=False):
+    """
+    reads a config file and merges it on top of the config files listed under its `_base_` key (a path or list of
+    paths relative to the config). bases are merged in order, later files overriding earlier ones, and may have
+    bases of their own. shared bases are parsed once per process
+    @param config_file: path to config file
+    @param cache_dir: directory to cache parsed configs in, see `parse_config`
+    @param flat: return the merged config with dotted keys instead of nested dictionaries
+    :return: merged config; a fresh object on every call
+    """
+    assert os.path.exists(config_file), f'could not find config file: {config_file}'
+    _, blob = _resolve_flat(os.path.abspath(config_file), [], cache_dir)
+    config = pickle.loads(blob)
+    return config if flat else unflatten_args(config)
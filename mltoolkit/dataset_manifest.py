@@ -0,0 +1,227 @@
+"""
+Checksum manifests of local dataset trees. Files are hashed on a thread pool with chunked, streaming reads (hashlib
+releases the GIL on large updates), and digests are kept in a sqlite cache keyed by (path, size, mtime), so building
+the manifest of a new dataset version only reads the files that changed. Manifests are json files that can be
+attached to an artifact and diffed between versions.
+"""
+import dataclasses
+import hashlib
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# sqlite file caching file digests across processes; defaults to ~/.cache/mltoolkit/digests.db
+DIGEST_CACHE_ENV = 'MLTOOLKIT_DIGEST_CACHE'
+
+MANIFEST_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS digests (
+    path TEXT NOT NULL,
+    algorithm TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (path, algorithm)
+);
+"""
+
+
+def default_digest_cache():
+    return os.environ.get(DIGEST_CACHE_ENV) or os.path.join(os.path.expanduser('~'), '.cache', 'mltoolkit',
+                                                            'digests.db')
+
+
+class DigestCache:
+    """
+    sqlite backed map from (absolute path, size, mtime) to file digest. safe to share between processes
+    """
+
+    def __init__(self, path, timeout=30.0):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+
+    def under(self, root, algorithm):
+        """
+        cached {path: (size, mtime_ns, digest)} of every file below the directory `root`
+        """
+        prefix = os.path.join(os.path.abspath(root), '')
+        # every path starting with `prefix` sorts between it and the prefix with its last character incremented
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self._conn.execute('SELECT path, size, mtime_ns, digest FROM digests '
+                                  'WHERE algorithm = ? AND path >= ? AND path < ?', (algorithm, prefix, upper))
+        return {path: (size, mtime_ns, digest) for path, size, mtime_ns, digest in rows}
+
+    def update(self, algorithm, entries):
+        """
+        stores (path, size, mtime_ns, digest) `entries`
+        """
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._conn.executemany('INSERT OR REPLACE INTO digests (path, algorithm, size, mtime_ns, digest) '
+                                   'VALUES (?, ?, ?, ?, ?)',
+                                   [(path, algorithm, size, mtime_ns, digest)
+                                    for path, size, mtime_ns, digest in entries])
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def file_digest(path, algorithm='md5', chunk_size=1 << 20) -> str:
+    """
+    hex digest of the file at `path`, read in chunks of `chunk_size` bytes
+    """
+    digest = hashlib.new(algorithm)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+def _scan(root):
+    """
+    (relative path, absolute path, size, mtime_ns) of every file below `root`, following symlinks to files. like
+    `os.walk` (and wandb's directory references), symlinks to directories are not descended into, so link cycles
+    can't recurse forever
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    yield os.path.relpath(entry.path, root), entry.path, stat.st_size, stat.st_mtime_ns
+
+
+@dataclasses.dataclass
+class ManifestDiff:
+    added: List[str]
+    removed: List[str]
+    changed: List[str]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+@dataclasses.dataclass
+class Manifest:
+    algorithm: str
+    # relative path -> {'size': bytes, 'digest': hex digest}
+    files: Dict[str, dict]
+    # files that were hashed (as opposed to served from the digest cache) while building the manifest
+    hashed: int = dataclasses.field(default=0, compare=False)
+
+    @property
+    def digest(self) -> str:
+        """
+        digest of the whole tree: changes whenever any file is added, removed or modified
+        """
+        digest = hashlib.new(self.algorithm)
+        for path in sorted(self.files):
+            digest.update(f'{path}\0{self.files[path]["digest"]}\n'.encode())
+        return digest.hexdigest()
+
+    @property
+    def size(self) -> int:
+        return sum(entry['size'] for entry in self.files.values())
+
+    def diff(self, other: 'Manifest') -> ManifestDiff:
+        """
+        files added, removed and changed in `other` relative to this manifest
+        """
+        assert self.algorithm == other.algorithm, 'manifests hashed with different algorithms can\'t be compared'
+        return ManifestDiff(added=sorted(other.files.keys() - self.files.keys()),
+                            removed=sorted(self.files.keys() - other.files.keys()),
+                            changed=sorted(path for path in self.files.keys() & other.files.keys()
+                                           if self.files[path]['digest'] != other.files[path]['digest']))
+
+    def to_dict(self):
+        return {'version': MANIFEST_VERSION, 'algorithm': self.algorithm, 'digest': self.digest,
+                'files': {path: self.files[path] for path in sorted(self.files)}}
+
+    def save(self, path):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path) -> 'Manifest':
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != MANIFEST_VERSION:
+            raise ValueError(f'unsupported manifest version {data.get("version")} in {path}')
+        return cls(algorithm=data['algorithm'], files=data['files'])
+
+
+def build_manifest(root, algorithm='md5', workers=None, cache_path=None, chunk_size=1 << 20,
+                   max_objects=None) -> Manifest:
+    """
+    hashes every file below the directory `root`
+    @param algorithm: any `hashlib` algorithm
+    @param workers: hashing threads, defaults to min(32, cpu count + 4)
+    @param cache_path: sqlite digest cache, defaults to $MLTOOLKIT_DIGEST_CACHE or ~/.cache/mltoolkit/digests.db.
+                       pass False to hash every file
+    @param max_objects: fail if `root` contains more files
+    """
+    root = os.path.abspath(root)
+    assert os.path.isdir(root), f'could not find dataset directory {root}'
+    files = list(_scan(root))
+    if max_objects is not None and len(files) > max_objects:
+        raise ValueError(f'{root} contains {len(files)} files, more than max_objects={max_objects}')
+
+    cache = DigestCache(cache_path or default_digest_cache()) if cache_path is not False else None
+    cached = cache.under(root, algorithm) if cache is not None else {}
+    entries = {}
+    missing = []
+    for relative, path, size, mtime_ns in files:
+        hit = cached.get(path)
+        if hit is not None and hit[:2] == (size, mtime_ns):
+            entries[relative] = {'size': size, 'digest': hit[2]}
+        else:
+            missing.append((relative, path, size, mtime_ns))
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            digests = list(pool.map(lambda file: file_digest(file[1], algorithm, chunk_size), missing))
+        for (relative, path, size, mtime_ns), digest in zip(missing, digests):
+            entries[relative] = {'size': size, 'digest': digest}
+        if cache is not None:
+            cache.update(algorithm, [(path, size, mtime_ns, digest)
+                                     for (_, path, size, mtime_ns), digest in zip(missing, digests)])
+    if cache is not None:
+        cache.close()
+    return Manifest(algorithm=algorithm, files=entries, hashed=len(missing))
+
+
+def diff_manifests(old, new) -> ManifestDiff:
+    """
+    diff between two manifests or manifest files
+    """
+    old = old if isinstance(old, Manifest) else Manifest.load(old)
+    new = new if isinstance(new, Manifest) else Manifest.load(new)
+    return old.diff(new)
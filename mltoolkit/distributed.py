@@ -0,0 +1,228 @@
+"""
+Helpers for multi-process launches (torchrun, slurm, mpirun). Work that every process would otherwise repeat, like
+parsing the config, is done by a single process and its result is shared with the others, either through a file in
+local shared memory or with a cpu (gloo) broadcast when torch.distributed is already initialized.
+"""
+import dataclasses
+import hashlib
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Optional
+
+# directory used to exchange shared results between the processes of a host; defaults to /dev/shm
+BROADCAST_DIR_ENV = 'MLTOOLKIT_BROADCAST_DIR'
+
+# (global rank, local rank, world size, local world size) variables of the supported launchers
+_RANK_ENV_VARS = [
+    ('RANK', 'LOCAL_RANK', 'WORLD_SIZE', 'LOCAL_WORLD_SIZE'),  # torchrun / torch.distributed.launch
+    ('SLURM_PROCID', 'SLURM_LOCALID', 'SLURM_NTASKS', None),
+    ('OMPI_COMM_WORLD_RANK', 'OMPI_COMM_WORLD_LOCAL_RANK', 'OMPI_COMM_WORLD_SIZE', 'OMPI_COMM_WORLD_LOCAL_SIZE'),
+    ('PMI_RANK', 'MPI_LOCALRANKID', 'PMI_SIZE', 'MPI_LOCALNRANKS'),  # mpich / intel mpi
+]
+
+# variables identifying a launch, so that shared files of different launches never collide
+_LAUNCH_ENV_VARS = ['TORCHELASTIC_RUN_ID', 'TORCHELASTIC_RESTART_COUNT', 'MASTER_ADDR', 'MASTER_PORT',
+                    'SLURM_JOB_ID', 'SLURM_STEP_ID', 'OMPI_COMM_WORLD_JOBID']
+
+_OK, _ERROR, _EXIT = range(3)
+
+
+@dataclasses.dataclass(frozen=True)
+class ProcessInfo:
+    rank: int = 0
+    local_rank: int = 0
+    world_size: int = 1
+    # processes on this host, None if the launcher doesn't tell
+    local_world_size: Optional[int] = 1
+
+    @property
+    def is_main(self):
+        return self.rank == 0
+
+
+def process_info() -> ProcessInfo:
+    """
+    rank of this process as set by the launcher, single process if no launcher is detected
+    """
+    for rank_var, local_rank_var, world_size_var, local_world_size_var in _RANK_ENV_VARS:
+        if rank_var in os.environ and world_size_var in os.environ:
+            rank = int(os.environ[rank_var])
+            if local_world_size_var is None:
+                local_world_size = _slurm_local_world_size()
+            else:
+                local_world_size = os.environ.get(local_world_size_var)
+                local_world_size = int(local_world_size) if local_world_size else None
+            return ProcessInfo(rank=rank, local_rank=int(os.environ.get(local_rank_var, rank)),
+                               world_size=int(os.environ[world_size_var]), local_world_size=local_world_size)
+    return ProcessInfo()
+
+
+def _slurm_local_world_size():
+    # tasks per node are listed like `2(x3),1`: 2 tasks on each of the first 3 nodes, 1 on the fourth
+    tasks_per_node = os.environ.get('SLURM_STEP_TASKS_PER_NODE') or os.environ.get('SLURM_TASKS_PER_NODE')
+    node_id = os.environ.get('SLURM_NODEID')
+    if not tasks_per_node or node_id is None:
+        return None
+    counts = []
+    for part in tasks_per_node.split(','):
+        count, _, repeat = part.partition('(x')
+        counts.extend([int(count)] * (int(repeat.rstrip(')')) if repeat else 1))
+    node_id = int(node_id)
+    return counts[node_id] if node_id < len(counts) else None
+
+
+def is_main_process() -> bool:
+    return process_info().is_main
+
+
+# number of `share_result` calls per key made by this process. every process of a launch makes the same calls in the
+# same order, so the count tells repeated calls apart
+_CALL_COUNTS = {}
+
+
+def _launch_key(key=None):
+    """
+    name of the shared file of the next `share_result` call with `key` in this launch
+    """
+    count = _CALL_COUNTS.get(key, 0)
+    _CALL_COUNTS[key] = count + 1
+    launch = [os.environ.get(name) for name in _LAUNCH_ENV_VARS]
+    # processes started by the same launcher share their parent (torchrun agent, slurmstepd, mpi daemon)
+    launch += [os.getppid(), os.getcwd(), sys.argv, key, count]
+    return hashlib.sha256(json.dumps(launch, default=repr).encode()).hexdigest()[:32]
+
+
+def _broadcast_dir():
+    directory = os.environ.get(BROADCAST_DIR_ENV)
+    if directory:
+        return directory
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def _run(fn):
+    """
+    calls `fn` and returns the picklable payload shared with the other processes plus the exception raised, if any
+    """
+    try:
+        return (_OK, fn()), None
+    except SystemExit as e:
+        # e.g. `--help`; every process exits the same way
+        return (_EXIT, e.code), e
+    except Exception as e:
+        return (_ERROR, f'{type(e).__name__}: {e}'), e
+
+
+def _unpack(payload):
+    status, value = payload
+    if status == _OK:
+        return value
+    if status == _EXIT:
+        raise SystemExit(value)
+    raise RuntimeError(f'shared computation failed on the main process: {value}')
+
+
+def _release(path, readers):
+    """
+    counts this process as a reader of the shared file at `path`; the last of `readers` readers removes it
+    """
+    import fcntl
+    fd = os.open(f'{path}.readers', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        count = int(os.read(fd, 32) or 0) + 1
+        if count >= readers:
+            os.remove(path)
+            os.remove(f'{path}.readers')
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, str(count).encode())
+    finally:
+        os.close(fd)
+
+
+def _share_file(fn, info, key, timeout, poll_interval):
+    path = os.path.join(_broadcast_dir(), f'mltoolkit-{_launch_key(key)}.pkl')
+    if info.local_rank == 0:
+        if info.local_world_size == 1:
+            # nobody to share with on this host
+            return fn()
+        payload, error = _run(fn)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        if error is not None:
+            raise error
+        return payload[1]
+
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'local rank 0 did not share a result at {path} within {timeout}s')
+        time.sleep(poll_interval)
+        poll_interval = min(poll_interval * 2, 0.1)
+    with open(path, 'rb') as f:
+        payload = pickle.load(f)
+    _release(path, info.local_world_size - 1)
+    return _unpack(payload)
+
+
+_GLOO_GROUP = []
+
+
+def _share_gloo(fn, info):
+    import torch.distributed as dist
+    if dist.get_backend() == 'gloo':
+        group = None
+    else:
+        # the default group may be nccl; objects are always exchanged on cpu
+        if not _GLOO_GROUP:
+            _GLOO_GROUP.append(dist.new_group(backend='gloo'))
+        group = _GLOO_GROUP[0]
+    payload, error = _run(fn) if info.rank == 0 else (None, None)
+    payloads = [payload]
+    dist.broadcast_object_list(payloads, src=0, group=group)
+    if error is not None:
+        raise error
+    return _unpack(payloads[0])
+
+
+def _gloo_available():
+    dist = sys.modules.get('torch.distributed')
+    return dist is not None and dist.is_available() and dist.is_initialized()
+
+
+def share_result(fn: Callable[[], Any], method: str = 'auto', key: Optional[str] = None, timeout: float = 600.0,
+                 poll_interval: float = 0.001):
+    """
+    calls `fn` on one process and returns its result on every process. exceptions raised by `fn` are raised on
+    every process. must be called by every process of the launch
+
+    @param fn: callable without arguments; its result must be picklable
+    @param method: 'file' to call `fn` once per host (local rank 0) and exchange the result through a file in local
+                   shared memory, 'gloo' to call `fn` on global rank 0 and broadcast the result with
+                   torch.distributed, or 'auto' to use 'gloo' if torch.distributed is already initialized. 'file'
+                   needs the number of processes per host (e.g. LOCAL_WORLD_SIZE) to know when the shared file can
+                   be removed; without it 'auto' calls `fn` on every process
+    @param key: identifies the call, e.g. the function and its arguments. the shared file is named after the
+                launch, the key and the number of earlier calls with the same key, and removed once every local
+                process has read it
+    @param timeout: seconds to wait for the shared file
+    @param poll_interval: initial seconds between checks for the shared file
+    """
+    assert method in ('auto', 'file', 'gloo'), f'unknown share method {method}'
+    info = process_info()
+    if info.world_size <= 1:
+        return fn()
+    if method == 'gloo' or (method == 'auto' and _gloo_available()):
+        return _share_gloo(fn, info)
+    if info.local_world_size is None:
+        # nobody would know when to remove the shared file, and a later launch could read it
+        if method == 'file':
+            raise ValueError("method='file' needs the number of processes per host, which the launcher didn't report")
+        return fn()
+    return _share_file(fn, info, key, timeout, poll_interval)
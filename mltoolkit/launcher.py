@@ -0,0 +1,176 @@
+"""
+Local process-pool launcher for sweeps of many small experiments. Every worker process is pinned to its own set of
+cpu cores and limits the intra-op threads of torch / OpenMP / BLAS to those cores, so that workers don't oversubscribe
+the machine. Results are streamed back as runs finish and finished runs can be skipped on resume through a `RunIndex`.
+"""
+import concurrent.futures
+import dataclasses
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Union
+
+from mltoolkit.run_index import FAILED, FINISHED, RunIndex
+
+# environment variables read by OpenMP, MKL, OpenBLAS, numexpr and friends when they are first imported
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                   'NUMEXPR_NUM_THREADS')
+
+
+@dataclasses.dataclass
+class LaunchResult:
+    config: Any
+    # return value of the entry point, None if it raised
+    result: Any = None
+    # formatted traceback if the entry point raised
+    error: Optional[str] = None
+    seconds: float = 0.0
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def available_cpus() -> List[int]:
+    """
+    cpu cores this process may run on
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cpus(cpus: List[int], workers: int, cpus_per_worker: Optional[int] = None) -> List[List[int]]:
+    """
+    splits `cpus` into `workers` disjoint, contiguous sets (neighbouring cores usually share caches). if there are
+    fewer cores than workers, the cores are shared round robin
+    """
+    if cpus_per_worker is None:
+        cpus_per_worker = max(1, len(cpus) // workers)
+    if cpus_per_worker * workers <= len(cpus):
+        return [cpus[i * cpus_per_worker:(i + 1) * cpus_per_worker] for i in range(workers)]
+    return [[cpus[(i * cpus_per_worker + j) % len(cpus)] for j in range(cpus_per_worker)] for i in range(workers)]
+
+
+def limit_threads(num_threads: int):
+    """
+    limits the intra-op thread pools of this process to `num_threads`. environment variables only take effect for
+    libraries imported afterwards; torch is configured directly if it is already imported
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(num_threads)
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(num_threads)
+
+
+def _init_worker(cpu_sets, pin_cpus, threads_per_worker):
+    cpus = cpu_sets.get()
+    if pin_cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    limit_threads(threads_per_worker or len(cpus))
+
+
+def _run_task(entry_point, config):
+    start = time.perf_counter()
+    try:
+        return entry_point(config), None, time.perf_counter() - start
+    except BaseException:
+        # including SystemExit and KeyboardInterrupt, which would otherwise leave the run marked running
+        return None, traceback.format_exc(), time.perf_counter() - start
+
+
+def launch(entry_point: Callable[[Any], Any], configs: Iterable[Any], workers: Optional[int] = None,
+           cpus_per_worker: Optional[int] = None, threads_per_worker: Optional[int] = None, pin_cpus: bool = True,
+           index: Union[RunIndex, str, None] = None, stale_after: Optional[float] = None,
+           max_pending: Optional[int] = None, start_method: Optional[str] = None) -> Iterator[LaunchResult]:
+    """
+    runs `entry_point(config)` for every config on a pool of worker processes and yields the results as runs finish
+
+    @param entry_point: picklable (module level) function taking an argclass config
+    @param configs: argclass configs, e.g. a list or a lazy `sweep`; consumed incrementally
+    @param workers: number of worker processes, defaults to the `workers` field of the first config
+                    (`GeneralArguments.workers`), or to one per cpu core if it has none
+    @param cpus_per_worker: cpu cores pinned to each worker, defaults to an even split of the available cores
+    @param threads_per_worker: intra-op threads of each worker, defaults to its number of cores
+    @param pin_cpus: set the cpu affinity of workers (linux only)
+    @param index: `RunIndex` (or path to one) used to resume: configs that finished, or that another process is
+                  running, are skipped and every run is recorded as finished / failed. string return values of
+                  `entry_point` are recorded as output paths
+    @param stale_after: seconds after which runs marked running in `index` are considered abandoned and run again.
+                        runs whose launching process died on this host are always run again
+    @param max_pending: maximum number of submitted configs that haven't finished, defaults to 2 * workers
+    @param start_method: multiprocessing start method, defaults to the platform default
+    :return: generator of `LaunchResult` in completion order
+    """
+    configs = iter(configs)
+    first = next(configs, None)
+    if first is None:
+        return
+    if workers is None:
+        workers = getattr(first, 'workers', None) or os.cpu_count() or 1
+    assert workers >= 1, 'at least one worker is required'
+    max_pending = max_pending or 2 * workers
+
+    cpu_sets = partition_cpus(available_cpus(), workers, cpus_per_worker)
+    context = multiprocessing.get_context(start_method)
+    cpu_queue = context.Queue()
+    for cpus in cpu_sets:
+        cpu_queue.put(cpus)
+
+    owns_index = isinstance(index, str)
+    if owns_index:
+        index = RunIndex(index)
+
+    def claimed(config):
+        return index is None or index.claim(config, stale_after=stale_after)
+
+    pending_configs = (config for config in _chain_first(first, configs) if claimed(config))
+    # claimed configs whose result hasn't been yielded
+    running = {}
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                    initializer=_init_worker,
+                                                    initargs=(cpu_queue, pin_cpus, threads_per_worker)) as pool:
+            for config in pending_configs:
+                running[pool.submit(_run_task, entry_point, config)] = config
+                if len(running) < max_pending:
+                    continue
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield _finish(index, running.pop(future), future)
+            for future in concurrent.futures.as_completed(running):
+                yield _finish(index, running.pop(future), future)
+    finally:
+        # the consumer stopped early, or the pool or this process failed: record the runs that are left, so that they
+        # aren't skipped as running on resume
+        for future, config in running.items():
+            try:
+                _finish(index, config, future)
+            except Exception:
+                pass
+        if owns_index:
+            index.close()
+
+
+def _chain_first(first, rest):
+    yield first
+    yield from rest
+
+
+def _finish(index, config, future):
+    try:
+        result, error, seconds = future.result()
+    except BaseException:
+        # the worker died (e.g. a broken pool) or the run was cancelled
+        if index is not None:
+            index.mark(config, FAILED)
+        raise
+    if index is not None:
+        if error is None:
+            index.mark(config, FINISHED, output_path=result if isinstance(result, str) else None)
+        else:
+            index.mark(config, FAILED)
+    return LaunchResult(config=config, result=result, error=error, seconds=seconds)
@@ -1,6 +1,10 @@
 # credits: https://gist.github.com/ferrine
-import torch.nn
 import collections
+import dataclasses
+
+import torch.nn
+
+from mltoolkit.network_checkpointing import CHECKPOINT_KEY, CheckpointedSequential, even_segments
 
 class Builder(object):
     def __init__(self, *namespaces):
@@ -21,7 +25,8 @@ class Builder(object):
             self._namespace = self._namespace.new_child(namespace)
 
 
-def build_network(architecture, builder=Builder(torch.nn.__dict__)):
+def build_network(architecture, builder=Builder(torch.nn.__dict__), device=None, fuse=False, jit=None,
+                  example_input=None, cache_dir=None, reuse_weights=False, checkpoint_segments=None, profile=False):
     """
     Configuration for feedforward networks is list by nature. We can write 
     this in simple data structures. In yaml format it can look like:
@@ -61,14 +66,155 @@ def build_network(architecture, builder=Builder(torch.nn.__dict__)):
     
         extended_builder = Builder(torch.nn.__dict__, mynnlib.__dict__)
         net = build_network(architecture, builder=extended_builder)
+
+    Pass `device='meta'` to only record shapes: no memory is allocated and no weights are initialized. Such networks
+    can be inspected with `network_size` and allocated from a checkpoint with `materialize`.
+
+    Pass `fuse=True` to get an inference-only network with batch norms folded into the preceding layers and
+    activations fused, see `mltoolkit.network_fusion.fuse_network`.
+
+    Layers listed under a `checkpoint` block run as one activation-checkpointed segment in training, which saves
+    memory by recomputing their activations in the backward pass:
+
+    .. code-block:: yaml
+
+        architecture:
+            - checkpoint:
+                - Linear:
+                    args: [512, 512]
+                - ReLU:
+            - Linear:
+                args: [512, 10]
+
+    `checkpoint_segments=N` instead splits the whole network into N segments, the first N - 1 of which are
+    checkpointed; 0 disables checkpointing. see `mltoolkit.network_checkpointing`.
+
+    Pass `jit='script'` (or `jit='trace'` with an `example_input`) to get a TorchScript module. Compiled networks are
+    cached in `cache_dir` (defaults to $MLTOOLKIT_NETWORK_CACHE) keyed by the architecture, the layer constructors and
+    the torch version, so later launches load them instead of compiling again, see
+    `mltoolkit.network_cache.cached_jit_network`. Only the compiled code is reused: the network is still built to
+    initialize the weights, so seeds apply as usual. Pass `reuse_weights=True` to skip building and keep the weights
+    of whichever process cached the network. Compiled and fused networks are never checkpointed.
+
+    Pass `profile=True` (or `profile=n` to only record every n-th forward pass) to attach a
+    `mltoolkit.network_profiler.NetworkProfiler` as `network.profiler`, which records the latency, output size,
+    memory (on cuda) and FLOPs of every layer keyed by its architecture index and builder name.
         
     """
+    if profile:
+        assert jit is None, 'compiled networks cannot be profiled per layer'
+        from mltoolkit.network_profiler import profile_network
+        network = build_network(architecture, builder=builder, device=device, fuse=fuse,
+                                checkpoint_segments=checkpoint_segments)
+        # fused layers no longer correspond to architecture entries
+        network.profiler = profile_network(network, architecture=None if fuse else architecture,
+                                           sample_every=int(profile))
+        return network
+    if jit is not None:
+        from mltoolkit.network_cache import cached_jit_network
+        return cached_jit_network(lambda: build_network(architecture, builder=builder, device=device, fuse=fuse,
+                                                        checkpoint_segments=0),
+                                  architecture, builder, mode=jit, example_input=example_input, cache_dir=cache_dir,
+                                  reuse_weights=reuse_weights, device=str(device), fuse=fuse)
+    if device is not None:
+        with torch.device(device):
+            return build_network(architecture, builder=builder, fuse=fuse, checkpoint_segments=checkpoint_segments)
     layers = []
+    segments = []
     for block in architecture:
         assert len(block) == 1
         name, kwargs = list(block.items())[0]
-        if kwargs is None:
-            kwargs = {}
+        if name == CHECKPOINT_KEY:
+            start = len(layers)
+            layers.extend(build_network(kwargs, builder=builder, checkpoint_segments=0))
+            segments.append((start, len(layers)))
+            continue
+        # copied so that the architecture can be built again
+        kwargs = dict(kwargs or {})
         args = kwargs.pop("args", [])
         layers.append(builder(name, *args, **kwargs))
+    if checkpoint_segments:
+        segments = even_segments(len(layers), checkpoint_segments)
+    if fuse:
+        from mltoolkit.network_fusion import fuse_network
+        return fuse_network(torch.nn.Sequential(*layers))
+    if segments and checkpoint_segments != 0:
+        return CheckpointedSequential(*layers, segments=segments)
     return torch.nn.Sequential(*layers)
+
+
+@dataclasses.dataclass
+class NetworkSize:
+    parameters: int
+    trainable_parameters: int
+    parameter_bytes: int
+    buffer_bytes: int
+
+    @property
+    def total_bytes(self):
+        return self.parameter_bytes + self.buffer_bytes
+
+
+def network_size(network: torch.nn.Module) -> NetworkSize:
+    """
+    number of parameters and memory needed for the parameters and buffers of `network`. works on networks built on
+    the meta device, so sizes can be estimated without allocating anything
+    """
+    parameters = list(network.parameters())
+    return NetworkSize(parameters=sum(p.numel() for p in parameters),
+                       trainable_parameters=sum(p.numel() for p in parameters if p.requires_grad),
+                       parameter_bytes=sum(p.numel() * p.element_size() for p in parameters),
+                       buffer_bytes=sum(b.numel() * b.element_size() for b in network.buffers()))
+
+
+def estimate_network(architecture, builder=Builder(torch.nn.__dict__)) -> NetworkSize:
+    """
+    `network_size` of an architecture, built on the meta device
+    """
+    return network_size(build_network(architecture, builder=builder, device='meta'))
+
+
+def materialize(network: torch.nn.Module, state_dict=None, device='cpu', strict=True) -> torch.nn.Module:
+    """
+    allocates the parameters and buffers of a network built on the meta device. entries of `state_dict` are used as
+    the weights directly (no random initialization and no copy if they are already on `device`). modules missing any
+    of their tensors in `state_dict` are initialized with their `reset_parameters`, and then get the loaded tensors back
+    @param state_dict: weights to load, e.g. from `torch.load(..., mmap=True)`
+    @param device: device to allocate missing tensors on and move loaded tensors to
+    @param strict: require `state_dict` to match the keys of `network` exactly
+    :raises RuntimeError: if tensors missing from `state_dict` belong to modules without `reset_parameters`
+    :return: `network`, materialized in place
+    """
+    if state_dict is not None:
+        state_dict = {k: v.to(device) for k, v in state_dict.items()}
+        network.load_state_dict(state_dict, strict=strict, assign=True)
+
+    uninitialized = []
+    for module_name, module in network.named_modules():
+        tensors = [(name, tensor) for name, tensor in [*module._parameters.items(), *module._buffers.items()]
+                   if tensor is not None]
+        if not any(tensor.is_meta for _, tensor in tensors):
+            continue
+        if not hasattr(module, 'reset_parameters'):
+            prefix = f'{module_name}.' if module_name else ''
+            uninitialized.extend(prefix + name for name, tensor in tensors if tensor.is_meta)
+            continue
+        # loaded tensors are set aside, so that `reset_parameters` doesn't overwrite the state dict in place
+        loaded = [(name, tensor) for name, tensor in tensors if not tensor.is_meta]
+        for name, tensor in tensors:
+            _assign(module, name, torch.empty_like(tensor, device=device))
+        module.reset_parameters()
+        for name, tensor in loaded:
+            _assign(module, name, tensor)
+    if uninitialized:
+        raise RuntimeError(f'missing from the state dict and cannot be initialized: {", ".join(uninitialized)}')
+    return network
+
+
+def _assign(module, name, tensor):
+    if name in module._parameters:
+        if not isinstance(tensor, torch.nn.Parameter):
+            tensor = torch.nn.Parameter(tensor, requires_grad=module._parameters[name].requires_grad)
+        module._parameters[name] = tensor
+    else:
+        module._buffers[name] = tensor
@@ -0,0 +1,146 @@
+"""
+On-disk cache of TorchScript networks built by `build_network`. Scripting or tracing a network is paid once per
+architecture: later processes load the saved module instead. Entries are keyed by a canonical hash of the
+architecture, the code of the layer constructors it resolves through the builder and the torch version.
+"""
+import functools
+import hashlib
+import json
+import os
+import sys
+
+import torch
+
+from mltoolkit.network_checkpointing import CHECKPOINT_KEY
+
+# directory used to persist compiled networks across processes; disabled when unset
+NETWORK_CACHE_ENV = 'MLTOOLKIT_NETWORK_CACHE'
+
+JIT_MODES = ('script', 'trace')
+
+
+def _canonical(value):
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items(), key=lambda item: str(item[0]))}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return repr(value)
+
+
+@functools.lru_cache(maxsize=None)
+def _file_digest(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _code_identity(obj):
+    """
+    qualified name of a layer constructor plus the hash of the file defining it. torch's own layers are covered by
+    the torch version
+    """
+    module = getattr(obj, '__module__', None) or ''
+    identity = f'{module}.{getattr(obj, "__qualname__", repr(obj))}'
+    if module == 'torch' or module.startswith('torch.'):
+        return identity
+    source_file = getattr(sys.modules.get(module), '__file__', None)
+    return f'{identity}:{_file_digest(source_file) if source_file else None}'
+
+
+def _resolve(builder, name):
+    namespace = getattr(builder, '_namespace', None)
+    if namespace is None:
+        # plain builder function; its own code decides what gets built
+        return builder
+    return namespace.get(name, None)
+
+
+def _layer_names(architecture):
+    names = []
+    for block in architecture:
+        name, value = next(iter(block.items()))
+        names.extend(_layer_names(value) if name == CHECKPOINT_KEY else [name])
+    return names
+
+
+def architecture_key(architecture, builder, **options) -> str:
+    """
+    canonical hash of `architecture`, the constructors `builder` resolves its layer names to, the torch version and
+    any build `options` (e.g. the jit mode and example input shapes)
+    """
+    layers = _layer_names(architecture)
+    description = {
+        'architecture': _canonical(architecture),
+        'layers': {name: _code_identity(_resolve(builder, name)) for name in layers},
+        'torch': torch.__version__,
+        'options': _canonical(options),
+    }
+    encoded = json.dumps(description, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def jit_network(network: torch.nn.Module, mode='script', example_input=None) -> torch.jit.ScriptModule:
+    """
+    compiles `network` with `torch.jit.script` or, for mode 'trace', `torch.jit.trace` on `example_input`. traces
+    record the ops of a single mode, so networks are traced in eval mode
+    """
+    assert mode in JIT_MODES, f'unknown jit mode {mode}, expected one of {JIT_MODES}'
+    if mode == 'trace':
+        assert example_input is not None, 'example_input is required to trace a network'
+        network.eval()
+        with torch.no_grad():
+            return torch.jit.trace(network, example_input)
+    return torch.jit.script(network)
+
+
+def _input_signature(example_input):
+    if example_input is None:
+        return None
+    if isinstance(example_input, torch.Tensor):
+        return [list(example_input.shape), str(example_input.dtype), example_input.device.type]
+    return [_input_signature(item) for item in example_input]
+
+
+def cached_jit_network(build, architecture, builder, mode='script', example_input=None, cache_dir=None,
+                       reuse_weights=False, **options):
+    """
+    loads the compiled network of `architecture` from the cache, or builds it with `build()`, compiles it with
+    `jit_network` and stores it
+    @param build: callable returning the (uncompiled) network
+    @param cache_dir: directory to cache compiled networks in, defaults to $MLTOOLKIT_NETWORK_CACHE. the network is
+                      compiled on every call if neither is set
+    @param reuse_weights: keep the weights of the build that stored the cached network instead of loading the weights
+                          of a fresh `build()` into it. skips building, but ignores the caller's seed and initialization
+    @param options: other build options that change the compiled network (e.g. fusion)
+    """
+    cache_dir = cache_dir or os.environ.get(NETWORK_CACHE_ENV)
+    if not cache_dir:
+        return jit_network(build(), mode=mode, example_input=example_input)
+
+    key = architecture_key(architecture, builder, jit=mode, input=_input_signature(example_input), **options)
+    path = os.path.join(cache_dir, f'{key}.pt')
+    if os.path.exists(path):
+        try:
+            network = torch.jit.load(path)
+        except RuntimeError:
+            # partially written or corrupt entry
+            network = None
+        if network is not None:
+            if not reuse_weights:
+                network.load_state_dict(build().state_dict())
+            return network
+
+    network = jit_network(build(), mode=mode, example_input=example_input)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        torch.jit.save(network, tmp_path)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return network
@@ -0,0 +1,139 @@
+"""
+Activation checkpointing for networks built by `build_network`. Segments of the layer list run under
+`torch.utils.checkpoint` in training: only their input is kept for the backward pass and their activations are
+recomputed, trading compute for memory. Layers stay direct children of the network, so state dicts are the same as
+for a plain `torch.nn.Sequential`.
+"""
+import contextlib
+import dataclasses
+import threading
+from typing import List, Sequence, Tuple
+
+import torch
+from torch.utils.checkpoint import checkpoint
+
+# architecture block whose list of layers runs as one checkpointed segment
+CHECKPOINT_KEY = 'checkpoint'
+
+
+def even_segments(num_layers: int, num_segments: int) -> List[Tuple[int, int]]:
+    """
+    splits `num_layers` layers into `num_segments` contiguous segments of (almost) equal size. like
+    `torch.utils.checkpoint.checkpoint_sequential`, the last segment is not checkpointed since its activations are
+    needed right away by the backward pass
+    """
+    assert num_segments >= 1, 'at least one segment is required'
+    num_segments = min(num_segments, num_layers)
+    if num_segments == 0:
+        return []
+    bounds = [round(i * num_layers / num_segments) for i in range(num_segments + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(num_segments - 1)]
+
+
+# number of checkpointed segments recomputing their activations on this thread
+_RECOMPUTING = threading.local()
+
+
+def is_recomputing() -> bool:
+    """
+    whether a checkpointed segment of a `CheckpointedSequential` is recomputing its activations on this thread, i.e.
+    its layers are running a second time for the backward pass
+    """
+    return getattr(_RECOMPUTING, 'depth', 0) > 0
+
+
+@contextlib.contextmanager
+def _recomputing():
+    _RECOMPUTING.depth = getattr(_RECOMPUTING, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _RECOMPUTING.depth -= 1
+
+
+def _checkpoint_contexts():
+    # (forward, recomputation) contexts of `torch.utils.checkpoint.checkpoint`
+    return contextlib.nullcontext(), _recomputing()
+
+
+class CheckpointedSequential(torch.nn.Sequential):
+    """
+    `torch.nn.Sequential` whose layer ranges `segments` (list of [start, end) index pairs) run under activation
+    checkpointing in training. in eval mode or without gradients it behaves exactly like a `torch.nn.Sequential`
+    """
+
+    def __init__(self, *layers, segments: Sequence[Tuple[int, int]] = ()):
+        super().__init__(*layers)
+        self.segments = sorted((int(start), int(end)) for start, end in segments)
+        # (start, end, checkpointed) ranges covering every layer
+        plan, position = [], 0
+        for start, end in self.segments:
+            assert position <= start < end <= len(layers), f'invalid or overlapping checkpoint segment {start, end}'
+            if position < start:
+                plan.append((position, start, False))
+            plan.append((start, end, True))
+            position = end
+        if position < len(layers):
+            plan.append((position, len(layers), False))
+        self._plan = plan
+
+    def _run(self, x, start, end):
+        for layer in list(self._modules.values())[start:end]:
+            x = layer(x)
+        return x
+
+    def forward(self, x):
+        if not (self.training and torch.is_grad_enabled()):
+            return super().forward(x)
+        for start, end, checkpointed in self._plan:
+            if checkpointed:
+                x = checkpoint(self._run, x, start, end, use_reentrant=False, context_fn=_checkpoint_contexts)
+            else:
+                x = self._run(x, start, end)
+        return x
+
+
+@dataclasses.dataclass
+class ActivationMemory:
+    # bytes of activations kept for the backward pass at the peak of a training step
+    without_checkpointing: int
+    with_checkpointing: int
+    # output bytes of every layer, in order
+    layer_bytes: List[int]
+
+
+def activation_memory(network: torch.nn.Sequential, example_input, segments=None) -> ActivationMemory:
+    """
+    estimates the peak memory of the activations saved for the backward pass, approximated by the output sizes of
+    the layers, with and without checkpointing. without checkpointing every output is kept; with checkpointing only
+    the outputs of non-checkpointed layers and segment boundaries are kept, plus the recomputed activations of the
+    largest segment during its backward pass. pass a network built with `device='meta'` and a meta input to
+    estimate without computing or allocating anything
+    @param segments: segments to estimate for, defaults to the segments of a `CheckpointedSequential`
+    """
+    if segments is None:
+        segments = getattr(network, 'segments', [])
+    layer_bytes = []
+    # in eval mode, so that the example doesn't update batch norm statistics. submodules may be in different modes
+    modes = [(module, module.training) for module in network.modules()]
+    network.eval()
+    try:
+        with torch.no_grad():
+            x = example_input
+            for layer in network:
+                x = layer(x)
+                layer_bytes.append(x.numel() * x.element_size())
+    finally:
+        for module, training in modes:
+            module.training = training
+    input_bytes = example_input.numel() * example_input.element_size()
+
+    checkpointed = set()
+    largest_segment = 0
+    kept = input_bytes
+    for start, end in segments:
+        checkpointed.update(range(start, end - 1))
+        largest_segment = max(largest_segment, sum(layer_bytes[start:end - 1]))
+    kept += sum(size for i, size in enumerate(layer_bytes) if i not in checkpointed)
+    return ActivationMemory(without_checkpointing=input_bytes + sum(layer_bytes),
+                            with_checkpointing=kept + largest_segment, layer_bytes=layer_bytes)
@@ -0,0 +1,120 @@
+"""
+Inference-time layer fusion for networks built by `build_network`. Batch norms following a convolution or linear layer
+are folded into its weights, activations following them are applied in place on their output and layers that are
+no-ops in eval mode are dropped.
+"""
+import torch
+import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval
+
+_CONVS = (torch.nn.Conv1d, torch.nn.Conv2d, torch.nn.Conv3d)
+_TRANSPOSED_CONVS = (torch.nn.ConvTranspose1d, torch.nn.ConvTranspose2d, torch.nn.ConvTranspose3d)
+_BATCH_NORMS = (torch.nn.BatchNorm1d, torch.nn.BatchNorm2d, torch.nn.BatchNorm3d)
+
+# layers that don't do anything in eval mode
+_NO_OPS = (torch.nn.Identity, torch.nn.Dropout, torch.nn.Dropout1d, torch.nn.Dropout2d, torch.nn.Dropout3d,
+           torch.nn.AlphaDropout)
+
+
+# activations that can be applied in place on the output of the layer before them
+_INPLACE_ACTIVATIONS = (torch.nn.ReLU, torch.nn.ReLU6, torch.nn.Hardtanh, torch.nn.LeakyReLU, torch.nn.ELU,
+                        torch.nn.SiLU, torch.nn.Hardswish, torch.nn.Sigmoid, torch.nn.Tanh)
+
+
+class FusedActivation(torch.nn.Module):
+    """
+    a convolution or linear layer followed by an activation applied in place on its output, which saves allocating
+    and writing a second output tensor. inference only; supports TorchScript
+    """
+
+    def __init__(self, layer: torch.nn.Module, activation: torch.nn.Module):
+        super().__init__()
+        self.layer = layer
+        self.activation = activation
+        # ReLU6 is a Hardtanh with fixed bounds
+        self.kind = 'Hardtanh' if isinstance(activation, torch.nn.Hardtanh) else type(activation).__name__
+        self.min_val = float(getattr(activation, 'min_val', 0.))
+        self.max_val = float(getattr(activation, 'max_val', 0.))
+        self.negative_slope = float(getattr(activation, 'negative_slope', 0.))
+        self.alpha = float(getattr(activation, 'alpha', 0.))
+
+    def forward(self, x):
+        x = self.layer(x)
+        if self.kind == 'ReLU':
+            return torch.relu_(x)
+        if self.kind == 'Hardtanh':
+            return F.hardtanh_(x, self.min_val, self.max_val)
+        if self.kind == 'LeakyReLU':
+            return F.leaky_relu_(x, self.negative_slope)
+        if self.kind == 'ELU':
+            return F.elu_(x, self.alpha)
+        if self.kind == 'SiLU':
+            return F.silu(x, inplace=True)
+        if self.kind == 'Hardswish':
+            return F.hardswish(x, inplace=True)
+        if self.kind == 'Sigmoid':
+            return torch.sigmoid_(x)
+        return torch.tanh_(x)
+
+
+def _fuse_batch_norm(layer, batch_norm):
+    if not batch_norm.track_running_stats or batch_norm.running_mean is None:
+        return None
+    if isinstance(layer, _CONVS):
+        return fuse_conv_bn_eval(layer, batch_norm)
+    if isinstance(layer, _TRANSPOSED_CONVS):
+        return fuse_conv_bn_eval(layer, batch_norm, transpose=True)
+    if isinstance(layer, torch.nn.Linear) and isinstance(batch_norm, torch.nn.BatchNorm1d):
+        return fuse_linear_bn_eval(layer, batch_norm)
+    return None
+
+
+def fuse_network(network: torch.nn.Sequential) -> torch.nn.Sequential:
+    """
+    returns an inference-only copy of `network` with the following patterns fused:
+        - Conv / ConvTranspose / Linear -> BatchNorm: the batch norm is folded into the layer's weights and bias
+        - Conv / ConvTranspose / Linear -> ReLU, ReLU6, LeakyReLU, ELU, SiLU, Sigmoid, ...: the activation is applied
+          in place on the layer's output
+        - Identity and Dropout layers are dropped
+    `network` is put in eval mode. fused layers are new modules, all other layers are shared with `network`. the
+    result must not be trained
+    """
+    network.eval()
+    layers = [layer for layer in network if not isinstance(layer, _NO_OPS)]
+    fused = []
+    i = 0
+    while i < len(layers):
+        layer = layers[i]
+        i += 1
+        if not isinstance(layer, (*_CONVS, *_TRANSPOSED_CONVS, torch.nn.Linear)):
+            fused.append(layer)
+            continue
+        if i < len(layers) and isinstance(layers[i], _BATCH_NORMS):
+            folded = _fuse_batch_norm(layer, layers[i])
+            if folded is not None:
+                layer = folded
+                i += 1
+        if i < len(layers) and type(layers[i]) in _INPLACE_ACTIVATIONS:
+            layer = FusedActivation(layer, layers[i])
+            i += 1
+        fused.append(layer)
+    return torch.nn.Sequential(*fused).eval()
+
+
+def check_fusion(network: torch.nn.Module, fused: torch.nn.Module, example_input, rtol=1e-4, atol=1e-5):
+    """
+    asserts that `fused` computes the same outputs as `network` (in eval mode) on `example_input`
+    :return: largest absolute difference between the outputs
+    """
+    was_training = network.training
+    network.eval()
+    try:
+        with torch.no_grad():
+            expected = network(example_input)
+            actual = fused(example_input)
+    finally:
+        network.train(was_training)
+    difference = (expected - actual).abs().max().item() if expected.numel() else 0.
+    assert torch.allclose(expected, actual, rtol=rtol, atol=atol), \
+        f'fused network deviates from the original network by up to {difference}'
+    return difference
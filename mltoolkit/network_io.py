@@ -0,0 +1,117 @@
+"""
+Memory-mapped checkpoints for networks built by `build_network`. A checkpoint holds the architecture list and a flat,
+aligned blob of every tensor of the state dict, indexed by a header. Loading rebuilds the network on the meta device
+and maps the blob into its parameters without copying, so processes on one host loading the same checkpoint share
+the page cache instead of each holding a private copy of the weights.
+
+file layout: 8 byte magic | 8 byte little-endian header length | json header | padding | tensor data
+"""
+import ctypes
+import json
+import mmap
+import os
+import struct
+
+import torch
+
+from mltoolkit.network_builder import Builder, build_network, materialize
+
+_MAGIC = b'MLTNET\x00\x01'
+_HEADER_LENGTH = struct.Struct('<Q')
+# tensors start on cache line boundaries, the data section on a page boundary
+TENSOR_ALIGNMENT = 64
+DATA_ALIGNMENT = 4096
+
+
+def _align(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _dtype(name):
+    dtype = getattr(torch, name.rpartition('.')[2], None)
+    assert isinstance(dtype, torch.dtype), f'unknown tensor dtype {name}'
+    return dtype
+
+
+def save_network(path, network: torch.nn.Module, architecture):
+    """
+    writes `architecture` and the state dict of `network` (built from it) into a checkpoint at `path`. tensors that
+    share memory (e.g. tied weights) are stored once
+    """
+    entries = {}
+    tensors = []
+    # (storage, offset, shape, stride, dtype) -> index into `tensors`, so shared tensors are written once
+    written = {}
+    offset = 0
+    for name, tensor in network.state_dict().items():
+        identity = (tensor.untyped_storage().data_ptr(), tensor.storage_offset(), tuple(tensor.shape),
+                    tuple(tensor.stride()), tensor.dtype)
+        if identity not in written:
+            data = tensor.detach().to('cpu').contiguous()
+            written[identity] = len(tensors)
+            tensors.append((offset, data))
+            offset = _align(offset + data.numel() * data.element_size(), TENSOR_ALIGNMENT)
+        tensor_offset, data = tensors[written[identity]]
+        entries[name] = {'dtype': str(data.dtype), 'shape': list(data.shape), 'offset': tensor_offset}
+
+    header = json.dumps({'architecture': architecture, 'tensors': entries, 'torch': torch.__version__}).encode()
+    data_start = _align(len(_MAGIC) + _HEADER_LENGTH.size + len(header), DATA_ALIGNMENT)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(_HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        for tensor_offset, data in tensors:
+            f.seek(data_start + tensor_offset)
+            if data.numel():
+                f.write(ctypes.string_at(data.data_ptr(), data.numel() * data.element_size()))
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def _read_header(f):
+    magic = f.read(len(_MAGIC))
+    if magic != _MAGIC:
+        raise ValueError(f'{f.name} is not a network checkpoint')
+    length, = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+    header = json.loads(f.read(length))
+    return header, _align(len(_MAGIC) + _HEADER_LENGTH.size + length, DATA_ALIGNMENT)
+
+
+def load_checkpoint(path):
+    """
+    maps the checkpoint at `path` into memory
+    :return: (architecture, state dict). the state dict tensors are views of a private (copy-on-write) mapping of the
+             file: pages are read lazily and shared between processes until a tensor is written to
+    """
+    with open(path, 'rb') as f:
+        header, data_start = _read_header(f)
+        size = os.fstat(f.fileno()).st_size
+        # copy-on-write, so tensors are writable without ever modifying the file
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY) if size > 0 else b''
+    state_dict = {}
+    for name, entry in header['tensors'].items():
+        dtype = _dtype(entry['dtype'])
+        shape = entry['shape']
+        numel = 1
+        for dim in shape:
+            numel *= dim
+        if numel == 0:
+            state_dict[name] = torch.empty(shape, dtype=dtype)
+            continue
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=numel, offset=data_start + entry['offset'])
+        state_dict[name] = tensor.view(shape)
+    return header['architecture'], state_dict
+
+
+def load_network(path, builder=Builder(torch.nn.__dict__), device='cpu', strict=True, **build_kwargs):
+    """
+    rebuilds the network saved with `save_network`. the network is built on the meta device, so no weights are
+    allocated or initialized, and its parameters are assigned the memory-mapped tensors of the checkpoint (copied
+    only if `device` is not the cpu)
+    @param builder: builder resolving the layer names of the architecture
+    @param build_kwargs: other `build_network` arguments, e.g. `checkpoint_segments`
+    """
+    architecture, state_dict = load_checkpoint(path)
+    network = build_network(architecture, builder=builder, device='meta', **build_kwargs)
+    return materialize(network, state_dict, device=device, strict=strict)
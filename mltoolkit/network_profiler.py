@@ -0,0 +1,240 @@
+"""
+Per-layer profiling of networks built by `build_network`. Hooks on every layer record wall-time latency, output sizes,
+allocated memory (cuda only) and estimated FLOPs, keyed by the layer's index in the architecture list and its builder
+name. Recording can be limited to every n-th forward pass to keep the overhead low in production.
+"""
+import dataclasses
+import functools
+import operator
+import time
+from typing import List, Optional, Tuple
+
+import torch
+
+from mltoolkit.network_checkpointing import CHECKPOINT_KEY, is_recomputing
+
+
+def architecture_layer_names(architecture) -> List[Tuple[str, str]]:
+    """
+    (architecture index, builder name) of every layer `build_network` builds from `architecture`, in order. layers
+    nested in a checkpoint block are indexed `block.layer`
+    """
+    names = []
+    for i, block in enumerate(architecture):
+        name, value = next(iter(block.items()))
+        if name == CHECKPOINT_KEY:
+            names.extend((f'{i}.{j}', next(iter(inner))) for j, inner in enumerate(value))
+        else:
+            names.append((str(i), name))
+    return names
+
+
+def _prod(values):
+    # math.prod needs python 3.8
+    return functools.reduce(operator.mul, values, 1)
+
+
+def _tensors(value):
+    if isinstance(value, torch.Tensor):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [t for item in value for t in _tensors(item)]
+    if isinstance(value, dict):
+        return [t for item in value.values() for t in _tensors(item)]
+    return []
+
+
+def estimate_flops(module: torch.nn.Module, inputs, output) -> Optional[int]:
+    """
+    estimated floating point operations (a multiply-add counts as 2) of one call of `module`, None for unknown layers
+    """
+    tensors = _tensors(output)
+    if not tensors:
+        return None
+    out = tensors[0]
+    if isinstance(module, torch.nn.Linear):
+        return 2 * out.numel() * module.in_features
+    if isinstance(module, torch.nn.modules.conv._ConvTransposeNd):
+        x = _tensors(inputs)[0]
+        return 2 * x.numel() * (module.out_channels // module.groups) * _prod(module.kernel_size)
+    if isinstance(module, torch.nn.modules.conv._ConvNd):
+        return 2 * out.numel() * (module.in_channels // module.groups) * _prod(module.kernel_size)
+    if isinstance(module, (torch.nn.modules.batchnorm._BatchNorm, torch.nn.LayerNorm, torch.nn.GroupNorm)):
+        return 4 * out.numel()
+    if isinstance(module, (torch.nn.modules.pooling._MaxPoolNd, torch.nn.modules.pooling._AvgPoolNd)):
+        kernel_size = module.kernel_size
+        return out.numel() * _prod(kernel_size if isinstance(kernel_size, tuple) else
+                                       (kernel_size,) * (out.dim() - 2))
+    if type(module).__name__ == 'FusedActivation':
+        layer_flops = estimate_flops(module.layer, inputs, output)
+        return None if layer_flops is None else layer_flops + out.numel()
+    if isinstance(module, (torch.nn.ReLU, torch.nn.ReLU6, torch.nn.LeakyReLU, torch.nn.ELU, torch.nn.GELU,
+                           torch.nn.SiLU, torch.nn.Sigmoid, torch.nn.Tanh, torch.nn.Hardtanh, torch.nn.Hardswish,
+                           torch.nn.Softmax, torch.nn.LogSoftmax)):
+        return out.numel()
+    if isinstance(module, (torch.nn.Flatten, torch.nn.Identity, torch.nn.Dropout, torch.nn.Unflatten)):
+        return 0
+    return None
+
+
+@dataclasses.dataclass
+class LayerStats:
+    index: str
+    name: str
+    # recorded (sampled) forward calls
+    calls: int = 0
+    forward_seconds: float = 0.
+    backward_calls: int = 0
+    backward_seconds: float = 0.
+    output_shape: Optional[Tuple[int, ...]] = None
+    output_bytes: int = 0
+    # change of allocated device memory over the forward call (cuda only)
+    memory_delta: Optional[int] = None
+    flops: Optional[int] = None
+    # clock and allocator readings of the call in flight
+    _start: float = dataclasses.field(default=0., repr=False)
+    _backward_start: Optional[float] = dataclasses.field(default=None, repr=False)
+    _memory_before: int = dataclasses.field(default=0, repr=False)
+
+    @property
+    def mean_forward_ms(self):
+        return 1000 * self.forward_seconds / self.calls if self.calls else 0.
+
+    @property
+    def mean_backward_ms(self):
+        return 1000 * self.backward_seconds / self.backward_calls if self.backward_calls else 0.
+
+
+class NetworkProfiler:
+    """
+    forward (and optionally backward) hooks on every layer of a `torch.nn.Sequential`
+    """
+
+    def __init__(self, network: torch.nn.Sequential, layer_names=None, sample_every=1, backward=False,
+                 synchronize=True):
+        """
+        @param layer_names: (index, name) of every layer, e.g. from `architecture_layer_names`; defaults to the child
+                            index and class name
+        @param sample_every: only record every n-th forward pass of the network
+        @param backward: also time backward passes; full backward hooks don't allow layers that modify their input
+                         in place (e.g. `ReLU(inplace=True)`)
+        @param synchronize: synchronize cuda before reading the clock, so that latencies include the kernels
+        """
+        layers = list(network)
+        if layer_names is None:
+            layer_names = [(str(i), type(layer).__name__) for i, layer in enumerate(layers)]
+        assert len(layer_names) == len(layers), 'one name is required per layer'
+        self.stats = [LayerStats(index=index, name=name) for index, name in layer_names]
+        self.sample_every = sample_every
+        self.synchronize = synchronize
+        self._forward_calls = 0
+        self._active = False
+        self._handles = [network.register_forward_pre_hook(self._network_pre_hook)]
+        for layer, stats in zip(layers, self.stats):
+            self._handles.append(layer.register_forward_pre_hook(self._pre_hook(stats)))
+            self._handles.append(layer.register_forward_hook(self._hook(stats)))
+            if backward:
+                self._handles.append(layer.register_full_backward_pre_hook(self._backward_pre_hook(stats)))
+                self._handles.append(layer.register_full_backward_hook(self._backward_hook(stats)))
+
+    def _recording(self):
+        # checkpointed segments run their layers a second time in the backward pass, which would count them twice
+        return self._active and not is_recomputing()
+
+    def _network_pre_hook(self, network, args):
+        self._active = self._forward_calls % self.sample_every == 0
+        self._forward_calls += 1
+
+    def _clock(self, tensors):
+        if self.synchronize and tensors and tensors[0].is_cuda:
+            torch.cuda.synchronize(tensors[0].device)
+        return time.perf_counter()
+
+    def _pre_hook(self, stats):
+        def hook(layer, args):
+            if not self._recording():
+                return
+            tensors = _tensors(args)
+            if tensors and tensors[0].is_cuda:
+                stats._memory_before = torch.cuda.memory_allocated(tensors[0].device)
+            stats._start = self._clock(tensors)
+
+        return hook
+
+    def _hook(self, stats):
+        def hook(layer, args, output):
+            if not self._recording():
+                return
+            tensors = _tensors(output)
+            stats.forward_seconds += self._clock(tensors) - stats._start
+            stats.calls += 1
+            if tensors:
+                stats.output_shape = tuple(tensors[0].shape)
+                stats.output_bytes = sum(t.numel() * t.element_size() for t in tensors)
+                if tensors[0].is_cuda:
+                    stats.memory_delta = torch.cuda.memory_allocated(tensors[0].device) - stats._memory_before
+            stats.flops = estimate_flops(layer, args, output)
+
+        return hook
+
+    def _backward_pre_hook(self, stats):
+        def hook(layer, grad_output):
+            stats._backward_start = self._clock(_tensors(grad_output))
+
+        return hook
+
+    def _backward_hook(self, stats):
+        def hook(layer, grad_input, grad_output):
+            start = stats._backward_start
+            if start is not None:
+                stats.backward_seconds += self._clock(_tensors(grad_input)) - start
+                stats.backward_calls += 1
+                stats._backward_start = None
+
+        return hook
+
+    def reset(self):
+        for stats in self.stats:
+            stats.calls = stats.backward_calls = 0
+            stats.forward_seconds = stats.backward_seconds = 0.
+        self._forward_calls = 0
+
+    def remove(self):
+        """
+        detaches all hooks from the network
+        """
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+    def summary(self) -> str:
+        """
+        table of the recorded statistics of every layer. the memory column is only shown for networks on cuda
+        """
+        show_memory = any(stats.memory_delta is not None for stats in self.stats)
+        header = f'{"index":>6}  {"layer":<20} {"calls":>6} {"fwd ms":>9} {"bwd ms":>9} {"GFLOPs":>8} ' \
+                 f'{"out MB":>8} ' + (f'{"mem MB":>8} ' if show_memory else '') + ' output shape'
+        rows = [header, '-' * len(header)]
+        total_ms = sum(stats.mean_forward_ms for stats in self.stats) or 1.
+        for stats in self.stats:
+            flops = '-' if stats.flops is None else f'{stats.flops / 1e9:.3f}'
+            memory = '-' if stats.memory_delta is None else f'{stats.memory_delta / 2 ** 20:.2f}'
+            rows.append(f'{stats.index:>6}  {stats.name[:20]:<20} {stats.calls:>6} '
+                        f'{stats.mean_forward_ms:>9.3f} {stats.mean_backward_ms:>9.3f} {flops:>8} '
+                        f'{stats.output_bytes / 2 ** 20:>8.2f} ' + (f'{memory:>8} ' if show_memory else '') +
+                        f' {stats.output_shape or "-"} ({100 * stats.mean_forward_ms / total_ms:.0f}%)')
+        return '\n'.join(rows)
+
+    def __str__(self):
+        return self.summary()
+
+
+def profile_network(network: torch.nn.Sequential, architecture=None, sample_every=1, backward=False,
+                    synchronize=True) -> NetworkProfiler:
+    """
+    attaches a `NetworkProfiler` to `network`. pass the `architecture` it was built from to key the statistics by
+    architecture index and builder name
+    """
+    layer_names = architecture_layer_names(architecture) if architecture is not None else None
+    return NetworkProfiler(network, layer_names=layer_names, sample_every=sample_every, backward=backward,
+                           synchronize=synchronize)
@@ -0,0 +1,217 @@
+"""
+Local index of runs keyed by config fingerprint. Launchers and sweeps record the status and output path of every
+configuration they run, so configurations that already finished can be skipped after a restart or preemption.
+"""
+import dataclasses
+import os
+import socket
+import sqlite3
+import time
+from typing import Iterable, Iterator, List, Optional
+
+from mltoolkit.argparser import _is_argclass_instance
+from mltoolkit.serialization import canonical_json, fingerprint
+
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+
+@dataclasses.dataclass
+class RunRecord:
+    fingerprint: str
+    status: str
+    output_path: Optional[str]
+    config: Optional[str]
+    created: float
+    updated: float
+    # host:pid:start time of the process that claimed the run
+    owner: Optional[str] = None
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    fingerprint TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    output_path TEXT,
+    config TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_status ON runs (status);
+"""
+
+
+def _process_start(pid):
+    """
+    start time of process `pid` in clock ticks since boot (linux only), None if unknown
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # fields after the command name, which is in parentheses and may contain spaces
+            return int(f.read().rpartition(')')[2].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_owner(pid=None) -> str:
+    """
+    identifies process `pid` (this process by default) across hosts and pid reuse
+    """
+    pid = pid if pid is not None else os.getpid()
+    start = _process_start(pid)
+    return f'{socket.gethostname()}:{pid}:{start if start is not None else ""}'
+
+
+def owner_alive(owner) -> bool:
+    """
+    whether the process identified by `owner` (see `process_owner`) is still running. processes on other hosts, and
+    records without an owner, are assumed to be alive
+    """
+    if not owner or os.name != 'posix':
+        return True
+    host, pid, start = owner.rsplit(':', 2)
+    if host != socket.gethostname():
+        return True
+    pid = int(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # the pid may have been reused by another process since
+    return not start or _process_start(pid) == int(start)
+
+
+class RunIndex:
+    """
+    sqlite backed map from config fingerprints to run status and output path. safe to share between the processes
+    of a sweep on one host
+    """
+
+    def __init__(self, path, timeout=30.0):
+        """
+        @param path: sqlite database file, created if it doesn't exist
+        @param timeout: seconds to wait for other processes holding the database lock
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        # indexes created before runs recorded their owner
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(runs)')]
+            if 'owner' not in columns:
+                self._conn.execute('ALTER TABLE runs ADD COLUMN owner TEXT')
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _key(config_or_fingerprint):
+        if _is_argclass_instance(config_or_fingerprint):
+            return fingerprint(config_or_fingerprint)
+        return config_or_fingerprint
+
+    def get(self, config) -> Optional[RunRecord]:
+        """
+        record of argclass (or fingerprint) `config`, None if it never ran
+        """
+        row = self._conn.execute('SELECT * FROM runs WHERE fingerprint = ?', (self._key(config),)).fetchone()
+        return RunRecord(*row) if row is not None else None
+
+    def mark(self, config, status, output_path=None) -> str:
+        """
+        records `status` (and `output_path` if given) for argclass `config`
+        :return: fingerprint of `config`
+        """
+        assert _is_argclass_instance(config), 'runs can only be recorded for argclass instances'
+        config_json = canonical_json(config)
+        key = fingerprint(config)
+        now = time.time()
+        self._conn.execute(
+            'INSERT INTO runs (fingerprint, status, output_path, config, created, updated) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(fingerprint) DO UPDATE SET status = excluded.status, '
+            'output_path = COALESCE(excluded.output_path, runs.output_path), updated = excluded.updated',
+            (key, status, output_path, config_json, now, now))
+        return key
+
+    def claim(self, config, stale_after=None) -> bool:
+        """
+        atomically marks `config` as running unless it already finished or another process is running it. the claim
+        records the claiming process, and runs whose process has died on this host (e.g. killed or preempted) may be
+        claimed again
+        @param stale_after: seconds after which a `running` record counts as abandoned even if its process is alive or
+                            ran on another host; such records are only reclaimed once their process died if None
+        :return: True if the caller should run `config`
+        """
+        key = fingerprint(config)
+        now = time.time()
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._conn.execute('SELECT status, updated, owner FROM runs WHERE fingerprint = ?',
+                                     (key,)).fetchone()
+            if row is not None and (row[0] == FINISHED or (row[0] == RUNNING and owner_alive(row[2]) and (
+                    stale_after is None or now - row[1] < stale_after))):
+                self._conn.execute('COMMIT')
+                return False
+            self._conn.execute(
+                'INSERT INTO runs (fingerprint, status, output_path, config, created, updated, owner) '
+                'VALUES (?, ?, NULL, ?, ?, ?, ?) '
+                'ON CONFLICT(fingerprint) DO UPDATE SET status = excluded.status, updated = excluded.updated, '
+                'owner = excluded.owner',
+                (key, RUNNING, canonical_json(config), now, now, process_owner()))
+            self._conn.execute('COMMIT')
+            return True
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+
+    def is_finished(self, config) -> bool:
+        record = self.get(config)
+        return record is not None and record.status == FINISHED
+
+    def pending(self, configs: Iterable, skip_statuses=(FINISHED,)) -> Iterator:
+        """
+        lazily filters `configs` (e.g. a `sweep`) down to the ones without a record in `skip_statuses`
+        """
+        for config in configs:
+            record = self.get(config)
+            if record is None or record.status not in skip_statuses:
+                yield config
+
+    def query(self, status=None, limit=None) -> List[RunRecord]:
+        """
+        records with `status` (all records if None), most recently updated first
+        """
+        sql = 'SELECT * FROM runs'
+        params = []
+        if status is not None:
+            sql += ' WHERE status = ?'
+            params.append(status)
+        sql += ' ORDER BY updated DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [RunRecord(*row) for row in self._conn.execute(sql, params)]
+
+    def remove(self, config):
+        self._conn.execute('DELETE FROM runs WHERE fingerprint = ?', (self._key(config),))
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,236 @@
+"""
+Compiled argument schemas. Walking an argclass tree with `get_type_hints` and `dataclasses.fields` is expensive for
+large nested configs, so every class is compiled once into a flat table of dotted field paths which the parser and
+config helpers read from.
+"""
+import dataclasses
+import hashlib
+import os
+import pickle
+import sys
+from enum import Enum
+from inspect import isclass
+from typing import Any, Dict, List, Optional, Union, get_type_hints
+
+# bump whenever the layout of `FieldSpec` / `ArgumentSchema` changes so stale disk caches are ignored
+SCHEMA_VERSION = 2
+
+# directory used to persist compiled schemas across processes; disabled when unset
+SCHEMA_CACHE_ENV = 'MLTOOLKIT_SCHEMA_CACHE'
+
+
+@dataclasses.dataclass
+class FieldSpec:
+    """
+    a single leaf argument of a compiled schema
+    """
+    path: str
+    name: str
+    type: Any
+    kind: str  # one of 'enum', 'bool', 'list', 'value'
+    default: Any = dataclasses.MISSING
+    default_factory: Any = dataclasses.MISSING
+    metadata: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    group: Optional[str] = None
+    # declared as `Optional[X]`
+    optional: bool = False
+
+    def __setstate__(self, state):
+        # dataclasses.MISSING is compared by identity and does not survive pickling
+        for key in ('default', 'default_factory'):
+            if isinstance(state[key], type(dataclasses.MISSING)):
+                state[key] = dataclasses.MISSING
+        self.__dict__.update(state)
+
+    @property
+    def required(self):
+        return self.default is dataclasses.MISSING and self.default_factory is dataclasses.MISSING
+
+    def get_default(self):
+        if self.default_factory is not dataclasses.MISSING:
+            return self.default_factory()
+        if self.default is not dataclasses.MISSING:
+            return self.default
+        return None
+
+
+@dataclasses.dataclass
+class ArgumentSchema:
+    """
+    flat table of every public leaf field in an argclass tree, keyed by dotted path
+    """
+    dataclass_type: Any
+    fields: Dict[str, FieldSpec]
+    # dotted paths of nested argclass fields mapped to their class
+    nested: Dict[str, Any]
+    # names accepted by the top-level constructor
+    init_names: List[str]
+
+    @property
+    def paths(self):
+        return self.fields.keys()
+
+
+_SCHEMAS: Dict[Any, ArgumentSchema] = {}
+
+
+def _resolve_type(field_type, name):
+    """
+    unwraps `Optional[X]` and `Union[X, str]` into the single type the argument parser works with
+    """
+    origin_type = getattr(field_type, "__origin__", field_type)
+    if origin_type is Union:
+        if str not in field_type.__args__ and (
+                len(field_type.__args__) != 2 or type(None) not in field_type.__args__
+        ):
+            raise ValueError(
+                "Only `Union[X, NoneType]` (i.e., `Optional[X]`) is allowed for `Union` because"
+                " the argument parser only supports one type per argument."
+                f" Problem encountered in field '{name}'."
+            )
+        if type(None) not in field_type.__args__:
+            # filter `str` in Union
+            field_type = field_type.__args__[0] if field_type.__args__[1] == str else field_type.__args__[1]
+        elif bool not in field_type.__args__:
+            # filter `NoneType` in Union (except for `Union[bool, NoneType]`)
+            field_type = (
+                field_type.__args__[0] if isinstance(None, field_type.__args__[1]) else field_type.__args__[1]
+            )
+    return field_type
+
+
+def _field_kind(field_type):
+    origin_type = getattr(field_type, "__origin__", field_type)
+    if isinstance(field_type, type) and issubclass(field_type, Enum):
+        return 'enum'
+    elif field_type is bool or field_type == Optional[bool]:
+        return 'bool'
+    elif isclass(origin_type) and issubclass(origin_type, list):
+        return 'list'
+    return 'value'
+
+
+def _compile_fields(dtype, schema, parent=''):
+    try:
+        type_hints: Dict[str, type] = get_type_hints(dtype)
+    except NameError:
+        raise RuntimeError(
+            f"Type resolution failed for f{dtype}. Try declaring the class in global scope or "
+            "removing line of `from __future__ import annotations` which opts in Postponed "
+            "Evaluation of Annotations (PEP 563)"
+        )
+    group = getattr(dtype, "_argument_group_name", None)
+
+    for field in dataclasses.fields(dtype):
+        # ignore arguments with _ in beginning
+        if not field.init or field.name.startswith('_'):
+            continue
+        path = f'{parent}{field.name}'
+        hint = type_hints[field.name]
+        field_type = _resolve_type(hint, field.name)
+        if dataclasses.is_dataclass(field_type):
+            schema.nested[path] = field_type
+            _compile_fields(field_type, schema, parent=f'{path}.')
+            continue
+        schema.fields[path] = FieldSpec(path=path, name=field.name, type=field_type, kind=_field_kind(field_type),
+                                        default=field.default, default_factory=field.default_factory,
+                                        metadata=dict(field.metadata), group=group,
+                                        optional=getattr(hint, '__origin__', None) is Union
+                                        and type(None) in hint.__args__)
+
+
+def _source_digest(klass):
+    """
+    hash of the source file that defines `klass`, or None if it has no file on disk
+    """
+    source_file = getattr(sys.modules.get(klass.__module__), '__file__', None)
+    if source_file is None:
+        return None
+    try:
+        with open(source_file, 'rb') as f:
+            return source_file, hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _schema_sources(schema):
+    classes = [schema.dataclass_type, *schema.nested.values()]
+    sources = {}
+    for klass in classes:
+        for base in klass.__mro__:
+            if base is object:
+                continue
+            digest = _source_digest(base)
+            if digest is None:
+                return None
+            sources[digest[0]] = digest[1]
+    return sources
+
+
+def schema_key(dtype):
+    """
+    cache key of `dtype`: its qualified name plus the hash of the source file defining it.
+    returns None if the class has no source file (e.g. defined in a REPL)
+    """
+    digest = _source_digest(dtype)
+    if digest is None:
+        return None
+    key = f'{SCHEMA_VERSION}:{sys.version_info[:2]}:{dtype.__module__}.{dtype.__qualname__}:{digest[1]}'
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _load_cached(path, dtype):
+    try:
+        with open(path, 'rb') as f:
+            sources, schema = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, AttributeError, ImportError, EOFError, ValueError):
+        return None
+    # bases and nested argclasses may live in other files, which must be unchanged too
+    if schema.dataclass_type is not dtype or _schema_sources(schema) != sources:
+        return None
+    return schema
+
+
+def _store_cached(path, schema):
+    sources = _schema_sources(schema)
+    if sources is None:
+        return
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((sources, schema), f)
+        os.replace(tmp_path, path)
+    except (OSError, pickle.PicklingError, AttributeError, TypeError):
+        # locally defined types or factories can't be pickled; the in-memory schema is still used
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def compile_schema(dataclass_type, cache_dir=None) -> ArgumentSchema:
+    """
+    compiles (or returns the memoized) flat schema of `dataclass_type`
+    @param dataclass_type: argclass to compile
+    @param cache_dir: directory to persist compiled schemas in, defaults to $MLTOOLKIT_SCHEMA_CACHE
+    """
+    schema = _SCHEMAS.get(dataclass_type)
+    if schema is not None:
+        return schema
+
+    cache_dir = cache_dir or os.environ.get(SCHEMA_CACHE_ENV)
+    cache_path = None
+    if cache_dir:
+        key = schema_key(dataclass_type)
+        if key is not None:
+            cache_path = os.path.join(cache_dir, f'{key}.schema')
+            schema = _load_cached(cache_path, dataclass_type)
+
+    if schema is None:
+        schema = ArgumentSchema(dataclass_type=dataclass_type, fields={}, nested={},
+                                init_names=[f.name for f in dataclasses.fields(dataclass_type) if f.init])
+        _compile_fields(dataclass_type, schema)
+        if cache_path is not None:
+            _store_cached(cache_path, schema)
+
+    _SCHEMAS[dataclass_type] = schema
+    return schema
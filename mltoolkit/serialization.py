@@ -0,0 +1,351 @@
+"""
+Streaming serialization of argclasses. Configs are written field by field straight into a text stream instead of being
+converted into an intermediate dictionary first. Also provides canonical encodings and content fingerprints of configs
+and a compact schema-driven binary encoding for shipping configs to worker processes.
+"""
+import dataclasses
+import functools
+import hashlib
+import json
+import math
+import operator
+import os
+import pickle
+from enum import Enum
+
+import yaml
+
+from mltoolkit.argparser import _field_names, _is_argclass_instance, asdict
+from mltoolkit.schema import compile_schema
+
+_OPEN, _VALUE, _CLOSE = range(3)
+
+
+def _walk(c, skip_private):
+    """
+    iteratively walks the fields of `c` depth first. yields (_OPEN, name, None, depth) before the fields of a nested
+    argclass, (_CLOSE, None, None, depth) after them and (_VALUE, name, value, depth) for every other field
+    """
+    stack = [(c, iter(_field_names(type(c))))]
+    while stack:
+        obj, names = stack[-1]
+        for name in names:
+            if skip_private and name.startswith('_'):
+                continue
+            val = getattr(obj, name, None)
+            if _is_argclass_instance(val):
+                yield _OPEN, name, None, len(stack)
+                stack.append((val, iter(_field_names(type(val)))))
+                break
+            yield _VALUE, name, val, len(stack)
+        else:
+            stack.pop()
+            if stack:
+                yield _CLOSE, None, None, len(stack)
+
+
+def _json_default(obj):
+    if isinstance(obj, Enum):
+        return obj.value
+    if _is_argclass_instance(obj):
+        return asdict(obj)
+    return str(obj)
+
+
+_JSON_ENCODER = json.JSONEncoder(default=_json_default)
+_encode_json_key = functools.lru_cache(maxsize=None)(json.encoder.encode_basestring_ascii)
+
+
+def dump_json(c, stream, indent=None, skip_private=True):
+    """
+    writes argclass `c` as json into text stream `stream`
+    @param indent: indentation of nested argclasses, written on a single line if None
+    @param skip_private: leave out fields starting with `_` (e.g. `_device`, `_run`)
+    """
+    newline = '' if indent is None else '\n'
+    separator = ', ' if indent is None else ','
+    first = True
+    stream.write('{')
+    for kind, name, val, depth in _walk(c, skip_private):
+        if kind == _CLOSE:
+            stream.write('}' if first else f'{newline}{" " * (indent or 0) * depth}}}')
+            first = False
+            continue
+        if not first:
+            stream.write(separator)
+        stream.write(f'{newline}{" " * (indent or 0) * depth}{_encode_json_key(name)}: ')
+        if kind == _OPEN:
+            stream.write('{')
+            first = True
+        else:
+            stream.write(json.encoder.encode_basestring_ascii(val) if type(val) is str
+                         else int.__repr__(val) if type(val) is int else _JSON_ENCODER.encode(val))
+            first = False
+    stream.write(f'{newline}}}')
+
+
+@functools.lru_cache(maxsize=None)
+def _yaml_key(name):
+    # names like `yes`, `null` or `1` would not load back as strings when written plain
+    if yaml.resolver.Resolver().resolve(yaml.ScalarNode, name, (True, False)) == 'tag:yaml.org,2002:str' \
+            and name and name[0].isalpha() and all(ch.isalnum() or ch in '_-' for ch in name):
+        return name
+    return json.dumps(name, ensure_ascii=False)
+
+
+def _yaml_float(val):
+    if math.isnan(val):
+        return '.nan'
+    if math.isinf(val):
+        return '.inf' if val > 0 else '-.inf'
+    text = repr(val)
+    # yaml 1.1 only resolves exponent floats with a decimal point
+    if '.' not in text and 'e' in text:
+        text = text.replace('e', '.0e', 1)
+    return text
+
+
+def _yaml_flow(val):
+    if val is None:
+        return 'null'
+    if val is True or val is False:
+        return 'true' if val else 'false'
+    if isinstance(val, int) and not isinstance(val, Enum):
+        return str(val)
+    if isinstance(val, float):
+        return _yaml_float(val)
+    if isinstance(val, str):
+        return json.dumps(val, ensure_ascii=False)
+    if isinstance(val, Enum):
+        return _yaml_flow(val.value)
+    if isinstance(val, (list, tuple)):
+        return '[' + ', '.join(_yaml_flow(item) for item in val) + ']'
+    if isinstance(val, dict):
+        return '{' + ', '.join(f'{_yaml_flow(k)}: {_yaml_flow(v)}' for k, v in val.items()) + '}'
+    if _is_argclass_instance(val):
+        return _yaml_flow(asdict(val))
+    return _yaml_flow(str(val))
+
+
+def dump_yaml(c, stream, skip_private=True):
+    """
+    writes argclass `c` as block-style yaml into text stream `stream`. nested argclasses become nested mappings,
+    all other values are written in flow style
+    @param skip_private: leave out fields starting with `_` (e.g. `_device`, `_run`)
+    """
+    pending_open = False
+    for kind, name, val, depth in _walk(c, skip_private):
+        if kind == _CLOSE:
+            # nested argclass without any fields
+            stream.write(' {}\n' if pending_open else '')
+            pending_open = False
+            continue
+        if pending_open:
+            stream.write('\n')
+        stream.write(f'{"  " * (depth - 1)}{_yaml_key(name)}:')
+        if kind == _OPEN:
+            pending_open = True
+        else:
+            stream.write(f' {_yaml_flow(val)}\n')
+            pending_open = False
+
+
+def _canonical(val):
+    if _is_argclass_instance(val):
+        return {name: _canonical(getattr(val, name)) for name in _field_names(type(val)) if not name.startswith('_')}
+    if val is None or isinstance(val, (bool, str)):
+        return val
+    if isinstance(val, Enum):
+        return _canonical(val.value)
+    if isinstance(val, int):
+        return int(val)
+    if isinstance(val, float):
+        # 1 and 1.0 (e.g. `lr: 1` vs `lr: 1.0` in a config file) describe the same value
+        return int(val) if val.is_integer() else val
+    if isinstance(val, dict):
+        return {str(k): _canonical(v) for k, v in val.items()}
+    if isinstance(val, (list, tuple)):
+        return [_canonical(item) for item in val]
+    if isinstance(val, (set, frozenset)):
+        return sorted((_canonical(item) for item in val), key=lambda item: json.dumps(item, sort_keys=True))
+    if isinstance(val, os.PathLike):
+        return os.fspath(val)
+    raise TypeError(f'cannot fingerprint value of type {type(val).__name__}: {val!r}')
+
+
+def canonical_json(c):
+    """
+    canonical json encoding of argclass `c`: private fields (e.g. `_device`, `_run`) are left out, keys are sorted
+    and numbers are written in a single normalized form
+    """
+    return json.dumps(_canonical(c), sort_keys=True, separators=(',', ':'), ensure_ascii=True)
+
+
+def fingerprint(c):
+    """
+    stable content hash of argclass `c`, independent of field order, float formatting and private fields
+    """
+    return hashlib.sha256(canonical_json(c).encode()).hexdigest()
+
+
+# binary format: magic + format version, 8 byte schema digest, then a pickled flat list of the values of every argclass
+# in the tree, depth first: its public leaf fields in declaration order and, if it has nested argclass fields, a bitmap
+# of the ones holding the declared argclass followed by the values of the others, then the nested argclasses. field
+# names, classes and the per-object pickle overhead are implied by the schema, and pickle's C encoder packs the leaves
+_BINARY_MAGIC = b'MLTB'
+_BINARY_VERSION = 2
+_HEADER_SIZE = len(_BINARY_MAGIC) + 1 + 8
+
+
+def _getter(names):
+    # tuple of the values of `names`; `attrgetter` returns a bare value for a single name
+    if len(names) > 1:
+        return operator.attrgetter(*names)
+    if names:
+        name = names[0]
+        return lambda obj: (getattr(obj, name),)
+    return lambda obj: ()
+
+
+class _BinaryLayout:
+    """
+    how instances of an argclass are encoded and decoded
+    """
+    __slots__ = ('cls', 'leaves', 'get_leaves', 'nested', 'defaults', 'factories', 'slotted', 'construct', 'digest')
+
+    def __init__(self, cls, leaves, nested):
+        self.cls = cls
+        self.leaves = tuple(leaves)
+        self.get_leaves = _getter(self.leaves)
+        # (bit, name, declared argclass, its layout) of every nested argclass field
+        self.nested = nested
+        # fields that aren't encoded (private ones) take their defaults when decoding
+        encoded = {*self.leaves, *(name for _, name, _, _ in nested)}
+        self.defaults = {}
+        self.factories = []
+        for field in dataclasses.fields(cls):
+            if field.name in encoded:
+                continue
+            if field.default_factory is not dataclasses.MISSING:
+                self.factories.append((field.name, field.default_factory))
+            elif field.default is not dataclasses.MISSING:
+                self.defaults[field.name] = field.default
+        # slot descriptors take precedence over the instance dictionary, so slotted fields are set one by one
+        self.slotted = any('__slots__' in vars(base) for base in cls.__mro__[:-1])
+        # fields set by `__post_init__` (init=False) aren't encoded, so such classes are still decoded by calling them
+        self.construct = any(not field.init for field in dataclasses.fields(cls))
+        self.digest = None
+
+
+_BINARY_LAYOUTS = {}
+
+
+def _binary_layout(cls):
+    layout = _BINARY_LAYOUTS.get(cls)
+    if layout is not None:
+        return layout
+    schema = compile_schema(cls)
+    names = [name for name in schema.init_names if not name.startswith('_')]
+    leaves = [name for name in names if name not in schema.nested]
+    nested = tuple((1 << i, name, schema.nested[name], _binary_layout(schema.nested[name]))
+                   for i, name in enumerate(name for name in names if name in schema.nested))
+    layout = _BINARY_LAYOUTS[cls] = _BinaryLayout(cls, leaves, nested)
+    # digest of the field names and types of the whole tree, so data is never decoded with a changed schema
+    description = [f'{cls.__module__}.{cls.__qualname__}']
+    description.extend(f'{name}:{schema.fields[name].type!r}' for name in leaves)
+    description.extend(f'{name}:{nested_layout.digest.hex()}' for _, name, _, nested_layout in nested)
+    layout.digest = hashlib.sha256('\n'.join(description).encode()).digest()[:8]
+    return layout
+
+
+def _write_binary(out, obj, layout):
+    out += layout.get_leaves(obj)
+    if not layout.nested:
+        return
+    index = len(out)
+    out.append(0)
+    declared = 0
+    for bit, name, nested_cls, _ in layout.nested:
+        value = getattr(obj, name)
+        if type(value) is nested_cls:
+            declared |= bit
+        else:
+            # e.g. None or an instance of a subclass, which the declared layout doesn't describe
+            out.append(value)
+    out[index] = declared
+    for bit, name, _, nested_layout in layout.nested:
+        if declared & bit:
+            _write_binary(out, getattr(obj, name), nested_layout)
+
+
+def dumps(c) -> bytes:
+    """
+    encodes argclass `c` into a compact binary representation using its schema: field names and classes are implied by
+    the schema and only the values are written. private fields (e.g. `_device`, `_run`) are not encoded. the encoding
+    can only be decoded with an identical schema, see `loads`
+    """
+    assert _is_argclass_instance(c), 'only argclass instances can be encoded'
+    layout = _binary_layout(type(c))
+    values = []
+    _write_binary(values, c, layout)
+    return _BINARY_MAGIC + bytes([_BINARY_VERSION]) + layout.digest + pickle.dumps(values, pickle.HIGHEST_PROTOCOL)
+
+
+_new = object.__new__
+_setattr = object.__setattr__
+
+
+def _read_binary(values, pos, layout):
+    """
+    decodes the argclass starting at `values[pos]` without running `__init__` or `__post_init__`, like unpickling.
+    fields that aren't encoded take their defaults
+    :return: the argclass and the position after its values
+    """
+    end = pos + len(layout.leaves)
+    state = dict(zip(layout.leaves, values[pos:end]))
+    if layout.nested:
+        declared = values[end]
+        end += 1
+        for bit, name, _, _ in layout.nested:
+            if not declared & bit:
+                state[name] = values[end]
+                end += 1
+        for bit, name, _, nested_layout in layout.nested:
+            if declared & bit:
+                state[name], end = _read_binary(values, end, nested_layout)
+    if layout.construct:
+        return layout.cls(**state), end
+    for name, factory in layout.factories:
+        state[name] = factory()
+    if layout.defaults:
+        state.update(layout.defaults)
+    obj = _new(layout.cls)
+    if layout.slotted:
+        for name, value in state.items():
+            _setattr(obj, name, value)
+    else:
+        _setattr(obj, '__dict__', state)
+    return obj, end
+
+
+def loads(data: bytes, arg_class):
+    """
+    decodes the output of `dumps` into an instance of `arg_class`. like unpickling, neither `__init__` nor
+    `__post_init__` runs: fields hold the encoded values and private fields take their defaults
+    :raises ValueError: if `data` wasn't encoded with the current schema of `arg_class`
+    """
+    layout = _binary_layout(arg_class)
+    if bytes(data[:len(_BINARY_MAGIC)]) != _BINARY_MAGIC or len(data) < _HEADER_SIZE:
+        raise ValueError('not an argclass encoding')
+    if data[len(_BINARY_MAGIC)] != _BINARY_VERSION:
+        raise ValueError(f'unsupported argclass encoding version {data[len(_BINARY_MAGIC)]}')
+    if bytes(data[len(_BINARY_MAGIC) + 1:_HEADER_SIZE]) != layout.digest:
+        raise ValueError(f'argclass encoding does not match the schema of {arg_class.__name__}')
+    try:
+        values = pickle.loads(memoryview(data)[_HEADER_SIZE:])
+        obj, end = _read_binary(values, 0, layout)
+    except (pickle.UnpicklingError, EOFError, IndexError, TypeError) as e:
+        raise ValueError(f'corrupt argclass encoding: {e!r}')
+    if type(values) is not list or end != len(values):
+        raise ValueError('corrupt argclass encoding: unexpected number of values')
+    return obj
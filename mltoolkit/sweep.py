@@ -0,0 +1,103 @@
+"""
+Lazy sweep expansion over argclass configs. Variants are yielded one at a time and share every nested sub-config that
+an override does not touch with the base config, so large sweeps never materialize the full expansion.
+"""
+import dataclasses
+import itertools
+import random as _random
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Union
+
+from mltoolkit.config import compose_config, unflatten_args
+from mltoolkit.schema import compile_schema
+from mltoolkit.validation import compile_validator
+
+
+def _replace_paths(config, overrides):
+    """
+    returns a copy of `config` with `overrides` (list of (path parts, value)) applied. only the argclasses along the
+    overridden paths are re-created, everything else is shared with `config`
+    """
+    changes = {}
+    nested = {}
+    for parts, value in overrides:
+        if len(parts) == 1:
+            changes[parts[0]] = value
+        else:
+            nested.setdefault(parts[0], []).append((parts[1:], value))
+    for name, sub_overrides in nested.items():
+        changes[name] = _replace_paths(getattr(config, name), sub_overrides)
+    return dataclasses.replace(config, **changes)
+
+
+def _check_paths(arg_class, paths):
+    schema = compile_schema(arg_class)
+    unknown = [path for path in paths if path not in schema.fields and path not in schema.nested]
+    if unknown:
+        raise ValueError(f'unknown sweep paths for {arg_class.__name__}: {unknown}')
+    for path in paths:
+        for other in paths:
+            if other.startswith(f'{path}.'):
+                raise ValueError(f'sweep path "{other}" conflicts with path "{path}"')
+
+
+def _sample(spec, rng, validator, path):
+    if callable(spec):
+        # drawn values can only be checked one at a time
+        return validator.coerce(path, spec(rng))
+    return rng.choice(spec)
+
+
+def sweep(base, grid: Optional[Dict[str, Sequence[Any]]] = None,
+          zipped: Optional[Dict[str, Sequence[Any]]] = None,
+          random: Optional[Dict[str, Union[Sequence[Any], Callable[[_random.Random], Any]]]] = None,
+          num_samples: int = 1, seed: Optional[int] = None, arg_class=None) -> Iterator[Any]:
+    """
+    lazily expands a sweep over dotted config paths (e.g. `train.lr`, `env.grid_size`). the sweep is the product of
+    the zipped rows, the grid points and `num_samples` random draws
+
+    @param base: argclass instance, or path to a config file parsed into `arg_class`
+    @param grid: path -> values; every combination is visited
+    @param zipped: path -> values; all lists must have the same length and are iterated together
+    @param random: path -> values to choose from or callable drawing a value from a `random.Random`
+    @param num_samples: number of random draws per grid point / zipped row (ignored without `random`)
+    @param seed: seed of the random draws
+    @param arg_class: @argclass wrapped class to populate when `base` is a config file
+    :return: generator of argclass instances
+    """
+    if isinstance(base, str):
+        assert arg_class is not None, 'arg_class is required when sweeping over a config file'
+        # coerced and checked like `parse_args` does for config files
+        base = arg_class(**unflatten_args(compile_validator(arg_class).validate(compose_config(base, flat=True))))
+    grid = grid or {}
+    zipped = zipped or {}
+    random = random or {}
+
+    paths = [*zipped, *grid, *random]
+    assert len(paths) == len(set(paths)), 'a path can only be swept once'
+    _check_paths(type(base), paths)
+
+    # swept values are coerced to the field types once up front instead of once per variant
+    validator = compile_validator(type(base))
+    zipped = validator.validate_choices(zipped)
+    grid = validator.validate_choices(grid)
+    random_choices = validator.validate_choices({path: spec for path, spec in random.items() if not callable(spec)})
+    random = {path: random_choices.get(path, spec) for path, spec in random.items()}
+
+    zipped_lengths = {len(values) for values in zipped.values()}
+    assert len(zipped_lengths) <= 1, 'zipped sweep values must all have the same length'
+    zipped_rows = zip(*zipped.values()) if zipped else [()]
+
+    zipped_parts = [path.split('.') for path in zipped]
+    grid_parts = [path.split('.') for path in grid]
+    random_paths = list(random)
+    random_parts = [path.split('.') for path in random_paths]
+    random_specs = list(random.values())
+    rng = _random.Random(seed)
+
+    for zipped_row in zipped_rows:
+        for grid_point in itertools.product(*grid.values()):
+            for _ in range(num_samples if random else 1):
+                overrides = [*zip(zipped_parts, zipped_row), *zip(grid_parts, grid_point),
+                             *((parts, _sample(spec, rng, validator, path))
+                               for path, parts, spec in zip(random_paths, random_parts, random_specs))]
+                yield _replace_paths(base, overrides) if overrides else base
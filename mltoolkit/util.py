@@ -1,25 +1,86 @@
 import os
 
-import wandb
-
 from mltoolkit.arguments import DataUseArguments, WandBArguments
 
+# directory of the artifact cache (see `mltoolkit.artifact_cache`); download_dataset downloads into the wandb default
+# location when unset
+ARTIFACT_CACHE_ENV = 'MLTOOLKIT_ARTIFACT_CACHE'
+# size bound of the cache in bytes, with an optional K/M/G/T suffix; unbounded when unset
+ARTIFACT_CACHE_SIZE_ENV = 'MLTOOLKIT_ARTIFACT_CACHE_SIZE'
+# resolve artifacts from the cache alone, without contacting wandb
+ARTIFACT_OFFLINE_ENV = 'MLTOOLKIT_ARTIFACT_OFFLINE'
+
+
+def download_dataset(dataset_args: DataUseArguments, wandb_args: WandBArguments, cache_dir=None, run_dir=None,
+                     link='hardlink', offline=None, max_cache_size=None):
+    """
+    downloads the dataset artifact `dataset_args.wandb_artifact_path` used by the wandb run. with an artifact cache
+    (see `mltoolkit.artifact_cache`) every version is downloaded once per host and reused by later calls
+    @param cache_dir: artifact cache directory, defaults to $MLTOOLKIT_ARTIFACT_CACHE. without one, the artifact is
+                      downloaded to the wandb default location on every call
+    @param run_dir: directory to link the cached files into (see `link`), e.g. the run's output directory. defaults
+                    to the cache entry itself, which must not be modified and is pinned in the cache (not evicted)
+                    until this process exits
+    @param link: 'hardlink', 'symlink' or 'copy'
+    @param offline: resolve the artifact from the cache alone, without a wandb run; defaults to
+                    $MLTOOLKIT_ARTIFACT_OFFLINE. resolves the digest the artifact path was last fetched at
+    @param max_cache_size: size bound of the cache in bytes (or e.g. '50G'), defaults to
+                           $MLTOOLKIT_ARTIFACT_CACHE_SIZE. least recently used versions are evicted beyond it
+    :return: directory of the dataset files
+    """
+    cache_dir = cache_dir or os.environ.get(ARTIFACT_CACHE_ENV)
+    if offline is None:
+        offline = os.environ.get(ARTIFACT_OFFLINE_ENV, '').lower() in ('1', 'true', 'yes')
+    artifact_path = dataset_args.wandb_artifact_path
 
-def download_dataset(dataset_args: DataUseArguments, wandb_args: WandBArguments):
-    artifact = wandb_args.run.use_artifact(os.path.join(wandb_args.project_path,
-                                                        dataset_args.wandb_artifact_path),
-                                           type='dataset')
-    dataset_artifact_dir = artifact.download()
-    return dataset_artifact_dir
+    if not cache_dir:
+        assert not offline, f'offline mode requires an artifact cache, set ${ARTIFACT_CACHE_ENV}'
+        artifact = wandb_args.run.use_artifact(os.path.join(wandb_args.project_path, artifact_path), type='dataset')
+        return artifact.download(root=run_dir)
 
+    from mltoolkit.artifact_cache import ArtifactCache
+    cache = ArtifactCache(cache_dir, max_size=max_cache_size or os.environ.get(ARTIFACT_CACHE_SIZE_ENV))
+    if offline:
+        path = cache.lookup(artifact_path)
+        if path is None:
+            raise FileNotFoundError(f'{artifact_path} is not in the artifact cache {cache.root}')
+    else:
+        # use_artifact only fetches the metadata; it also records the artifact as an input of the run
+        artifact = wandb_args.run.use_artifact(os.path.join(wandb_args.project_path, artifact_path), type='dataset')
+        path = cache.fetch(artifact_path, artifact.digest, lambda root: artifact.download(root=root))
+    if run_dir is None:
+        return path
+    cache.link(path, run_dir, mode=link)
+    if link == 'copy' or (link == 'hardlink' and os.stat(path).st_dev == os.stat(run_dir).st_dev):
+        # copied and hardlinked files outlive the entry (hardlinks fall back to symlinks across file systems)
+        cache.unpin(path)
+    return run_dir
 
-def log_dataset_reference(dataset_args: DataUseArguments, wandb_args: WandBArguments, max_objects=10000, checksum=True):
+
+def log_dataset_reference(dataset_args: DataUseArguments, wandb_args: WandBArguments, max_objects=10000, checksum=True,
+                          workers=None, digest_cache=None):
+    """
+    logs the local dataset `dataset_args.file_uri` as a reference artifact. with `checksum`, its files are hashed
+    locally into a manifest (see `mltoolkit.dataset_manifest`) in parallel, with only files changed since the last
+    build re-hashed, instead of serially by wandb. the manifest is attached to the artifact as `manifest.json`, so the
+    artifact version changes with the dataset contents, and the files themselves are referenced without checksums
+    @param workers: hashing threads
+    @param digest_cache: sqlite digest cache, see `build_manifest`
+    """
+    import json
+    import wandb
     init_wandb(wandb_args)
     artifact = wandb.Artifact(dataset_args.name, type='dataset')
     path = dataset_args.file_uri
-    if not path.startswith('file://'):
-        path = f'file://{path}'
-    artifact.add_reference(path, max_objects=max_objects, checksum=checksum)
+    if path.startswith('file://'):
+        path = path[len('file://'):]
+    if checksum:
+        from mltoolkit.dataset_manifest import build_manifest
+        manifest = build_manifest(path, workers=workers, cache_path=digest_cache, max_objects=max_objects)
+        artifact.metadata.update(manifest_digest=manifest.digest, files=len(manifest.files), size=manifest.size)
+        with artifact.new_file('manifest.json', mode='w') as f:
+            json.dump(manifest.to_dict(), f, indent=1)
+    artifact.add_reference(f'file://{path}', max_objects=max_objects, checksum=False)
     wandb_args.run.log_artifact(artifact, aliases=[dataset_args.version])
     return artifact
 
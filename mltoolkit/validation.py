@@ -0,0 +1,403 @@
+"""
+Compiled type coercion and validation of config values. Every field of an argclass schema is compiled once into a
+small coercion function, so config files, dictionaries and sweep values are converted to the declared field types
+(e.g. a YAML `lr: 5e-4`, which loads as a string) and checked in a single pass that reports every invalid value.
+"""
+import difflib
+import numbers
+import os
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from mltoolkit.config import flatten_args, unflatten_args
+from mltoolkit.schema import ArgumentSchema, FieldSpec, compile_schema
+
+_TRUE_STRINGS = frozenset(("yes", "true", "t", "y", "1"))
+_FALSE_STRINGS = frozenset(("no", "false", "f", "n", "0"))
+
+
+class ValidationError(ValueError):
+    """
+    raised with every invalid value of a config at once
+    """
+
+    def __init__(self, arg_class, errors: List[Tuple[str, str]]):
+        self.arg_class = arg_class
+        # (dotted path, message) of every invalid value
+        self.errors = errors
+        name = getattr(arg_class, '__name__', str(arg_class))
+        lines = ''.join(f'\n  {path}: {message}' for path, message in errors)
+        super().__init__(f'{len(errors)} invalid argument(s) for {name}:{lines}')
+
+
+def _type_name(field_type):
+    return getattr(field_type, '__name__', str(field_type))
+
+
+def _coerce_bool(value):
+    if value is True or value is False:
+        return value
+    if type(value) is int and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        if value.lower() in _TRUE_STRINGS:
+            return True
+        if value.lower() in _FALSE_STRINGS:
+            return False
+    raise ValueError(f'expected bool, got {value!r}')
+
+
+def _coerce_int(value):
+    value_type = type(value)
+    if value_type is int:
+        return value
+    if value_type is float and value.is_integer():
+        return int(value)
+    if value_type is str:
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                # yaml 1.1 loads exponent notation without a decimal point (`1e3`) as a string
+                number = float(value)
+            except ValueError:
+                number = None
+            if number is not None and number.is_integer():
+                return int(number)
+    elif isinstance(value, numbers.Integral) and value_type is not bool:
+        return int(value)
+    raise ValueError(f'expected int, got {value!r}')
+
+
+def _coerce_float(value):
+    value_type = type(value)
+    if value_type is float:
+        return value
+    if value_type is int:
+        return float(value)
+    if value_type is str:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    elif isinstance(value, numbers.Real) and value_type is not bool:
+        return float(value)
+    raise ValueError(f'expected float, got {value!r}')
+
+
+def _coerce_str(value):
+    value_type = type(value)
+    if value_type is str:
+        return value
+    if value_type is int or value_type is float:
+        return str(value)
+    if isinstance(value, os.PathLike):
+        return os.fspath(value)
+    raise ValueError(f'expected str, got {value!r}')
+
+
+_SCALAR_COERCERS = {
+    bool: _coerce_bool,
+    int: _coerce_int,
+    float: _coerce_float,
+    str: _coerce_str,
+}
+
+
+def _enum_coercer(enum_type):
+    # members by value, by name and by the string form of their value (as written on the command line)
+    lookup = {}
+    for member in enum_type:
+        lookup.setdefault(str(member.value), member)
+        lookup.setdefault(member.name, member)
+    for member in enum_type:
+        try:
+            lookup[member.value] = member
+        except TypeError:
+            pass
+    choices = [member.value for member in enum_type]
+
+    def coerce(value):
+        if type(value) is enum_type:
+            return value
+        try:
+            member = lookup.get(value)
+        except TypeError:
+            member = None
+        if member is None:
+            raise ValueError(f'expected one of {choices}, got {value!r}')
+        return member
+
+    return coerce
+
+
+def _class_coercer(field_type):
+    # same as the `type=` conversion argparse applies to command line values, e.g. `Path`
+    def coerce(value):
+        if isinstance(value, field_type):
+            return value
+        try:
+            return field_type(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'expected {_type_name(field_type)}, got {value!r}')
+
+    return coerce
+
+
+def _errors_message(errors):
+    return '; '.join(f'{path}: {message}' for path, message in errors)
+
+
+def _argclass_coercer(arg_class):
+    # mappings are validated against the argclass' own schema and decoded into it, instances are kept as is
+    def coerce(value):
+        if isinstance(value, arg_class):
+            return value
+        if type(value) is not dict:
+            raise ValueError(f'expected {_type_name(arg_class)} or a mapping of its arguments, got {value!r}')
+        try:
+            return arg_class(**unflatten_args(compile_validator(arg_class).validate(flatten_args(value))))
+        except ValidationError as e:
+            raise ValueError(_errors_message(e.errors))
+
+    return coerce
+
+
+def _passthrough(value):
+    return value
+
+
+def _mapping_types(field_type):
+    """
+    value type of a `Dict[K, V]` field, None for other types
+    """
+    field_args = getattr(field_type, '__args__', None) or ()
+    if getattr(field_type, '__origin__', None) is dict and len(field_args) == 2:
+        return field_args[1]
+    return None
+
+
+def _type_coercer(field_type) -> Callable[[Any], Any]:
+    if field_type in _SCALAR_COERCERS:
+        return _SCALAR_COERCERS[field_type]
+    if isinstance(field_type, type) and issubclass(field_type, Enum):
+        return _enum_coercer(field_type)
+    if hasattr(field_type, '_ARGCLASS'):
+        return _argclass_coercer(field_type)
+    if getattr(field_type, '__origin__', None) is list:
+        return _list_coercer(field_type.__args__[0] if getattr(field_type, '__args__', None) else Any)
+    if field_type is list:
+        return _list_coercer(Any)
+    value_type = _mapping_types(field_type)
+    if value_type is not None:
+        return _dict_coercer(value_type)
+    if isinstance(field_type, type) and field_type is not object:
+        return _class_coercer(field_type)
+    # typing constructs like `Any` or `Sequence[str]` are not checked
+    return _passthrough
+
+
+def _dict_coercer(value_type):
+    coerce_value = _type_coercer(value_type)
+    if coerce_value is _passthrough:
+        return _passthrough
+
+    def coerce(value):
+        if not isinstance(value, dict):
+            raise ValueError(f'expected dict, got {value!r}')
+        values = {}
+        for key, item in value.items():
+            try:
+                values[key] = coerce_value(item)
+            except ValueError as e:
+                raise ValueError(f'key {key!r}: {e}')
+        return values
+
+    return coerce
+
+
+def _list_coercer(item_type):
+    coerce_item = _type_coercer(item_type)
+
+    def coerce(value):
+        if not isinstance(value, (list, tuple)):
+            raise ValueError(f'expected list, got {value!r}')
+        items = []
+        for i, item in enumerate(value):
+            try:
+                items.append(coerce_item(item))
+            except ValueError as e:
+                raise ValueError(f'item {i}: {e}')
+        return items
+
+    return coerce
+
+
+def _compile_coercer(spec: FieldSpec) -> Callable[[Any], Any]:
+    coerce = _type_coercer(spec.type)
+    if coerce is _passthrough or not (spec.optional or spec.default is None):
+        return coerce
+
+    def coerce_optional(value):
+        return None if value is None else coerce(value)
+
+    return coerce_optional
+
+
+class ArgumentValidator:
+    """
+    coercion functions of every field of an argclass schema, keyed by dotted path
+    """
+
+    def __init__(self, schema: ArgumentSchema):
+        self.schema = schema
+        self.coercers: Dict[str, Callable[[Any], Any]] = {
+            path: _compile_coercer(spec) for path, spec in schema.fields.items()}
+        # required paths with the prefixes (nested argclass paths) that may provide them as a whole
+        self.required = [(path, tuple(path[:i] for i, ch in enumerate(path) if ch == '.'))
+                         for path, spec in schema.fields.items() if spec.required]
+        # `Dict[K, V]` fields, whose entries are flattened along with the config, mapped to their value type
+        self.mappings = {path: _mapping_types(spec.type) for path, spec in schema.fields.items()
+                         if _mapping_types(spec.type) is not None}
+
+    def _coerce_entry(self, key, value):
+        """
+        coerces `<field>.<key>[.<path>]`, an entry (or a value inside an entry) of a mapping-valued field, to the
+        field's value type. returns `value` unchanged for other keys
+        """
+        prefix = key
+        while '.' in prefix:
+            prefix = prefix.rpartition('.')[0]
+            value_type = self.mappings.get(prefix)
+            if value_type is None:
+                continue
+            entry_path = key[len(prefix) + 1:].partition('.')[2]
+            if not entry_path:
+                return _type_coercer(value_type)(value)
+            if hasattr(value_type, '_ARGCLASS'):
+                try:
+                    return compile_validator(value_type).coerce(entry_path, value)
+                except ValidationError as e:
+                    raise ValueError(_errors_message(e.errors))
+            return value
+        return value
+
+    def _check_unknown(self, key, value):
+        """
+        error message for a key that isn't a leaf field of the schema, None if the value is accepted as is
+        """
+        if key.startswith('_') or '._' in key:
+            # private fields are not part of the schema
+            return None
+        nested = self.schema.nested.get(key)
+        if nested is not None:
+            if value is None or type(value) is dict or isinstance(value, nested):
+                return None
+            return f'expected a mapping of {_type_name(nested)} arguments, got {value!r}'
+        prefix = key
+        while '.' in prefix:
+            prefix = prefix.rpartition('.')[0]
+            if prefix in self.schema.fields:
+                # entry of a mapping-valued field, flattened along with the config
+                return None
+            if prefix in self.schema.nested:
+                break
+        matches = difflib.get_close_matches(key, self.coercers.keys(), n=1)
+        return 'unknown argument' + (f', did you mean "{matches[0]}"?' if matches else '')
+
+    def validate(self, args: dict, check_required=True) -> dict:
+        """
+        coerces a flattened (dotted key) config to the declared field types
+        @param args: flattened config, e.g. from `flatten_args`; not modified
+        @param check_required: report required fields missing from `args`
+        :return: new flattened config holding the coerced values
+        :raises ValidationError: listing every invalid, unknown and missing argument
+        """
+        coercers = self.coercers
+        result = {}
+        errors = []
+        for key, value in args.items():
+            coerce = coercers.get(key)
+            if coerce is not None:
+                try:
+                    result[key] = coerce(value)
+                except ValueError as e:
+                    errors.append((key, str(e)))
+                continue
+            message = self._check_unknown(key, value)
+            if message is not None:
+                errors.append((key, message))
+                continue
+            try:
+                result[key] = self._coerce_entry(key, value) if self.mappings else value
+            except ValueError as e:
+                errors.append((key, str(e)))
+        if check_required:
+            for path, prefixes in self.required:
+                if path not in result and not any(prefix in result for prefix in prefixes):
+                    errors.append((path, 'missing required argument'))
+        if errors:
+            raise ValidationError(self.schema.dataclass_type, errors)
+        return result
+
+    def validate_choices(self, choices: Dict[str, Iterable[Any]]) -> Dict[str, List[Any]]:
+        """
+        coerces lists of candidate values per dotted path, e.g. the values of a sweep
+        :raises ValidationError: listing every invalid value
+        """
+        result = {}
+        errors = []
+        for path, values in choices.items():
+            coerce = self.coercers.get(path)
+            values = list(values)
+            if coerce is None:
+                coerced = []
+                for i, value in enumerate(values):
+                    message = self._check_unknown(path, value)
+                    if message is not None:
+                        errors.append((f'{path}[{i}]', message))
+                        continue
+                    try:
+                        coerced.append(self._coerce_entry(path, value) if self.mappings else value)
+                    except ValueError as e:
+                        errors.append((f'{path}[{i}]', str(e)))
+                result[path] = coerced
+                continue
+            coerced = []
+            for i, value in enumerate(values):
+                try:
+                    coerced.append(coerce(value))
+                except ValueError as e:
+                    errors.append((f'{path}[{i}]', str(e)))
+            result[path] = coerced
+        if errors:
+            raise ValidationError(self.schema.dataclass_type, errors)
+        return result
+
+    def coerce(self, path: str, value):
+        """
+        coerces a single value of dotted path `path`
+        :raises ValidationError: if the value is invalid
+        """
+        return self.validate({path: value}, check_required=False)[path]
+
+
+_VALIDATORS: Dict[Any, ArgumentValidator] = {}
+
+
+def compile_validator(arg_class) -> ArgumentValidator:
+    """
+    compiles (or returns the memoized) validator of argclass `arg_class`
+    """
+    validator = _VALIDATORS.get(arg_class)
+    if validator is None:
+        validator = _VALIDATORS[arg_class] = ArgumentValidator(compile_schema(arg_class))
+    return validator
+
+
+def validate_config(arg_class, args: dict, check_required=True) -> dict:
+    """
+    coerces a flattened (dotted key) config to the field types declared by `arg_class`
+    :raises ValidationError: listing every invalid, unknown and missing argument
+    """
+    return compile_validator(arg_class).validate(args, check_required=check_required)
@@ -55,13 +55,1061 @@ class MazeArguments(GeneralArguments):
             return self.agent_visibility
 
 
+def test_import_is_lazy():
+    import os
+    import subprocess
+    import sys
+    code = "import sys, mltoolkit; heavy = [m for m in ('torch', 'wandb', 'numpy') if m in sys.modules]; " \
+           "assert not heavy, heavy; assert callable(mltoolkit.build_network) and 'torch' in sys.modules"
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+
+def test_compiled_schema_is_memoized_and_cached_on_disk():
+    import os
+    import tempfile
+    from mltoolkit.schema import _SCHEMAS, compile_schema
+    schema = compile_schema(MazeArguments)
+    assert compile_schema(MazeArguments) is schema
+    assert {'seed', 'train.lr', 'env.grid_size'} <= set(schema.paths) and schema.nested['env'] is EnvironmentArguments
+    assert schema.fields['train.lr'].default == 1e-4
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            _SCHEMAS.pop(MazeArguments)
+            compile_schema(MazeArguments, cache_dir=directory)
+            assert len(os.listdir(directory)) == 1
+            _SCHEMAS.pop(MazeArguments)
+            cached = compile_schema(MazeArguments, cache_dir=directory)
+            assert cached is not schema and list(cached.fields) == list(schema.fields)
+        finally:
+            _SCHEMAS[MazeArguments] = schema
+
+
+
+def test_flatten_and_unflatten_args():
+    from mltoolkit.config import flatten_args, unflatten_args
+    nested = {'a': {'b': 1, 'c': {'d': 2}}, 'e': [3]}
+    assert flatten_args(nested) == {'a.b': 1, 'a.c.d': 2, 'e': [3]}
+    assert unflatten_args(flatten_args(nested)) == nested
+    # dictionary values merge with dotted keys and later keys override earlier ones, without modifying the input
+    args = {'a': {'b': 1, 'c': 2}, 'a.c': 3, 'a.d.e': 4}
+    assert unflatten_args(args) == {'a': {'b': 1, 'c': 3, 'd': {'e': 4}}}
+    assert args == {'a': {'b': 1, 'c': 2}, 'a.c': 3, 'a.d.e': 4}
+    try:
+        unflatten_args({'a': 1, 'a.b': 2})
+    except Exception as e:
+        assert 'conflicts' in str(e), e
+    else:
+        raise AssertionError('conflicting keys were merged')
+
+
+
+@argclass
+class ItemArguments:
+    a: int = field(default=1)
+
+
+
+@argclass
+class CollectionArguments:
+    items: List[ItemArguments] = field(default_factory=list)
+    table: Dict[str, ItemArguments] = field(default_factory=dict)
+
+
+
+@argclass
+class DecodedArguments:
+    env: EnvironmentArguments
+    decoded: str = field(default=None)
+
+    def __post_init__(self):
+        self.decoded = type(self.env).__name__
+
+
+
+def test_generated_post_init_decodes_nested_dictionaries():
+    args = MazeArguments(train={'lr': 0.1}, env={'grid_size': 9})
+    assert type(args.train) is TrainingArguments and args.train.lr == 0.1 and args.env.grid_size == 9
+    item = ItemArguments(a=2)
+    collection = CollectionArguments(items=[{'a': 3}, item], table={'x': {'a': 4}})
+    assert collection.items == [ItemArguments(a=3), item] and collection.items[1] is item
+    assert collection.table == {'x': ItemArguments(a=4)}
+    # the class's own __post_init__ runs after decoding
+    assert DecodedArguments(env={'grid_size': 3}).decoded == 'EnvironmentArguments'
+    # classes without nested argclasses keep their own __post_init__
+    assert '__post_init__' not in vars(ItemArguments)
+
+
+
+def test_sweep_expands_lazily_and_shares_untouched_configs():
+    from mltoolkit.sweep import sweep
+    base = MazeArguments(train=TrainingArguments(), env=EnvironmentArguments())
+    variants = sweep(base, grid={'train.lr': [0.1, 0.2], 'env.grid_size': [3, 5]}, zipped={'seed': [1, 2]})
+    assert next(variants).train.lr == 0.1
+    configs = list(variants)
+    assert len(configs) == 7 and [config.seed for config in configs] == [1] * 3 + [2] * 4
+    assert (configs[-1].train.lr, configs[-1].env.grid_size) == (0.2, 5)
+    random = list(sweep(base, grid={'train.lr': [0.1]}, random={'seed': range(100)}, num_samples=3, seed=0))
+    assert len(random) == 3 and random[0].env is base.env and base.train.lr == 1e-4
+    assert [config.seed for config in random] == [config.seed for config in
+                                                  sweep(base, random={'seed': range(100)}, num_samples=3, seed=0)]
+    try:
+        next(sweep(base, grid={'train.missing': [1]}))
+    except ValueError as e:
+        assert 'train.missing' in str(e), e
+    else:
+        raise AssertionError('unknown sweep path was accepted')
+
+
+
+def _write_config(path, text, mtime_ns=None):
+    import os
+    with open(path, 'w') as f:
+        f.write(text)
+    if mtime_ns is not None:
+        # edits within the file system's timestamp resolution must still be noticed
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+
+def test_parse_config_is_cached_and_notices_edits():
+    import os
+    import tempfile
+    from mltoolkit.config import _PARSED_CONFIGS, parse_config
+    with tempfile.TemporaryDirectory() as directory:
+        path, cache_dir = os.path.join(directory, 'config.yaml'), os.path.join(directory, 'cache')
+        _write_config(path, 'train:\n  lr: 0.1\n', mtime_ns=10 ** 18)
+        config = parse_config(path, cache_dir=cache_dir)
+        assert config == {'train': {'lr': 0.1}} and len(os.listdir(cache_dir)) == 1
+        config['train']['lr'] = 0.5
+        assert parse_config(path)['train']['lr'] == 0.1, 'cached config was modified through a returned config'
+        # a new process reads the disk cache
+        _PARSED_CONFIGS.clear()
+        assert parse_config(path, cache_dir=cache_dir) == {'train': {'lr': 0.1}}
+        _write_config(path, 'train:\n  lr: 0.2\n', mtime_ns=10 ** 18 + 1)
+        assert parse_config(path, cache_dir=cache_dir) == {'train': {'lr': 0.2}}
+        json_path = os.path.join(directory, 'config.json')
+        _write_config(json_path, '{"seed": 3}')
+        assert parse_config(json_path) == {'seed': 3}
+
+
+
+def test_compose_config_merges_bases():
+    import os
+    import tempfile
+    from mltoolkit.config import compose_config
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, 'base'))
+        _write_config(os.path.join(directory, 'base', 'train.yaml'), 'train:\n  lr: 0.1\n  num_steps: 10\n')
+        _write_config(os.path.join(directory, 'base', 'env.yaml'), '_base_: train.yaml\nenv:\n  grid_size: 3\n')
+        path = os.path.join(directory, 'config.yaml')
+        _write_config(path, '_base_: [base/train.yaml, base/env.yaml]\ntrain:\n  lr: 0.3\n')
+        assert compose_config(path) == {'train': {'lr': 0.3, 'num_steps': 10}, 'env': {'grid_size': 3}}
+        assert compose_config(path, flat=True)['train.lr'] == 0.3
+        # editing a base invalidates every config built on it
+        _write_config(os.path.join(directory, 'base', 'env.yaml'), 'env:\n  grid_size: 4\n', mtime_ns=10 ** 18)
+        assert compose_config(path)['env'] == {'grid_size': 4}
+        _write_config(os.path.join(directory, 'base', 'train.yaml'), '_base_: ../config.yaml\n', mtime_ns=10 ** 18)
+        try:
+            compose_config(path)
+        except ValueError as e:
+            assert 'cycle' in str(e), e
+        else:
+            raise AssertionError('include cycle was not detected')
+
+
+
+def test_asdict_and_streaming_serializers():
+    import io
+    import json
+    import yaml
+    from mltoolkit.serialization import dump_json, dump_yaml
+    args = MazeArguments(train=TrainingArguments(lr=0.5), env=EnvironmentArguments(), seed=3)
+    collection = CollectionArguments(items=[ItemArguments(a=2), 7], table={'x': ItemArguments()})
+    # nested argclasses are converted, other values are shared with the config
+    assert asdict(collection) == {'items': [{'a': 2}, 7], 'table': {'x': {'a': 1}}}
+    tags = ['a']
+    assert asdict(DecodedArguments(env=EnvironmentArguments(difficulty=tags)))['env']['difficulty'] is tags
+    expected = {name: value for name, value in asdict(args).items() if not name.startswith('_')}
+    for indent in (None, 2):
+        stream = io.StringIO()
+        dump_json(args, stream, indent=indent)
+        assert json.loads(stream.getvalue()) == expected
+    stream = io.StringIO()
+    dump_yaml(args, stream)
+    assert yaml.safe_load(stream.getvalue()) == expected
+
+
+
+@argclass(slots=True, frozen=True)
+class CompactArguments:
+    grid_size: int = field(default=5)
+    tags: List[str] = field(default_factory=lambda: ['a'])
+
+
+def test_slotted_and_frozen_argclasses():
+    import dataclasses
+    args = CompactArguments(grid_size=7)
+    assert not hasattr(args, '__dict__') and '__slots__' in vars(CompactArguments)
+    # equal configs hash alike, so they can be used as keys
+    assert {args: 'seen'}[CompactArguments(grid_size=7, tags=['a'])] == 'seen'
+    assert hash(args) != hash(CompactArguments(grid_size=7, tags=['b']))
+    try:
+        args.grid_size = 3
+    except dataclasses.FrozenInstanceError:
+        pass
+    else:
+        raise AssertionError('frozen argclass was modified')
+
+
+
+@argclass(slots=True)
+class SlottedArguments(GeneralArguments):
+    name: str = field(default=None)
+
+    def __post_init__(self):
+        super().__post_init__()
+        if self.name is None:
+            self.name = 'slotted'
+
+    @property
+    def label(self):
+        return f'{self.name}:{super().__repr__()[:7]}'
+
+
+
+def test_slotted_argclass_zero_argument_super():
+    args = SlottedArguments()
+    assert args.name == 'slotted' and args.label.startswith('slotted:Slotted'), args.label
+    assert '__slots__' in vars(SlottedArguments)
+
+
+
+@argclass(frozen=True)
+class FrozenEnvironmentArguments:
+    grid_size: int = field(default=5)
+
+
+
+def test_frozen_argclass_requires_frozen_fields_and_bases():
+    frozen = argclass(frozen=True)(type('FrozenConfig', (), {'__annotations__': {'env': FrozenEnvironmentArguments},
+                                                             '__module__': __name__}))
+    assert hash(frozen()) == hash(frozen())
+    for namespace, bases in [({'__annotations__': {'env': EnvironmentArguments}}, ()),
+                             ({'__annotations__': {'envs': List[EnvironmentArguments]}}, ()),
+                             ({}, (GeneralArguments,))]:
+        try:
+            argclass(frozen=True)(type('InvalidFrozenConfig', bases, dict(namespace, __module__=__name__)))
+        except TypeError as e:
+            assert 'non-frozen' in str(e), e
+        else:
+            raise AssertionError(f'frozen argclass with non-frozen {namespace or bases} was declared')
+
+
+
+def test_fingerprint_ignores_formatting_and_private_fields():
+    from mltoolkit.serialization import fingerprint
+    args = MazeArguments(train=TrainingArguments(), env=EnvironmentArguments())
+    assert fingerprint(args) == fingerprint(MazeArguments(train={'lr': 1e-4, 'gamma': 0.99}, env={}, _device='cpu'))
+    assert fingerprint(args) == fingerprint(MazeArguments(train={'num_steps': 1000.0}, env={}))
+    assert fingerprint(args) != fingerprint(MazeArguments(train={'lr': 2e-4}, env={}))
+
+
+
+def test_device_is_detected_lazily_and_once():
+    import os
+    import subprocess
+    import sys
+    code = "import sys\n" \
+           "from mltoolkit import GeneralArguments\n" \
+           "from mltoolkit.arguments import detect_device\n" \
+           "args = GeneralArguments(no_gpu=True)\n" \
+           "assert 'torch' not in sys.modules and args.device == 'cpu' and 'torch' not in sys.modules\n" \
+           "devices = [GeneralArguments().device for _ in range(3)]\n" \
+           "assert len(set(devices)) == 1 and detect_device.cache_info().hits == 2\n" \
+           "args.device = 'cuda:1'\n" \
+           "assert args.device == args._device == 'cuda:1'\n"
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, MLTOOLKIT_DEVICE='mps')
+    subprocess.run([sys.executable, '-c', "import sys; from mltoolkit import GeneralArguments; "
+                                          "assert GeneralArguments().device == 'mps' and 'torch' not in sys.modules"],
+                   check=True, cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+
+
+
+def test_fast_command_line_path_matches_argparse():
+    from mltoolkit.argparser import NestedArgumentParser
+    from mltoolkit.config import unflatten_args
+    for args in [[], ['--train.lr', '0.5', '--env.grid_size=9', '--seed', '4'],
+                 ['--env.static_env', '--trainer_name', 'a2c', '--train.gamma', '-1'],
+                 ['--env.static_env', 'false', '--log_every=-3']]:
+        parser = NestedArgumentParser(MazeArguments)
+        fast = parser.parse_args(args, return_entered_args=True)
+        assert not parser._dataclass_arguments_added, f'{args} went through argparse'
+        namespace, _ = NestedArgumentParser(MazeArguments).parse_known_args(args)
+        assert fast == (unflatten_args(vars(namespace)), parser._entered_args(args)), args
+    # invalid values are reported by argparse
+    import contextlib
+    import io
+    parser = NestedArgumentParser(MazeArguments)
+    try:
+        with contextlib.redirect_stderr(io.StringIO()):
+            parser.parse_args(['--seed', 'x'])
+    except SystemExit:
+        assert parser._dataclass_arguments_added
+    else:
+        raise AssertionError('invalid value was accepted')
+
+
+
+@argclass
+class FactoryArguments:
+    table: Dict[str, int] = field(default_factory=dict)
+    steps: List[int] = field(default_factory=lambda: [1, 2])
+
+
+
+def test_default_factories_run_on_every_parse():
+    from mltoolkit.argparser import NestedArgumentParser
+    for fast in [True, False]:
+        parse = NestedArgumentParser(FactoryArguments).parse_args if fast else \
+            lambda args: vars(NestedArgumentParser(FactoryArguments).parse_known_args(args)[0])
+        first = parse([])
+        first['table']['x'] = 1
+        first['steps'].append(3)
+        assert parse([]) == {'config': None, 'table': {}, 'steps': [1, 2]}, fast
+
+
+
+def test_config_values_are_coerced_and_validated():
+    from mltoolkit.sweep import sweep
+    from mltoolkit.validation import ValidationError, validate_config
+    args = {'train.lr': '5e-4', 'env.static_env': 'yes', 'seed': '3'}
+    assert validate_config(MazeArguments, args) == {'train.lr': 5e-4, 'env.static_env': True, 'seed': 3}
+    assert args['train.lr'] == '5e-4'
+    try:
+        validate_config(MazeArguments, {'train.lr': 'fast', 'env.gridsize': 3})
+    except ValidationError as e:
+        # every invalid argument is reported at once
+        assert [path for path, _ in e.errors] == ['train.lr', 'env.gridsize'] and 'env.grid_size' in str(e), e
+    else:
+        raise AssertionError('invalid config was accepted')
+    base = MazeArguments(train=TrainingArguments(), env=EnvironmentArguments())
+    assert [config.train.num_steps for config in sweep(base, grid={'train.num_steps': ['10', 20.0]})] == [10, 20]
+    try:
+        next(sweep(base, grid={'train.num_steps': ['many']}))
+    except ValidationError:
+        pass
+    else:
+        raise AssertionError('invalid sweep value was accepted')
+
+
+
+def test_parse_dict_list_of_argclasses():
+    from mltoolkit.argparser import NestedArgumentParser
+    args = NestedArgumentParser(CollectionArguments).parse_dict({'items': [{'a': '2'}, ItemArguments(a=5)]})
+    assert args.items == [ItemArguments(a=2), ItemArguments(a=5)], args.items
+
+
+
+def test_parse_dict_dict_of_argclasses():
+    from mltoolkit.argparser import NestedArgumentParser
+    args = NestedArgumentParser(CollectionArguments).parse_dict({'table': {'x': {'a': '3'}, 'y': ItemArguments(a=4)}})
+    assert args.table == {'x': ItemArguments(a=3), 'y': ItemArguments(a=4)}, args.table
+
+
+
+def test_sweep_config_file_is_coerced():
+    import os
+    import tempfile
+    from mltoolkit.sweep import sweep
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'config.yaml')
+        with open(path, 'w') as f:
+            f.write('train:\n  lr: 5e-4\n')
+        configs = list(sweep(path, grid={'train.num_steps': ['10']}, arg_class=MazeArguments))
+    assert configs[0].train.lr == 5e-4 and configs[0].train.num_steps == 10, configs[0].train
+
+
+
+@argclass
+class FirstArguments:
+    name: str = field(default='a')
+
+
+def _pinned_entry_point(config):
+    import os
+    return config.name, sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None
+
+
+def test_launch_runs_pinned_workers_and_skips_finished_runs():
+    import os
+    import tempfile
+    from mltoolkit.launcher import available_cpus, launch, partition_cpus
+    from mltoolkit.run_index import FINISHED, RunIndex
+    assert partition_cpus([0, 1, 2, 3], 2) == [[0, 1], [2, 3]]
+    assert partition_cpus([0, 1], 3) == [[0], [1], [0]]
+    configs = [FirstArguments(name=name) for name in ('first', 'second', 'third')]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'runs.db')
+        with RunIndex(path) as index:
+            index.mark(configs[0], FINISHED)
+        results = list(launch(_pinned_entry_point, configs, workers=2, index=path, start_method='fork'))
+        assert sorted(result.result[0] for result in results if result.ok) == ['second', 'third'], results
+        # every worker runs on its own cores
+        cpu_sets = [result.result[1] for result in results]
+        if None not in cpu_sets and len(available_cpus()) >= 2:
+            assert all(cpus in partition_cpus(available_cpus(), 2) for cpus in cpu_sets), cpu_sets
+        with RunIndex(path) as index:
+            assert [index.get(config).status for config in configs] == [FINISHED] * 3
+
+
+
+def _claim_and_exit(path, config):
+    import os
+    from mltoolkit.run_index import RunIndex
+    RunIndex(path).claim(config)
+    os._exit(0)
+
+
+
+def test_run_index_reclaims_runs_of_dead_processes():
+    import multiprocessing
+    import os
+    import tempfile
+    from mltoolkit.run_index import RUNNING, RunIndex, process_owner
+    config = FirstArguments(name='claimed')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'runs.db')
+        process = multiprocessing.get_context('fork').Process(target=_claim_and_exit, args=(path, config))
+        process.start()
+        process.join()
+        with RunIndex(path) as index:
+            assert index.get(config).status == RUNNING
+            assert index.claim(config), 'run of a dead process was not reclaimed'
+            assert index.get(config).owner == process_owner()
+            assert not index.claim(config), 'run of a live process was reclaimed'
+
+
+
+def _interrupted_entry_point(config):
+    if config.name == 'exit':
+        raise SystemExit(1)
+    if config.name == 'interrupt':
+        raise KeyboardInterrupt
+    return config.name
+
+
+
+def test_launch_records_every_claimed_run():
+    import os
+    import tempfile
+    from mltoolkit.launcher import launch
+    from mltoolkit.run_index import FAILED, FINISHED, RunIndex
+    configs = [FirstArguments(name=name) for name in ('exit', 'interrupt')]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'runs.db')
+        results = list(launch(_interrupted_entry_point, configs, workers=1, index=path, start_method='fork'))
+        assert [result.ok for result in results] == [False, False]
+        # the consumer stops before every result was yielded
+        ok = [FirstArguments(name=name) for name in ('first', 'second', 'third')]
+        for _ in launch(_interrupted_entry_point, ok, workers=1, index=path, start_method='fork'):
+            break
+        with RunIndex(path) as index:
+            assert [index.get(config).status for config in configs + ok[:2]] == [FAILED] * 2 + [FINISHED] * 2
+            # configs are claimed as they are submitted
+            assert index.get(ok[2]) is None
+
+
+
+def _share_pid(rank, directory, queue):
+    import os
+    from mltoolkit.distributed import process_info, share_result
+    os.environ.update(RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE='2', LOCAL_WORLD_SIZE='2',
+                      MLTOOLKIT_BROADCAST_DIR=directory)
+    queue.put((process_info().rank, os.getpid(), share_result(os.getpid, key='pid')))
+
+
+def test_share_result_runs_on_the_main_process_only():
+    import multiprocessing
+    import os
+    import tempfile
+    from mltoolkit.distributed import process_info, share_result
+    assert process_info().is_main and share_result(os.getpid) == os.getpid()
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    with tempfile.TemporaryDirectory() as directory:
+        processes = [context.Process(target=_share_pid, args=(rank, directory, queue)) for rank in range(2)]
+        for process in processes:
+            process.start()
+        (_, main_pid, main_result), (_, _, result) = sorted(queue.get(timeout=60) for _ in processes)
+        for process in processes:
+            process.join()
+    assert main_result == result == main_pid, (main_pid, main_result, result)
+
+
+
+@argclass
+class SecondArguments:
+    name: str = field(default='b')
+
+
+
+def _distributed_worker(rank, world_size, directory, queue):
+    import os
+    os.environ.update(RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE=str(world_size),
+                      LOCAL_WORLD_SIZE=str(world_size), MLTOOLKIT_BROADCAST_DIR=directory)
+    first = parse_args(FirstArguments, print_args=False, args=[], distributed=True)
+    second = parse_args(SecondArguments, print_args=False, args=[], distributed=True)
+    again = parse_args(FirstArguments, print_args=False, args=['--name', 'c'], distributed=True)
+    queue.put((rank, first.name, second.name, again.name))
+
+
+
+def test_distributed_parse_args_calls_are_not_mixed_up():
+    import multiprocessing
+    import os
+    import tempfile
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    with tempfile.TemporaryDirectory() as directory:
+        processes = [context.Process(target=_distributed_worker, args=(rank, 4, directory, queue)) for rank in range(4)]
+        for process in processes:
+            process.start()
+        results = sorted(queue.get(timeout=60) for _ in processes)
+        for process in processes:
+            process.join()
+        assert [result[1:] for result in results] == [('a', 'b', 'c')] * 4, results
+        # the last reader removes the shared files
+        assert os.listdir(directory) == [], os.listdir(directory)
+
+
+
+def _share_without_local_world_size(rank, directory, queue):
+    import os
+    from mltoolkit.distributed import share_result
+    os.environ.update(SLURM_PROCID=str(rank), SLURM_NTASKS='2', MLTOOLKIT_BROADCAST_DIR=directory)
+    result = share_result(os.getpid, key='pid')
+    try:
+        share_result(os.getpid, method='file', key='pid')
+    except ValueError:
+        queue.put((rank, result == os.getpid()))
+
+
+
+def test_share_result_needs_the_local_world_size_for_files():
+    import multiprocessing
+    import os
+    import tempfile
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    with tempfile.TemporaryDirectory() as directory:
+        processes = [context.Process(target=_share_without_local_world_size, args=(rank, directory, queue))
+                     for rank in range(2)]
+        for process in processes:
+            process.start()
+        results = sorted(queue.get(timeout=60) for _ in processes)
+        for process in processes:
+            process.join()
+        # every process calls the function itself and no file is left behind for a later launch
+        assert results == [(0, True), (1, True)], results
+        assert os.listdir(directory) == [], os.listdir(directory)
+
+
+
+def test_binary_encoding_round_trip():
+    import pickle
+    from mltoolkit.serialization import dumps, loads
+    args = MazeArguments(train=TrainingArguments(lr=0.5, num_envs=16), env=EnvironmentArguments(difficulty='easy'),
+                         seed=3, verbose=False)
+    data = dumps(args)
+    assert loads(data, MazeArguments) == args and len(data) < len(pickle.dumps(args))
+    try:
+        loads(data, EnvironmentArguments)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('data of another argclass was decoded')
+
+
+
+def _learning_rate_arguments(default):
+    return argclass(type('LearningRateArguments', (), {'__annotations__': {'lr': float}, 'lr': default,
+                                                        '__module__': __name__}))
+
+
+
+def test_binary_encoding_keeps_values_under_changed_defaults():
+    from mltoolkit.serialization import dumps, loads
+    data = dumps(_learning_rate_arguments(0.1)(lr=0.1))
+    assert loads(data, _learning_rate_arguments(0.5)).lr == 0.1
+    changed_type = argclass(type('LearningRateArguments', (), {'__annotations__': {'lr': int}, 'lr': 1,
+                                                               '__module__': __name__}))
+    try:
+        loads(data, changed_type)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('data encoded against another schema was decoded')
+
+
+
+@argclass
+class DerivedEnvironmentArguments(EnvironmentArguments):
+    walls: int = field(default=3)
+
+
+
+def test_binary_encoding_of_nested_subclass():
+    from mltoolkit.serialization import dumps, loads
+    args = MazeArguments(env=DerivedEnvironmentArguments(walls=5, grid_size=9))
+    decoded = loads(dumps(args), MazeArguments)
+    assert type(decoded.env) is DerivedEnvironmentArguments and decoded.env == args.env, decoded.env
+
+
+
+@argclass
+class CountingArguments:
+    name: str = field(default='a')
+    _calls: List[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        self._calls.append(self.name)
+
+
+
+def test_binary_decoding_does_not_run_constructors():
+    from mltoolkit.serialization import dumps, loads
+    decoded = loads(dumps(CountingArguments(name='b')), CountingArguments)
+    # like unpickling, __post_init__ doesn't run again and private fields start from their defaults
+    assert decoded.name == 'b' and decoded._calls == [], decoded
+    slotted = SlottedArguments(name='x', seed=3)
+    assert loads(dumps(slotted), SlottedArguments) == slotted
+    frozen = FrozenEnvironmentArguments(grid_size=7)
+    decoded = loads(dumps(frozen), FrozenEnvironmentArguments)
+    assert decoded == frozen and hash(decoded) == hash(frozen), decoded
+
+
+
+_ARCHITECTURE = [{'Conv2d': {'args': [3, 8, 3], 'padding': 1}}, {'BatchNorm2d': {'args': [8]}}, {'ReLU': {}},
+                 {'Dropout': {}}, {'Flatten': {}}, {'Linear': {'args': [8 * 4 * 4, 2]}}]
+
+
+
+def test_meta_network_is_materialized_from_a_state_dict():
+    import torch
+    from mltoolkit.network_builder import build_network, estimate_network, materialize, network_size
+    network = build_network(_ARCHITECTURE)
+    meta = build_network(_ARCHITECTURE, device='meta')
+    assert all(parameter.is_meta for parameter in meta.parameters())
+    assert estimate_network(_ARCHITECTURE) == network_size(network)
+    state_dict = network.state_dict()
+    materialize(meta, state_dict)
+    assert meta[0].weight.data_ptr() == state_dict['0.weight'].data_ptr(), 'weights were copied'
+    x = torch.randn(2, 3, 4, 4)
+    assert torch.equal(meta.eval()(x), network.eval()(x))
+
+
+
+def test_materialize_initializes_tensors_missing_from_the_state_dict():
+    import torch
+    from mltoolkit.network_builder import Builder, build_network, materialize
+    architecture = [{'Linear': {'args': [4, 3]}}, {'ReLU': {}}]
+    weight = torch.ones(3, 4)
+    meta = build_network(architecture, device='meta')
+    torch.manual_seed(0)
+    materialize(meta, {'0.weight': weight}, strict=False)
+    torch.manual_seed(0)
+    # the partially loaded layer is reset like a new one and keeps its loaded weight
+    assert torch.equal(meta[0].bias, torch.nn.Linear(4, 3).bias) and meta[0].weight.data_ptr() == weight.data_ptr()
+    assert torch.equal(weight, torch.ones(3, 4)), 'the state dict was overwritten'
+
+    class Scale(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.scale = torch.nn.Parameter(torch.ones(3))
+
+    meta = build_network([{'Scale': {}}], builder=Builder({'Scale': Scale}), device='meta')
+    try:
+        materialize(meta, {}, strict=False)
+    except RuntimeError as e:
+        assert '0.scale' in str(e), e
+    else:
+        raise AssertionError('a tensor without a value was left uninitialized')
+
+
+
+def test_fused_network_matches_the_original():
+    import torch
+    from mltoolkit.network_builder import build_network
+    from mltoolkit.network_fusion import FusedActivation, check_fusion, fuse_network
+    expected_layers = [FusedActivation, torch.nn.Flatten, torch.nn.Linear]
+    assert [type(layer) for layer in build_network(_ARCHITECTURE, fuse=True)] == expected_layers
+    network = build_network(_ARCHITECTURE)
+    # batch norm statistics that aren't the identity
+    network[1].running_mean.uniform_(-1, 1)
+    network[1].running_var.uniform_(0.5, 2)
+    fused = fuse_network(network)
+    assert [type(layer) for layer in fused] == expected_layers
+    check_fusion(network, fused, torch.randn(2, 3, 4, 4))
+
+
+
+def test_compiled_networks_are_cached_by_architecture():
+    import os
+    import tempfile
+    import torch
+    from mltoolkit.network_builder import Builder, build_network
+    from mltoolkit.network_cache import architecture_key
+    architecture = [{'Linear': {'args': [4, 4]}}, {'ReLU': {}}]
+    with tempfile.TemporaryDirectory() as directory:
+        network = build_network(architecture, jit='script', cache_dir=directory)
+        assert isinstance(network, torch.jit.ScriptModule) and len(os.listdir(directory)) == 1
+        cached = build_network(architecture, jit='script', cache_dir=directory, reuse_weights=True)
+        x = torch.randn(2, 4)
+        assert torch.equal(cached(x), network(x)), 'the cached network was not loaded'
+        build_network(architecture, jit='trace', example_input=x, cache_dir=directory)
+        assert len(os.listdir(directory)) == 2
+        # without reuse_weights, cache hits are initialized like a fresh build
+        torch.manual_seed(1)
+        seeded = build_network(architecture, jit='script', cache_dir=directory)
+        torch.manual_seed(1)
+        assert torch.equal(seeded(x), build_network(architecture)(x))
+    builder = Builder(torch.nn.__dict__)
+    assert architecture_key(architecture, builder) == architecture_key([dict(block) for block in architecture], builder)
+    assert architecture_key(architecture, builder) != architecture_key(architecture[:1], builder)
+
+
+
+def test_checkpointed_network_matches_plain_gradients():
+    import torch
+    from mltoolkit.network_builder import build_network
+    architecture = [{'Linear': {'args': [4, 8]}}, {'checkpoint': [{'Tanh': {}}, {'Linear': {'args': [8, 8]}}]},
+                    {'Linear': {'args': [8, 2]}}]
+    checkpointed = build_network(architecture)
+    plain = build_network(architecture, checkpoint_segments=0)
+    plain.load_state_dict(checkpointed.state_dict())
+    assert checkpointed.segments == [(1, 3)] and type(plain) is torch.nn.Sequential
+    x = torch.randn(3, 4)
+    checkpointed(x).pow(2).sum().backward()
+    plain(x).pow(2).sum().backward()
+    for (name, parameter), expected in zip(checkpointed.named_parameters(), plain.parameters()):
+        assert torch.allclose(parameter.grad, expected.grad), name
+
+
+
+def test_activation_memory_keeps_batch_norm_statistics():
+    import torch
+    from mltoolkit.network_checkpointing import activation_memory
+    network = torch.nn.Sequential(torch.nn.Linear(4, 4), torch.nn.BatchNorm1d(4), torch.nn.Dropout())
+    network[2].eval()
+    state = {name: value.clone() for name, value in network.state_dict().items()}
+    memory = activation_memory(network, torch.randn(8, 4))
+    assert memory.layer_bytes == [8 * 4 * 4] * 3, memory
+    for name, value in network.state_dict().items():
+        assert torch.equal(value, state[name]), f'{name} changed'
+    assert [module.training for module in network.modules()] == [True, True, True, False]
+
+
+
+def test_checkpoint_segments_of_empty_network():
+    from mltoolkit.network_builder import build_network
+    from mltoolkit.network_checkpointing import even_segments
+    assert even_segments(0, 4) == []
+    assert even_segments(2, 4) == [(0, 1)]
+    assert len(build_network([], checkpoint_segments=2)) == 0
+
+
+
+def test_profiler_records_every_layer():
+    import torch
+    from mltoolkit.network_builder import build_network
+    from mltoolkit.network_profiler import profile_network
+    network = build_network(_ARCHITECTURE, profile=2)
+    x = torch.randn(2, 3, 4, 4)
+    for _ in range(4):
+        network(x)
+    stats = network.profiler.stats
+    assert [(layer.index, layer.name) for layer in stats][:2] == [('0', 'Conv2d'), ('1', 'BatchNorm2d')]
+    # every second forward pass is recorded
+    assert [layer.calls for layer in stats] == [2] * len(_ARCHITECTURE)
+    assert stats[0].output_shape == (2, 8, 4, 4) and stats[0].flops == 2 * 2 * 8 * 4 * 4 * 3 * 3 * 3
+    assert stats[-1].flops == 2 * 2 * 2 * 8 * 4 * 4 and 'Conv2d' in str(network.profiler)
+    network = build_network(_ARCHITECTURE)
+    profiler = profile_network(network, backward=True)
+    network(x.requires_grad_()).sum().backward()
+    assert [layer.backward_calls for layer in profiler.stats] == [1] * len(_ARCHITECTURE)
+
+
+
+def test_profiler_counts_checkpointed_layers_once():
+    import torch
+    from mltoolkit.network_builder import build_network
+    architecture = [{'Linear': {'args': [4, 8]}}, {'ReLU': {}}, {'Linear': {'args': [8, 8]}}, {'Linear': {'args': [8, 2]}}]
+    from mltoolkit.network_checkpointing import is_recomputing
+    network = build_network(architecture, checkpoint_segments=2, profile=True)
+    assert network.segments, 'the network is not checkpointed'
+    recomputing = []
+    network[0].register_forward_hook(lambda *_: recomputing.append(is_recomputing()))
+    network(torch.randn(3, 4)).sum().backward()
+    assert recomputing == [False, True] and not is_recomputing(), recomputing
+    assert [stats.calls for stats in network.profiler.stats] == [1] * 4
+    # allocated memory is only tracked on cuda
+    assert 'mem MB' not in str(network.profiler)
+
+
+
+def test_network_checkpoint_round_trip():
+    import os
+    import tempfile
+    import torch
+    from mltoolkit.network_builder import build_network
+    from mltoolkit.network_io import DATA_ALIGNMENT, TENSOR_ALIGNMENT, load_checkpoint, load_network, save_network
+    architecture = _ARCHITECTURE + [{'Linear': {'args': [2, 2]}}, {'Linear': {'args': [2, 2]}}]
+    network = build_network(architecture).eval()
+    # tied weights are stored once
+    network[7].weight = network[6].weight
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'network.mlt')
+        save_network(path, network, architecture)
+        loaded_architecture, state_dict = load_checkpoint(path)
+        assert loaded_architecture == architecture and state_dict.keys() == network.state_dict().keys()
+        offsets = {name: tensor.data_ptr() - state_dict['0.weight'].data_ptr() for name, tensor in state_dict.items()
+                   if tensor.numel()}
+        assert all(offset % TENSOR_ALIGNMENT == 0 for offset in offsets.values())
+        assert offsets['6.weight'] == offsets['7.weight']
+        assert state_dict['0.weight'].data_ptr() % DATA_ALIGNMENT == 0
+        loaded = load_network(path).eval()
+        x = torch.randn(2, 3, 4, 4)
+        assert torch.equal(loaded(x), network(x))
+        # tensors are writable without modifying the file
+        loaded[0].weight.data.zero_()
+        assert torch.equal(load_checkpoint(path)[1]['0.weight'], network[0].weight)
+
+
+
+def test_benchmark_baselines_flag_regressions():
+    import json
+    import os
+    import subprocess
+    import sys
+    import tempfile
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks.py')
+    with tempfile.TemporaryDirectory() as directory:
+        baseline = os.path.join(directory, 'baseline.json')
+        subprocess.run([sys.executable, script, 'binary_size', '--save', baseline], check=True,
+                       stdout=subprocess.DEVNULL)
+        compare = [sys.executable, script, 'binary_size', '--compare', baseline]
+        assert subprocess.run(compare, stdout=subprocess.DEVNULL).returncode == 0
+        with open(baseline) as f:
+            results = json.load(f)
+        results['results']['bytes']['binary_size/dumps'] //= 2
+        with open(baseline, 'w') as f:
+            json.dump(results, f)
+        process = subprocess.run(compare, stdout=subprocess.PIPE, universal_newlines=True)
+        assert process.returncode == 1 and 'REGRESSION' in process.stdout, process.stdout
+
+
+
+class _StubArtifact:
+    """
+    a logged wandb artifact, as returned by `run.use_artifact`
+    """
+
+    def __init__(self, name, type, digest=None, files=None):
+        self.name, self.type, self.digest, self._files = name, type, digest, files or {}
+
+    def download(self, root=None):
+        import os
+        os.makedirs(root, exist_ok=True)
+        for name, contents in self._files.items():
+            with open(os.path.join(root, name), 'w') as f:
+                f.write(contents)
+        return root
+
+
+
+def _stub_run(downloads):
+    import types
+
+    def use_artifact(path, type):
+        downloads.append(path)
+        return _StubArtifact(path, type, digest='digest-v1', files={'train.txt': 'maze'})
+    return types.SimpleNamespace(use_artifact=use_artifact)
+
+
+
+def test_download_dataset_reuses_cached_versions():
+    import os
+    import stat
+    import tempfile
+    from mltoolkit.arguments import DataUseArguments, WandBArguments
+    from mltoolkit.artifact_cache import ArtifactCache
+    from mltoolkit.util import download_dataset
+    dataset = DataUseArguments(name='maze', version='v1')
+    with tempfile.TemporaryDirectory() as directory:
+        cache_dir = os.path.join(directory, 'cache')
+        wandb_args = WandBArguments(workspace='team', project='maze', _run=_stub_run([]))
+        first, second = [download_dataset(dataset, wandb_args, cache_dir=cache_dir,
+                                          run_dir=os.path.join(directory, run)) for run in ('first', 'second')]
+        # both runs link the files of one download, which can't be modified through them
+        assert os.path.samefile(os.path.join(first, 'train.txt'), os.path.join(second, 'train.txt'))
+        assert not stat.S_IMODE(os.stat(os.path.join(first, 'train.txt')).st_mode) & 0o222
+        cache = ArtifactCache(cache_dir)
+        assert [(entry.artifact_path, entry.digest, entry.size) for entry in cache.entries()] == \
+               [('maze:v1', 'digest-v1', 4)]
+        assert len(cache.evict(max_size=0)) == 1 and not cache.entries()
+        with open(os.path.join(first, 'train.txt')) as f:
+            assert f.read() == 'maze'
+
+
+
+def test_download_dataset_without_cache_does_not_import_artifact_cache():
+    import os
+    import sys
+    import tempfile
+    from mltoolkit.arguments import DataUseArguments, WandBArguments
+    from mltoolkit.util import ARTIFACT_CACHE_ENV, download_dataset
+    artifact_cache = sys.modules.pop('mltoolkit.artifact_cache', None)
+    cache_dir = os.environ.pop(ARTIFACT_CACHE_ENV, None)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            downloads = []
+            path = download_dataset(DataUseArguments(name='maze', version='v1'),
+                                    WandBArguments(workspace='team', project='maze', _run=_stub_run(downloads)),
+                                    run_dir=directory)
+            assert downloads == ['team/maze/maze:v1'] and os.listdir(path) == ['train.txt']
+        assert 'mltoolkit.artifact_cache' not in sys.modules
+    finally:
+        if artifact_cache is not None:
+            sys.modules['mltoolkit.artifact_cache'] = artifact_cache
+        if cache_dir is not None:
+            os.environ[ARTIFACT_CACHE_ENV] = cache_dir
+
+
+
+def test_download_dataset_offline_and_pinned_entries():
+    import os
+    import tempfile
+    from mltoolkit.arguments import DataUseArguments, WandBArguments
+    from mltoolkit.artifact_cache import ArtifactCache
+    from mltoolkit.util import download_dataset
+    dataset = DataUseArguments(name='maze', version='v1')
+    with tempfile.TemporaryDirectory() as directory:
+        cache_dir = os.path.join(directory, 'cache')
+        downloads = []
+        path = download_dataset(dataset, WandBArguments(workspace='team', project='maze', _run=_stub_run(downloads)),
+                                cache_dir=cache_dir)
+        # offline, without a wandb run
+        assert download_dataset(dataset, WandBArguments(), cache_dir=cache_dir, offline=True) == path
+        assert len(downloads) == 1
+        with open(os.path.join(path, 'train.txt')) as f:
+            assert f.read() == 'maze'
+
+        # another cache user can't evict the entry this process uses in place
+        cache = ArtifactCache(cache_dir)
+        assert cache.evict(max_size=0) == [] and os.path.isdir(path)
+        run_dir = download_dataset(dataset, WandBArguments(), cache_dir=cache_dir, offline=True,
+                                   run_dir=os.path.join(directory, 'run'), link='copy')
+        assert os.listdir(run_dir) == ['train.txt']
+        cache.unpin(path)
+        assert [entry.path for entry in cache.evict(max_size=0)] == [path] and not os.path.exists(path)
+        try:
+            download_dataset(dataset, WandBArguments(), cache_dir=cache_dir, offline=True)
+        except FileNotFoundError:
+            pass
+        else:
+            raise AssertionError('evicted dataset was found offline')
+
+
+
+def test_manifest_rehashes_only_changed_files():
+    import os
+    import tempfile
+    from mltoolkit.dataset_manifest import Manifest, build_manifest, diff_manifests
+    with tempfile.TemporaryDirectory() as directory:
+        root, cache = os.path.join(directory, 'data'), os.path.join(directory, 'digests.db')
+        os.makedirs(os.path.join(root, 'nested'))
+        for name in ('a', 'b', os.path.join('nested', 'c')):
+            _write_config(os.path.join(root, name), name[-1], mtime_ns=10 ** 18)
+        first = build_manifest(root, cache_path=cache)
+        assert first.hashed == 3 and first.size == 3
+        assert build_manifest(root, cache_path=cache).hashed == 0
+        _write_config(os.path.join(root, 'a'), 'changed', mtime_ns=10 ** 18 + 1)
+        os.remove(os.path.join(root, 'b'))
+        _write_config(os.path.join(root, 'd'), 'd')
+        second = build_manifest(root, cache_path=cache, workers=2)
+        assert second.hashed == 2 and second.digest != first.digest
+        path = first.save(os.path.join(directory, 'manifest.json'))
+        assert Manifest.load(path) == first
+        diff = diff_manifests(path, second)
+        assert (diff.added, diff.removed, diff.changed) == (['d'], ['b'], ['a'])
+        assert not diff_manifests(second, build_manifest(root, cache_path=False))
+
+
+
+def test_log_dataset_reference_versions_follow_the_contents():
+    import os
+    import tempfile
+    from mltoolkit.arguments import DataUseArguments, WandBArguments
+    from mltoolkit.util import log_dataset_reference
+    mode = os.environ.get('WANDB_MODE')
+    os.environ['WANDB_MODE'] = 'disabled'
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            dataset = DataUseArguments(name='maze', version='v1', split='train', root=directory)
+            os.makedirs(os.path.join(dataset.file_uri, 'levels'))
+            for name, data in [('a.txt', 'a'), (os.path.join('levels', 'b.txt'), 'bb')]:
+                with open(os.path.join(dataset.file_uri, name), 'w') as f:
+                    f.write(data)
+            first = log_dataset_reference(dataset, WandBArguments(), digest_cache=False)
+            assert sorted(first.manifest.entries) == ['a.txt', 'levels/b.txt', 'manifest.json']
+            entry = first.manifest.entries['levels/b.txt']
+            assert entry.ref == f'file://{os.path.join(dataset.file_uri, "levels", "b.txt")}' and entry.size == 2
+            assert log_dataset_reference(dataset, WandBArguments(), digest_cache=False).digest == first.digest
+            # the files are referenced by path; the attached manifest changes the version with their contents
+            with open(os.path.join(dataset.file_uri, 'a.txt'), 'w') as f:
+                f.write('c')
+            assert log_dataset_reference(dataset, WandBArguments(), digest_cache=False).digest != first.digest
+            try:
+                log_dataset_reference(dataset, WandBArguments(), max_objects=1, digest_cache=False)
+            except ValueError as e:
+                assert 'max_objects=1' in str(e), e
+            else:
+                raise AssertionError('max_objects was not enforced')
+    finally:
+        if mode is None:
+            os.environ.pop('WANDB_MODE')
+        else:
+            os.environ['WANDB_MODE'] = mode
+
+
+
+def test_manifest_skips_directory_symlinks():
+    import os
+    import tempfile
+    from mltoolkit.dataset_manifest import build_manifest
+    with tempfile.TemporaryDirectory() as root:
+        os.makedirs(os.path.join(root, 'levels'))
+        _write_config(os.path.join(root, 'levels', 'a'), 'a')
+        os.symlink(os.path.join(root, 'levels', 'a'), os.path.join(root, 'b'))
+        # a link cycle
+        os.symlink(root, os.path.join(root, 'levels', 'loop'))
+        manifest = build_manifest(root, cache_path=False)
+        assert sorted(manifest.files) == ['b', os.path.join('levels', 'a')], manifest.files
+
+
+
 def main():
     args = parse_args(MazeArguments)
     import pickle
     pickle.loads(pickle.dumps(args))
     print(asdict(args))
 
-
+    tests = [test for name, test in globals().items() if name.startswith('test_')]
+    for test in tests:
+        test()
+    print(f'{len(tests)} tests passed')
 
 
 main()